@@ -0,0 +1,73 @@
+"""
+Спільне для бенчмарків: тимчасова БД та синтетичні дані
+prepare() треба викликати до імпорту config/db - шлях до БД береться з DATABASE_PATH
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def prepare(name: str) -> str:
+    """Окрема тимчасова БД для бенчмарку; повертає шлях до неї"""
+    directory = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    os.environ["DATABASE_PATH"] = os.path.join(directory, "bench.db")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return os.environ["DATABASE_PATH"]
+
+def _timestamp(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def fill_users(path: str, count: int, days: int = 365, seed: int = 1):
+    """count користувачів з датами приєднання та активності за останні days днів"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+
+    def rows():
+        for user_id in range(1, count + 1):
+            joined = now - timedelta(seconds=rng.randrange(days * 86400))
+            active = joined + (now - joined) * rng.random()
+            yield user_id, f"user{user_id}", _timestamp(joined), _timestamp(active)
+
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (id, username, joined_at, last_activity) VALUES (?, ?, ?, ?)", rows()
+    )
+    conn.commit()
+    conn.close()
+
+def fill_purchases(path: str, count: int, users: int, courses: int = 5, seed: int = 2):
+    """count покупок випадкових користувачів (70% завершених)"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT OR IGNORE INTO courses (id, zenedu_id, title, price_uah) VALUES (?, ?, ?, ?)",
+        [(i, f"z{i}", f"Курс {i}", 1000 * i) for i in range(1, courses + 1)]
+    )
+    conn.executemany(
+        """INSERT INTO purchases (user_id, course_id, ts, payment_status, amount)
+           VALUES (?, ?, ?, ?, ?)""",
+        (
+            (rng.randint(1, users), rng.randint(1, courses),
+             _timestamp(now - timedelta(seconds=rng.randrange(365 * 86400))),
+             "completed" if rng.random() < 0.7 else "pending", rng.choice((1000, 2000, 5000)))
+            for _ in range(count)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+async def per_call_us(call: Callable[[int], Awaitable], calls: int) -> float:
+    """Середній час виклику call(i), мкс"""
+    started = time.perf_counter()
+    for i in range(calls):
+        await call(i)
+    return (time.perf_counter() - started) / calls * 1e6
@@ -0,0 +1,105 @@
+"""
+Екран аналітики адміна на синтетичній БД (user-005)
+
+    python bench/dashboard.py [--users 1000000] [--purchases 50000] [--runs 3]
+
+Порівнюються: дев'ять окремих запитів-хелперів, як було в admin_analytics_handler;
+один прохід з умовними агрегатами (перша версія get_dashboard_snapshot); поточний
+get_dashboard_snapshot з денних агрегатів metrics_rollup. Перші два мають давати
+однакові числа (поточний рахує вікна в календарних днях, тож може відрізнятися)
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from _common import prepare, fill_users, fill_purchases
+
+def _threshold(days: int) -> str:
+    return (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+async def _scalar(sql: str, params=()) -> int:
+    import db
+    async with db._reader() as conn:
+        async with conn.execute(sql, params) as cursor:
+            return (await cursor.fetchone())[0] or 0
+
+async def nine_helpers():
+    """Хелпери в порядку виклику admin_analytics_handler (взаємодії рахують активних ще раз)"""
+    new_users = "SELECT COUNT(*) FROM users WHERE joined_at >= ?"
+    active_users = "SELECT COUNT(*) FROM users WHERE last_activity >= ?"
+    return (
+        await _scalar("SELECT COUNT(*) FROM users"),
+        await _scalar(new_users, (_threshold(1),)),
+        await _scalar(new_users, (_threshold(7),)),
+        await _scalar(new_users, (_threshold(30),)),
+        await _scalar(active_users, (_threshold(1),)),
+        await _scalar(active_users, (_threshold(7),)),
+        await _scalar("SELECT COUNT(*) FROM purchases"),
+        await _scalar("SELECT COUNT(DISTINCT user_id) FROM purchases"),
+        await _scalar(active_users, (_threshold(7),)),
+    )[:8]
+
+async def single_pass():
+    """Один прохід по users з умовними SUM та один запит по purchases"""
+    import db
+    async with db._reader() as conn:
+        async with conn.execute("SELECT COUNT(*) FROM users") as cursor:
+            users_count = (await cursor.fetchone())[0]
+        async with conn.execute(
+            """
+            SELECT SUM(joined_at >= :day), SUM(joined_at >= :week), SUM(joined_at >= :month),
+                   SUM(last_activity >= :day), SUM(last_activity >= :week)
+            FROM users
+            WHERE joined_at >= :month OR last_activity >= :week
+            """,
+            {"day": _threshold(1), "week": _threshold(7), "month": _threshold(30)}
+        ) as cursor:
+            users_row = await cursor.fetchone()
+        async with conn.execute("SELECT COUNT(*), COUNT(DISTINCT user_id) FROM purchases") as cursor:
+            purchases_row = await cursor.fetchone()
+    return (users_count, *(value or 0 for value in users_row), *purchases_row)
+
+async def rollup():
+    import db
+    snapshot = await db.get_dashboard_snapshot()
+    return (snapshot.users_count, snapshot.new_users_day, snapshot.new_users_week,
+            snapshot.new_users_month, snapshot.active_day, snapshot.active_week,
+            snapshot.course_purchases, snapshot.users_with_purchases)
+
+async def measure(call, runs: int):
+    """(середній час, мс; результат)"""
+    result = await call()  # прогрів кешу сторінок
+    started = time.perf_counter()
+    for _ in range(runs):
+        result = await call()
+    return (time.perf_counter() - started) / runs * 1000, result
+
+async def main(users: int, purchases: int, runs: int):
+    path = prepare("dashboard")
+    import db
+
+    await db.init_db()
+    started = time.perf_counter()
+    fill_users(path, users)
+    fill_purchases(path, purchases, users)
+    await db.rebuild_metrics_rollup()
+    print(f"{users} користувачів, {purchases} покупок (генерація {time.perf_counter() - started:.1f} с), "
+          f"середнє з {runs} запусків")
+    try:
+        results = {}
+        for name, call in (("9 helpers", nine_helpers), ("snapshot", single_pass), ("rollup", rollup)):
+            elapsed, results[name] = await measure(call, runs)
+            print(f"  {name:10} {elapsed:8.1f} мс  {results[name]}")
+        print(f"  9 helpers == snapshot: {results['9 helpers'] == results['snapshot']}")
+    finally:
+        await db.close_db()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--purchases", type=int, default=50_000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.purchases, args.runs))
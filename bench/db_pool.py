@@ -0,0 +1,85 @@
+"""
+Затримка виклику db.py: з'єднання на кожен виклик проти пулу з'єднань (user-001)
+
+    python bench/db_pool.py [--users 200] [--calls 500]
+
+"до" - той самий SQL через aiosqlite.connect() на кожен виклик, як було до пулу;
+"пул" - той самий SQL через ConnectionPool з db.py;
+"db.py" - поточні функції (update_user_activity тепер лише позначає користувача
+в activity_buffer, тож його запис окремо не вимірюється)
+"""
+
+import argparse
+import asyncio
+
+from _common import prepare, fill_users, per_call_us
+
+GET_USER = "SELECT * FROM users WHERE id = ?"
+UPDATE_ACTIVITY = "UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE id = ?"
+CHECK_ACCESS = """SELECT is_active FROM user_course_access
+                  WHERE user_id = ? AND course_id = ? AND
+                  (access_expires_at IS NULL OR access_expires_at > CURRENT_TIMESTAMP)"""
+GET_COURSES = "SELECT * FROM courses WHERE is_active = TRUE ORDER BY created_at DESC"
+
+async def main(users: int, calls: int):
+    path = prepare("db-pool")
+    import aiosqlite
+    import db
+
+    await db.init_db()
+    fill_users(path, users)
+    for course in range(1, 6):
+        await db.add_course(f"z{course}", f"Курс {course}", 1000 * course)
+    for user_id in range(1, users + 1, 2):
+        await db.grant_course_access(user_id, user_id % 5 + 1)
+
+    def user(i: int) -> int:
+        return i % users + 1
+
+    async def connect_read(sql, params):
+        async with aiosqlite.connect(path) as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def connect_write(sql, params):
+        async with aiosqlite.connect(path) as conn:
+            await conn.execute(sql, params)
+            await conn.commit()
+
+    async def pool_read(sql, params):
+        async with db._reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def pool_write(sql, params):
+        async with db._writer() as conn:
+            await conn.execute(sql, params)
+            await conn.commit()
+
+    # (функція, SQL, параметри для i-го виклику, запис?, поточна функція db.py)
+    cases = [
+        ("get_user", GET_USER, lambda i: (user(i),), False, lambda i: db.get_user(user(i))),
+        ("update_user_activity", UPDATE_ACTIVITY, lambda i: (user(i),), True, None),
+        ("check_course_access", CHECK_ACCESS, lambda i: (user(i), user(i) % 5 + 1), False,
+         lambda i: db.check_course_access(user(i), user(i) % 5 + 1)),
+        ("get_courses", GET_COURSES, lambda i: (), False, lambda i: db.get_courses()),
+    ]
+    print(f"{users} користувачів, {calls} викликів, мкс/виклик")
+    print(f"  {'функція':22} {'до':>8} {'пул':>8} {'db.py':>8}")
+    try:
+        for name, sql, params, write, current in cases:
+            connect_call = connect_write if write else connect_read
+            pool_call = pool_write if write else pool_read
+            before = await per_call_us(lambda i: connect_call(sql, params(i)), calls)
+            pooled = await per_call_us(lambda i: pool_call(sql, params(i)), calls)
+            now = f"{await per_call_us(current, calls):8.0f}" if current else f"{'-':>8}"
+            print(f"  {name:22} {before:8.0f} {pooled:8.0f} {now}")
+    finally:
+        await db.close_db()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--calls", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.calls))
@@ -0,0 +1,78 @@
+"""
+Пропускна здатність при одночасному записі та читанні для кожного профілю
+DB_STORAGE_PROFILES (user-002)
+
+    python bench/storage_profiles.py [--users 5000] [--readers 4] [--seconds 3]
+
+Один writer оновлює last_activity випадкових користувачів (commit на кожен запис),
+readers паралельно читають користувачів за id; кожен профіль - на новому файлі БД
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import time
+
+from _common import prepare, fill_users
+
+async def run_profile(path: str, profile: str, users: int, readers: int, seconds: float):
+    import db
+
+    conn = sqlite3.connect(path)
+    for sql in db.CREATE_TABLES_SQL:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+    fill_users(path, users)
+
+    pool = db.ConnectionPool(path, readers=readers, profile=profile)
+    await pool.open()
+    deadline = time.monotonic() + seconds
+    counts = {"writes": 0, "reads": 0}
+
+    async def writer():
+        rng = random.Random(1)
+        while time.monotonic() < deadline:
+            async with pool.writer() as conn:
+                await conn.execute(
+                    "UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE id = ?",
+                    (rng.randint(1, users),)
+                )
+                await conn.commit()
+            counts["writes"] += 1
+
+    async def reader(seed: int):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            async with pool.reader() as conn:
+                async with conn.execute(
+                    "SELECT * FROM users WHERE id = ?", (rng.randint(1, users),)
+                ) as cursor:
+                    await cursor.fetchone()
+            counts["reads"] += 1
+
+    try:
+        await asyncio.gather(writer(), *(reader(seed) for seed in range(readers)))
+    finally:
+        await pool.close()
+    return counts["writes"] / seconds, counts["reads"] / seconds
+
+async def main(users: int, readers: int, seconds: float):
+    base = prepare("storage-profiles")
+    from config import DB_STORAGE_PROFILES
+
+    print(f"{users} користувачів, 1 writer + {readers} readers, {seconds:g} с на профіль")
+    for profile in DB_STORAGE_PROFILES:
+        path = os.path.join(os.path.dirname(base), f"{profile}.db")
+        writes, reads = await run_profile(path, profile, users, readers, seconds)
+        print(f"  {profile:12} writes/s {writes:6.0f}  reads/s {reads:6.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.readers, args.seconds))
@@ -75,10 +75,80 @@ if not ZENEDU_API_KEY or ZENEDU_API_KEY == 'your_zenedu_api_key_here':
 
 # Database configuration
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'bot_database.db')
+DB_POOL_READERS = int(os.getenv('DB_POOL_READERS', 4))  # з'єднань для читання в пулі
+
+# Профілі зберігання SQLite (PRAGMA застосовуються до кожного з'єднання пулу)
+# auto_vacuum має йти першим: для нової БД він діє лише до переходу в WAL та створення таблиць
+DB_STORAGE_PROFILES = {
+    # Класичний rollback journal: запис блокує всіх читачів
+    'default': {
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+    # WAL: читачі не блокуються записом, fsync тільки на checkpoint
+    'wal': {
+        'auto_vacuum': 'INCREMENTAL',  # вільні сторінки повертаються через PRAGMA incremental_vacuum
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,  # 256 МБ
+        'cache_size': -16000,  # ~16 МБ (від'ємне значення - в КБ)
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,  # мс
+    },
+    # WAL з fsync на кожен commit (повільніше, але без втрати останніх транзакцій)
+    'wal_durable': {
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'mmap_size': 268435456,
+        'cache_size': -16000,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+DB_STORAGE_PROFILE = os.getenv('DB_STORAGE_PROFILE', 'wal')
+if DB_STORAGE_PROFILE not in DB_STORAGE_PROFILES:
+    print(f"⚠️ Невідомий DB_STORAGE_PROFILE '{DB_STORAGE_PROFILE}', використовується 'wal'")
+    DB_STORAGE_PROFILE = 'wal'
+
+# Відкладений запис активності користувачів
+ACTIVITY_FLUSH_INTERVAL = 5  # секунд між записами буфера активності
+ACTIVITY_FLUSH_SIZE = 500  # записати раніше, якщо накопичилось стільки користувачів
+
+# Кеш відомих користувачів (пропускає зайві INSERT в add_user)
+KNOWN_USERS_CACHE_SIZE = int(os.getenv('KNOWN_USERS_CACHE_SIZE', 50000))
+
+# Часовий пояс розкладу розсилок (дата/час від адміна вводяться в ньому)
+TIMEZONE = os.getenv('TIMEZONE', 'Europe/Kyiv')
 
 # Broadcast settings
 BROADCAST_DELAY = 0.034  # 30 msg/sec максимум
+BROADCAST_BURST = int(os.getenv('BROADCAST_BURST', 1))  # Місткість token bucket (повідомлень понад темп)
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 10))  # Одночасних запитів до Bot API
+BROADCAST_LOG_FLUSH_INTERVAL = 2  # секунд між записами результатів доставки в broadcast_log
+BROADCAST_LOG_BATCH_SIZE = int(os.getenv('BROADCAST_LOG_BATCH_SIZE', 500))  # результатів в одній транзакції
+BROADCAST_LOG_QUEUE_SIZE = 5000  # ліміт черги; при заповненні відправка чекає на запис
+BROADCAST_ALBUM_DELAY = 1.0  # секунд очікування решти частин альбому від адміна
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', 5))  # секунд між оновленнями прогресу в повідомленні адміна
+
+# Розсилка кількома процесами (шарди за user_id); 1 - в процесі бота
+BROADCAST_PROCESSES = int(os.getenv('BROADCAST_PROCESSES', 1))
+# Спільний для процесів ліміт темпу: файл SQLite з часом наступного вільного слота
+BROADCAST_RATE_DB = os.getenv('BROADCAST_RATE_DB', f"{DATABASE_PATH}.rate")
+BROADCAST_RATE_LEASE = 5  # слотів, які процес бере за одне звернення до спільного ліміту
+
+# Зберігання журналу розсилок: старі рядки broadcast_log переносяться в стиснені архіви
+BROADCAST_LOG_RETENTION_DAYS = int(os.getenv('BROADCAST_LOG_RETENTION_DAYS', 30))  # днів після завершення розсилки
+BROADCAST_LOG_MAX_ROWS = int(os.getenv('BROADCAST_LOG_MAX_ROWS', 1000000))  # ліміт рядків у broadcast_log
+BROADCAST_ARCHIVE_DIR = os.getenv('BROADCAST_ARCHIVE_DIR', 'archive')
+BROADCAST_ARCHIVE_RETENTION_DAYS = int(os.getenv('BROADCAST_ARCHIVE_RETENTION_DAYS', 365))  # 0 - зберігати архіви завжди
+BROADCAST_RETENTION_CRON = os.getenv('BROADCAST_RETENTION_CRON', '30 4 * * *')  # щоночі о 04:30
 MAX_RETRIES = 3
+BROADCAST_MAX_FLOOD_WAITS = int(os.getenv('BROADCAST_MAX_FLOOD_WAITS', 5))  # пауз flood control на одного одержувача, після яких він позначається failed
+RETRY_BACKOFF_BASE = 1.0  # Базова затримка повтору при мережевих помилках, с
+RETRY_BACKOFF_MAX = 30.0  # Максимальна затримка повтору, с
 
 # Company links
 COMPANY_LINKS = {
@@ -114,6 +184,13 @@ SERVICES = {
     }
 }
 
+# Назви сегментів аудиторії розсилки (ключ - audience_type в БД)
+AUDIENCE_NAMES = {
+    'all': '👥 Усі користувачі',
+    'buyers': '💰 Покупці курсів',
+    'inactive': '😴 Неактивні 7+ днів'
+}
+
 # Callback data prefixes (до 64 символів)
 CALLBACK_PREFIXES = {
     'service': 'srv:',
@@ -130,6 +207,15 @@ MAX_MESSAGE_LENGTH = 4096
 SESSION_TIMEOUT = 3600  # 1 година
 CACHE_TTL = 1800  # 30 хвилин
 
+# Обробка апдейтів webhook: відповідь Telegram одразу, окрема послідовна черга на кожен чат
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 8))  # апдейтів різних чатів, що обробляються одночасно
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', 1000))  # сумарна ємність черг
+UPDATE_LANE_SIZE = 100  # ліміт черги одного чату
+UPDATE_LANE_IDLE = 60.0  # с простою, після яких черга чату прибирається
+UPDATE_DEDUP_WINDOW = 4096  # останніх update_id, повторна доставка яких пропускається
+UPDATE_ENQUEUE_TIMEOUT = 2.0  # с очікування місця в черзі, далі 503 (Telegram повторить доставку)
+UPDATE_SLOW_THRESHOLD = float(os.getenv('UPDATE_SLOW_THRESHOLD', 1.0))  # с; повільніші апдейти пишуться в лог (0 - вимкнено)
+
 # Environment configuration для Render
 ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')  # production або development
 
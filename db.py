@@ -4,10 +4,20 @@
 
 import aiosqlite
 import asyncio
+import json
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
-from config import DATABASE_PATH
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional, Any, AsyncIterator, Awaitable, Callable
+from config import (
+    DATABASE_PATH, DB_POOL_READERS, DB_STORAGE_PROFILES, DB_STORAGE_PROFILE,
+    ACTIVITY_FLUSH_INTERVAL, ACTIVITY_FLUSH_SIZE, KNOWN_USERS_CACHE_SIZE,
+    BROADCAST_LOG_FLUSH_INTERVAL, BROADCAST_LOG_BATCH_SIZE, BROADCAST_LOG_QUEUE_SIZE,
+    MAX_RETRIES, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX
+)
+from services.metrics import db_timed
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +55,7 @@ CREATE_TABLES_SQL = [
         payment_status TEXT DEFAULT 'pending',
         monobank_payment_id TEXT,
         amount INTEGER,
+        completed_at TIMESTAMP,
         FOREIGN KEY (user_id) REFERENCES users (id),
         FOREIGN KEY (course_id) REFERENCES courses (id)
     )
@@ -56,6 +67,7 @@ CREATE_TABLES_SQL = [
         title TEXT NOT NULL,
         message TEXT NOT NULL,
         media_file_id TEXT,
+        media TEXT,
         target_segment TEXT DEFAULT 'all',
         scheduled_time TIMESTAMP,
         status TEXT DEFAULT 'draft',
@@ -73,6 +85,7 @@ CREATE_TABLES_SQL = [
         user_id INTEGER,
         status TEXT,
         error_message TEXT,
+        latency_ms INTEGER,
         sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (broadcast_id) REFERENCES broadcasts (id),
         FOREIGN KEY (user_id) REFERENCES users (id)
@@ -101,31 +114,560 @@ CREATE_TABLES_SQL = [
         audience_type TEXT DEFAULT 'all',
         recurring_type TEXT NOT NULL,
         cron_expression TEXT,
+        media TEXT,
         status TEXT DEFAULT 'active',
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         last_run TIMESTAMP,
         next_run TIMESTAMP,
         FOREIGN KEY (admin_id) REFERENCES users (id)
     )
+    """,
+    
+    # Денні агрегати для аналітики (день в UTC, оновлюються інкрементально).
+    # active_users - кількість користувачів, чия ОСТАННЯ активність припадає на цей день,
+    # тому сума за N днів дає точну кількість унікальних активних за N днів
+    """
+    CREATE TABLE IF NOT EXISTS metrics_rollup (
+        day TEXT PRIMARY KEY,
+        new_users INTEGER NOT NULL DEFAULT 0,
+        active_users INTEGER NOT NULL DEFAULT 0,
+        purchases INTEGER NOT NULL DEFAULT 0,
+        completed_purchases INTEGER NOT NULL DEFAULT 0,
+        revenue INTEGER NOT NULL DEFAULT 0,
+        new_buyers INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    
+    # Підсумки завершених розсилок (рахуються один раз з broadcast_log при завершенні).
+    # error_classes - JSON {статус: кількість}, top_errors - JSON [[текст помилки, кількість]]
+    """
+    CREATE TABLE IF NOT EXISTS broadcast_stats (
+        broadcast_id INTEGER PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        error_classes TEXT,
+        top_errors TEXT,
+        latency_count INTEGER NOT NULL DEFAULT 0,
+        latency_sum_ms INTEGER NOT NULL DEFAULT 0,
+        median_latency_ms INTEGER,
+        p95_latency_ms INTEGER,
+        elapsed_seconds REAL,
+        completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        archived_at TIMESTAMP,
+        archive_paths TEXT,
+        FOREIGN KEY (broadcast_id) REFERENCES broadcasts (id)
+    )
+    """,
+    
+    # Кількість недоставлених повідомлень за статусом для кожної розсилки (копія error_classes
+    # рядками), щоб загальна розбивка рахувалась GROUP BY без розбору JSON усіх розсилок
+    """
+    CREATE TABLE IF NOT EXISTS broadcast_error_classes (
+        broadcast_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (broadcast_id, status),
+        FOREIGN KEY (broadcast_id) REFERENCES broadcast_stats (broadcast_id)
+    )
     """
 ]
 
+# Колонки, додані після створення таблиць (CREATE TABLE IF NOT EXISTS не змінює існуючі БД)
+ADDED_COLUMNS = [
+    # Медіа розсилки в JSON: оригінальне повідомлення адміна та file_id файлів
+    ("broadcasts", "media", "TEXT"),
+    ("recurring_broadcasts", "media", "TEXT"),
+    # Тривалість запиту до Bot API при доставці (для статистики розсилок)
+    ("broadcast_log", "latency_ms", "INTEGER"),
+    # Час завершення оплати - день, в який покупка враховується в дохід
+    ("purchases", "completed_at", "TIMESTAMP"),
+    # Журнал розсилки перенесено в архів (archive_paths - JSON список файлів-частин)
+    ("broadcast_stats", "archived_at", "TIMESTAMP"),
+    ("broadcast_stats", "archive_paths", "TEXT"),
+]
+
 # Індекси для оптимізації
 CREATE_INDEXES_SQL = [
     "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)",
     "CREATE INDEX IF NOT EXISTS idx_purchases_user_id ON purchases(user_id)",
     "CREATE INDEX IF NOT EXISTS idx_purchases_course_id ON purchases(course_id)",
     "CREATE INDEX IF NOT EXISTS idx_broadcast_log_broadcast_id ON broadcast_log(broadcast_id)",
-    "CREATE INDEX IF NOT EXISTS idx_user_course_access_user_id ON user_course_access(user_id)"
+    # Вибірка наступних одержувачів розсилки та підрахунок прогресу
+    "CREATE INDEX IF NOT EXISTS idx_broadcast_log_status ON broadcast_log(broadcast_id, status)",
+    # Завантаження розкладу планувальником (найближчі запуски першими)
+    "CREATE INDEX IF NOT EXISTS idx_broadcasts_status_scheduled ON broadcasts(status, scheduled_time)",
+    "CREATE INDEX IF NOT EXISTS idx_recurring_broadcasts_next_run ON recurring_broadcasts(status, next_run)",
+    "CREATE INDEX IF NOT EXISTS idx_user_course_access_user_id ON user_course_access(user_id)",
+    # Індекси для keyset-пагінації списків в адмінці
+    "CREATE INDEX IF NOT EXISTS idx_users_joined_at_id ON users(joined_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_purchases_ts_id ON purchases(ts, id)",
+    # Регістронезалежний індекс для точного та префіксного пошуку за username
+    "CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users(username COLLATE NOCASE)"
 ]
 
+# Повнотекстовий індекс (FTS5, trigram) по username для пошуку підрядків.
+# External content: текст береться з users, індекс синхронізується тригерами
+CREATE_SEARCH_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        username, content='users', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+        INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+    END
+    """
+]
+
+# Мінімальна довжина запиту для trigram-індексу
+FTS_MIN_QUERY_LENGTH = 3
+
+class ConnectionPool:
+    """
+    Пул постійних з'єднань aiosqlite
+    Одне з'єднання для запису (доступ серіалізується lock'ом) та N з'єднань для читання
+    """
+
+    def __init__(self, path: str, readers: int = DB_POOL_READERS,
+                 profile: str = DB_STORAGE_PROFILE):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self.profile = profile
+        self.pragmas = DB_STORAGE_PROFILES[profile]
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._connections: List[aiosqlite.Connection] = []
+
+    async def _connect(self) -> aiosqlite.Connection:
+        """Відкрити нове з'єднання з БД та застосувати профіль зберігання"""
+        conn = await aiosqlite.connect(self.path)
+        self._connections.append(conn)
+        for name, value in self.pragmas.items():
+            await conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    async def open(self):
+        """Відкрити всі з'єднання пулу"""
+        self._writer = await self._connect()
+        for _ in range(self.readers_count):
+            self._readers.put_nowait(await self._connect())
+        logger.info(
+            f"Пул з'єднань БД відкрито (1 writer, {self.readers_count} readers, "
+            f"профіль '{self.profile}')"
+        )
+
+    async def close(self):
+        """Закрити всі з'єднання пулу"""
+        async with self._writer_lock:
+            for conn in self._connections:
+                try:
+                    await conn.close()
+                except Exception as e:
+                    logger.error(f"Помилка закриття з'єднання БД: {e}")
+            self._connections.clear()
+            self._writer = None
+        logger.info("Пул з'єднань БД закрито")
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """З'єднання для запису (одночасно тільки один власник)"""
+        async with self._writer_lock:
+            try:
+                yield self._writer
+            except Exception:
+                # Не залишаємо напівзавершену транзакцію на спільному з'єднанні
+                await self._writer.rollback()
+                raise
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """З'єднання для читання з пулу"""
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+# Глобальний пул з'єднань (створюється в init_db, закривається в close_db)
+_pool: Optional[ConnectionPool] = None
+_pool_lock = asyncio.Lock()
+_pool_closed = False
+
+async def get_pool() -> ConnectionPool:
+    """
+    Отримати пул з'єднань (відкриває його при першому зверненні)
+    Після close_db пул не відкривається знову до наступного init_db: фонова задача,
+    що пережила зупинку бота, отримує помилку замість нового пулу
+    """
+    global _pool
+    if _pool is None:
+        if _pool_closed:
+            raise RuntimeError("Пул з'єднань БД закрито")
+        async with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(DATABASE_PATH)
+                await pool.open()
+                _pool = pool
+    return _pool
+
+@asynccontextmanager
+async def _writer() -> AsyncIterator[aiosqlite.Connection]:
+    """З'єднання для запису з глобального пулу"""
+    pool = await get_pool()
+    async with pool.writer() as db:
+        yield db
+
+@asynccontextmanager
+async def _reader() -> AsyncIterator[aiosqlite.Connection]:
+    """З'єднання для читання з глобального пулу"""
+    pool = await get_pool()
+    async with pool.reader() as db:
+        yield db
+
+class ActivityBuffer:
+    """
+    Буфер відкладеного запису часу активності користувачів
+    Зберігає тільки останню мітку часу для кожного користувача і записує
+    весь буфер однією транзакцією (executemany) раз на flush_interval секунд
+    або коли накопичилось max_pending користувачів
+    """
+
+    def __init__(self, flush_interval: float = ACTIVITY_FLUSH_INTERVAL,
+                 max_pending: int = ACTIVITY_FLUSH_SIZE):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[int, str] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Користувачів, чия активність ще не записана"""
+        return len(self._pending)
+
+    def touch(self, user_id: int):
+        """Запам'ятати активність користувача (без звернення до БД)"""
+        # Формат збігається з CURRENT_TIMESTAMP в SQLite (UTC)
+        self._pending[user_id] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Записати накопичені мітки активності в БД"""
+        if not self._pending:
+            return 0
+        
+        batch, self._pending = self._pending, {}
+        try:
+            async with _writer() as db:
+                await _shift_active_days(db, batch)
+                await db.executemany(
+                    "UPDATE users SET last_activity = ? WHERE id = ?",
+                    [(ts, user_id) for user_id, ts in batch.items()]
+                )
+                await db.commit()
+            return len(batch)
+        except Exception as e:
+            logger.error(f"Помилка запису активності {len(batch)} користувачів: {e}")
+            # Повертаємо записи в буфер, не перезаписуючи новіші мітки
+            for user_id, ts in batch.items():
+                self._pending.setdefault(user_id, ts)
+            return 0
+
+    async def _run(self):
+        """Фоновий цикл періодичного запису"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Запустити фоновий запис"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Зупинити фоновий запис та записати залишок буфера"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+# Глобальний буфер активності користувачів
+activity_buffer = ActivityBuffer()
+
+class BroadcastLogSink:
+    """
+    Пакетний запис результатів доставки розсилок в broadcast_log
+    Результати накопичуються в обмеженій черзі і записуються транзакціями
+    по batch_size (executemany) раз на flush_interval секунд або коли черга
+    набрала batch_size записів; при повній черзі put() чекає на запис.
+    Пакет, який не вдалося записати, повторюється і не губиться
+    """
+
+    def __init__(self, flush_interval: float = BROADCAST_LOG_FLUSH_INTERVAL,
+                 batch_size: int = BROADCAST_LOG_BATCH_SIZE,
+                 max_queue: int = BROADCAST_LOG_QUEUE_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(max_queue, batch_size))
+        # Результати з невдалого запису - пишуться першими при наступному flush
+        self._retry: List[tuple] = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Результатів, що чекають запису"""
+        return self._queue.qsize() + len(self._retry)
+
+    async def put(self, log_id: int, status: str, error: Optional[str] = None,
+                  latency_ms: Optional[int] = None):
+        """Додати результат доставки (рядок broadcast_log з id log_id)"""
+        await self._queue.put((status, error, latency_ms, log_id))
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    def _take(self, limit: int) -> List[tuple]:
+        """Наступний пакет: спершу незаписані раніше результати, потім черга"""
+        batch, self._retry = self._retry, []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _write(self, batch: List[tuple], write: Callable[[List[tuple]], Awaitable[Any]]) -> Any:
+        """
+        Записати пакет через write(batch) з повторами при помилці
+        Якщо всі спроби невдалі - пакет повертається в буфер і помилка передається далі
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return await write(batch)
+            except Exception as e:
+                if attempt >= MAX_RETRIES:
+                    self._retry = batch + self._retry
+                    logger.error(f"Помилка запису {len(batch)} результатів розсилки: {e}")
+                    raise
+                logger.warning(f"Помилка запису {len(batch)} результатів розсилки, повтор: {e}")
+                await asyncio.sleep(min(RETRY_BACKOFF_BASE * 2 ** attempt, RETRY_BACKOFF_MAX))
+
+    async def flush(self) -> int:
+        """
+        Записати все, що є в черзі; після повернення попередні put() збережені в БД
+        Якщо запис не вдався після повторів - помилка (результати лишаються в буфері)
+        """
+        written = 0
+        async with self._flush_lock:
+            while self.pending:
+                batch = self._take(self.batch_size)
+                await self._write(batch, record_broadcast_outcomes)
+                written += len(batch)
+        return written
+
+    async def claim(self, broadcast_id: int, limit: int, shard: Optional[tuple] = None) -> List[tuple]:
+        """
+        Записати всі накопичені результати і взяти limit наступних одержувачів розсилки
+        в одній транзакції (див. claim_broadcast_recipients)
+        """
+        async with self._flush_lock:
+            batch = self._take(self.pending)
+            return await self._write(
+                batch, lambda outcomes: claim_broadcast_recipients(broadcast_id, limit, shard, outcomes)
+            )
+
+    async def _run(self):
+        """Фоновий цикл періодичного запису"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # Пакет лишився в буфері - наступний прохід спробує знову
+                pass
+
+    def start(self):
+        """Запустити фоновий запис"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Зупинити фоновий запис та записати залишок черги"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            # Рядки лишаються 'claimed' і після перезапуску стануть 'unknown'
+            logger.error(f"Не записано {self.pending} результатів розсилки при зупинці: {e}")
+
+# Глобальний журнал результатів доставки розсилок
+broadcast_log_sink = BroadcastLogSink()
+
+class RecipientClaimer:
+    """
+    Видача одержувачів розсилки воркерам
+    Воркер бере наступного одержувача лише разом із записом результату попереднього,
+    а запити воркерів, що прийшли одночасно, виконуються однією транзакцією (груповий
+    запис). Тож 'claimed' в журналі - тільки повідомлення, які зараз відправляються:
+    після збою невідомими лишаються не більше одного одержувача на воркер
+    """
+
+    def __init__(self, broadcast_id: int, shard: Optional[tuple] = None,
+                 sink: BroadcastLogSink = broadcast_log_sink):
+        self.broadcast_id = broadcast_id
+        self.shard = shard
+        self.sink = sink
+        self._waiters: List[asyncio.Future] = []
+        self._lock = asyncio.Lock()
+        self._exhausted = False
+
+    async def next(self, outcome: Optional[tuple] = None) -> Optional[tuple]:
+        """
+        Записати результат попереднього одержувача (log_id, status, error, latency_ms)
+        і взяти наступного: (id рядка журналу, user_id) або None, якщо одержувачі закінчились
+        """
+        if outcome is not None:
+            await self.sink.put(*outcome)
+        if self._exhausted:
+            return None
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        async with self._lock:
+            # Поки чекали, наш запит міг виконати попередній власник lock
+            if not waiter.done():
+                waiters, self._waiters = self._waiters, []
+                try:
+                    rows = [] if self._exhausted else await self.sink.claim(
+                        self.broadcast_id, len(waiters), self.shard
+                    )
+                except Exception as e:
+                    for pending in waiters:
+                        pending.set_exception(e)
+                else:
+                    if len(rows) < len(waiters):
+                        self._exhausted = True
+                    for index, pending in enumerate(waiters):
+                        pending.set_result(rows[index] if index < len(rows) else None)
+        return await waiter
+
+def _utc_day() -> str:
+    """Поточний день в UTC (формат як date(CURRENT_TIMESTAMP) в SQLite)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+async def _bump_rollup(db: aiosqlite.Connection, day: str, **deltas: int):
+    """Додати значення до денного бакету metrics_rollup (в поточній транзакції)"""
+    columns = ", ".join(deltas)
+    placeholders = ", ".join("?" * len(deltas))
+    updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in deltas)
+    await db.execute(
+        f"INSERT INTO metrics_rollup (day, {columns}) VALUES (?, {placeholders}) "
+        f"ON CONFLICT(day) DO UPDATE SET {updates}",
+        (day, *deltas.values())
+    )
+
+async def _shift_active_days(db: aiosqlite.Connection, batch: Dict[int, str]):
+    """Перенести користувачів з бакету попередньої активності в бакет нової"""
+    deltas: Dict[str, int] = {}
+    user_ids = list(batch)
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        async with db.execute(
+            f"SELECT id, substr(last_activity, 1, 10) FROM users WHERE id IN ({placeholders})",
+            chunk
+        ) as cursor:
+            async for user_id, old_day in cursor:
+                new_day = batch[user_id][:10]
+                if old_day == new_day:
+                    continue
+                if old_day:
+                    deltas[old_day] = deltas.get(old_day, 0) - 1
+                deltas[new_day] = deltas.get(new_day, 0) + 1
+    
+    if deltas:
+        await db.executemany(
+            """INSERT INTO metrics_rollup (day, active_users) VALUES (?, ?)
+               ON CONFLICT(day) DO UPDATE SET active_users = active_users + excluded.active_users""",
+            list(deltas.items())
+        )
+
+class KnownUsersCache:
+    """
+    Обмежений LRU кеш користувачів, які вже є в таблиці users
+    Зберігає username, щоб add_user звертався до БД тільки для нових
+    користувачів або при зміні username
+    """
+
+    def __init__(self, max_size: int = KNOWN_USERS_CACHE_SIZE):
+        self.max_size = max_size
+        self._users: "OrderedDict[int, Optional[str]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def matches(self, user_id: int, username: Optional[str]) -> bool:
+        """Чи відомий користувач з таким самим username"""
+        if user_id not in self._users or self._users[user_id] != username:
+            return False
+        self._users.move_to_end(user_id)
+        return True
+
+    def remember(self, user_id: int, username: Optional[str]):
+        """Запам'ятати користувача (витісняє найдавніших при переповненні)"""
+        self._users[user_id] = username
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def clear(self):
+        self._users.clear()
+
+# Глобальний кеш відомих користувачів
+known_users = KnownUsersCache()
+
+@db_timed
 async def init_db():
     """Ініціалізація бази даних"""
+    global _pool_closed
+    _pool_closed = False
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
             # Створюємо таблиці
             for sql in CREATE_TABLES_SQL:
                 await db.execute(sql)
+            await add_missing_columns(db)
             
             # Створюємо індекси
             for sql in CREATE_INDEXES_SQL:
@@ -133,29 +675,209 @@ async def init_db():
             
             await db.commit()
             logger.info("База даних успішно ініціалізована")
+        
+        await ensure_search_index()
+        await ensure_metrics_rollup()
+        await ensure_broadcast_error_classes()
+        await warm_known_users()
+        activity_buffer.start()
+        broadcast_log_sink.start()
     except Exception as e:
         logger.error(f"Помилка ініціалізації БД: {e}")
         raise
 
+@db_timed
+async def add_missing_columns(db: aiosqlite.Connection):
+    """Додати в існуючі таблиці колонки з ADDED_COLUMNS, яких ще немає"""
+    for table, column, column_type in ADDED_COLUMNS:
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if column not in columns:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            logger.info(f"Додано колонку {table}.{column}")
+
+# Чи доступний FTS5-індекс для пошуку (без нього - пошук через LIKE)
+_search_fts_enabled = False
+
+@db_timed
+async def ensure_search_index():
+    """Створити FTS5-індекс username та заповнити його для існуючих користувачів"""
+    global _search_fts_enabled
+    try:
+        async with _writer() as db:
+            async with db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'users_fts'"
+            ) as cursor:
+                exists = await cursor.fetchone() is not None
+            
+            for sql in CREATE_SEARCH_SQL:
+                await db.execute(sql)
+            if not exists:
+                await db.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+            await db.commit()
+        _search_fts_enabled = True
+    except Exception as e:
+        _search_fts_enabled = False
+        logger.warning(f"FTS5 недоступний, пошук користувачів працюватиме через LIKE: {e}")
+
+@db_timed
+async def checkpoint_db():
+    """Перенести вміст WAL в основний файл БД (перед копіюванням файлу)"""
+    try:
+        async with _writer() as db:
+            await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except Exception as e:
+        logger.error(f"Помилка checkpoint БД: {e}")
+
+@db_timed
+async def rebuild_metrics_rollup():
+    """Перерахувати metrics_rollup з нуля по таблицях users та purchases"""
+    async with _writer() as db:
+        await db.execute("DELETE FROM metrics_rollup")
+        await db.execute(
+            """INSERT INTO metrics_rollup (day, new_users)
+               SELECT date(joined_at), COUNT(*) FROM users
+               WHERE joined_at IS NOT NULL GROUP BY date(joined_at)"""
+        )
+        await db.execute(
+            """INSERT INTO metrics_rollup (day, active_users)
+               SELECT date(last_activity), COUNT(*) FROM users
+               WHERE last_activity IS NOT NULL GROUP BY date(last_activity)
+               ON CONFLICT(day) DO UPDATE SET active_users = excluded.active_users"""
+        )
+        await db.execute(
+            """INSERT INTO metrics_rollup (day, purchases)
+               SELECT date(ts), COUNT(*) FROM purchases
+               WHERE ts IS NOT NULL GROUP BY date(ts)
+               ON CONFLICT(day) DO UPDATE SET purchases = excluded.purchases"""
+        )
+        # Дохід - в день завершення оплати, як і при оновленні статусу
+        # (покупки, завершені до появи completed_at, - в день створення)
+        await db.execute(
+            """INSERT INTO metrics_rollup (day, completed_purchases, revenue)
+               SELECT date(COALESCE(completed_at, ts)), COUNT(*), SUM(COALESCE(amount, 0))
+               FROM purchases
+               WHERE payment_status = 'completed' AND COALESCE(completed_at, ts) IS NOT NULL
+               GROUP BY date(COALESCE(completed_at, ts))
+               ON CONFLICT(day) DO UPDATE SET completed_purchases = excluded.completed_purchases,
+                   revenue = excluded.revenue"""
+        )
+        await db.execute(
+            """INSERT INTO metrics_rollup (day, new_buyers)
+               SELECT date(first_ts), COUNT(*) FROM (
+                   SELECT MIN(ts) AS first_ts FROM purchases GROUP BY user_id
+               ) WHERE first_ts IS NOT NULL GROUP BY date(first_ts)
+               ON CONFLICT(day) DO UPDATE SET new_buyers = excluded.new_buyers"""
+        )
+        await db.commit()
+    logger.info("metrics_rollup перераховано")
+
+@db_timed
+async def ensure_metrics_rollup():
+    """Заповнити metrics_rollup для існуючої БД (один раз після міграції)"""
+    try:
+        async with _reader() as db:
+            async with db.execute(
+                "SELECT EXISTS(SELECT 1 FROM metrics_rollup), EXISTS(SELECT 1 FROM users)"
+            ) as cursor:
+                has_rollup, has_users = await cursor.fetchone()
+        if has_users and not has_rollup:
+            await rebuild_metrics_rollup()
+    except Exception as e:
+        logger.error(f"Помилка заповнення metrics_rollup: {e}")
+
+@db_timed
+async def ensure_broadcast_error_classes():
+    """Заповнити broadcast_error_classes з JSON error_classes для існуючої БД (один раз після міграції)"""
+    try:
+        async with _reader() as db:
+            async with db.execute(
+                """
+                SELECT EXISTS(SELECT 1 FROM broadcast_error_classes),
+                       EXISTS(SELECT 1 FROM broadcast_stats WHERE error_classes NOT IN ('', '{}'))
+                """
+            ) as cursor:
+                has_classes, has_stats = await cursor.fetchone()
+        if has_stats and not has_classes:
+            async with _writer() as db:
+                cursor = await db.execute(
+                    """
+                    INSERT OR REPLACE INTO broadcast_error_classes (broadcast_id, status, count)
+                    SELECT s.broadcast_id, e.key, e.value
+                    FROM broadcast_stats s, json_each(s.error_classes) e
+                    WHERE json_valid(s.error_classes)
+                    """
+                )
+                await db.commit()
+                logger.info(f"broadcast_error_classes заповнено: {cursor.rowcount} рядків")
+    except Exception as e:
+        logger.error(f"Помилка заповнення broadcast_error_classes: {e}")
+
+@db_timed
+async def warm_known_users() -> int:
+    """Заповнити кеш відомих користувачів найактивнішими користувачами з БД"""
+    try:
+        known_users.clear()
+        async with _reader() as db:
+            async with db.execute(
+                "SELECT id, username FROM users ORDER BY last_activity DESC LIMIT ?",
+                (known_users.max_size,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+        # Додаємо від найдавніших до найсвіжіших, щоб LRU порядок був правильним
+        for user_id, username in reversed(rows):
+            known_users.remember(user_id, username)
+        logger.info(f"Кеш відомих користувачів заповнено: {len(known_users)}")
+        return len(known_users)
+    except Exception as e:
+        logger.error(f"Помилка заповнення кешу користувачів: {e}")
+        return 0
+
+@db_timed
+async def close_db():
+    """Закрити пул з'єднань БД"""
+    global _pool, _pool_closed
+    await activity_buffer.stop()
+    await broadcast_log_sink.stop()
+    _pool_closed = True
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
 # Функції для роботи з користувачами
+@db_timed
 async def add_user(user_id: int, username: str = None) -> bool:
-    """Додати користувача"""
+    """Додати користувача або оновити його username"""
+    # Відомий користувач з тим самим username - запис у БД не потрібен
+    if known_users.matches(user_id, username):
+        return True
+    
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
+        async with _writer() as db:
+            cursor = await db.execute(
                 "INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)",
                 (user_id, username)
             )
+            if cursor.rowcount == 1:
+                # Новий користувач: joined_at та last_activity - сьогодні
+                await _bump_rollup(db, _utc_day(), new_users=1, active_users=1)
+            else:
+                await db.execute(
+                    "UPDATE users SET username = ? WHERE id = ? AND username IS NOT ?",
+                    (username, user_id, username)
+                )
             await db.commit()
-            return True
+        known_users.remember(user_id, username)
+        return True
     except Exception as e:
         logger.error(f"Помилка додавання користувача {user_id}: {e}")
         return False
 
+@db_timed
 async def get_user(user_id: int) -> Optional[Dict[str, Any]]:
     """Отримати користувача"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 "SELECT * FROM users WHERE id = ?", (user_id,)
             ) as cursor:
@@ -173,22 +895,16 @@ async def get_user(user_id: int) -> Optional[Dict[str, Any]]:
         logger.error(f"Помилка отримання користувача {user_id}: {e}")
         return None
 
+@db_timed
 async def update_user_activity(user_id: int):
-    """Оновити час останньої активності користувача"""
-    try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
-                "UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE id = ?",
-                (user_id,)
-            )
-            await db.commit()
-    except Exception as e:
-        logger.error(f"Помилка оновлення активності користувача {user_id}: {e}")
+    """Оновити час останньої активності користувача (відкладений запис через activity_buffer)"""
+    activity_buffer.touch(user_id)
 
+@db_timed
 async def block_user(user_id: int, blocked: bool = True):
     """Заблокувати/розблокувати користувача"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
             await db.execute(
                 "UPDATE users SET is_blocked = ? WHERE id = ?",
                 (blocked, user_id)
@@ -200,11 +916,12 @@ async def block_user(user_id: int, blocked: bool = True):
         return False
 
 # Функції для роботи з курсами
+@db_timed
 async def add_course(zenedu_id: str, title: str, price_uah: int, 
                     z_link: str = None, description: str = None) -> Optional[int]:
     """Додати курс"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
             cursor = await db.execute(
                 """INSERT INTO courses (zenedu_id, title, price_uah, z_link, description) 
                    VALUES (?, ?, ?, ?, ?)""",
@@ -216,10 +933,11 @@ async def add_course(zenedu_id: str, title: str, price_uah: int,
         logger.error(f"Помилка додавання курсу: {e}")
         return None
 
+@db_timed
 async def get_courses() -> List[Dict[str, Any]]:
     """Отримати всі активні курси"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 "SELECT * FROM courses WHERE is_active = TRUE ORDER BY created_at DESC"
             ) as cursor:
@@ -238,10 +956,11 @@ async def get_courses() -> List[Dict[str, Any]]:
         logger.error(f"Помилка отримання курсів: {e}")
         return []
 
+@db_timed
 async def get_course(course_id: int) -> Optional[Dict[str, Any]]:
     """Отримати курс за ID"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 "SELECT * FROM courses WHERE id = ?", (course_id,)
             ) as cursor:
@@ -263,30 +982,60 @@ async def get_course(course_id: int) -> Optional[Dict[str, Any]]:
         return None
 
 # Функції для роботи з покупками
+@db_timed
 async def create_purchase(user_id: int, course_id: int, amount: int, 
                          monobank_payment_id: str = None) -> Optional[int]:
     """Створити запис про покупку"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
+            async with db.execute(
+                "SELECT 1 FROM purchases WHERE user_id = ? LIMIT 1", (user_id,)
+            ) as cursor:
+                is_new_buyer = await cursor.fetchone() is None
+            
             cursor = await db.execute(
                 """INSERT INTO purchases (user_id, course_id, amount, monobank_payment_id) 
                    VALUES (?, ?, ?, ?)""",
                 (user_id, course_id, amount, monobank_payment_id)
             )
+            await _bump_rollup(db, _utc_day(), purchases=1, new_buyers=int(is_new_buyer))
             await db.commit()
             return cursor.lastrowid
     except Exception as e:
         logger.error(f"Помилка створення покупки: {e}")
         return None
 
+@db_timed
 async def update_purchase_status(purchase_id: int, status: str):
     """Оновити статус покупки"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
+            async with db.execute(
+                """SELECT payment_status, amount, date(COALESCE(completed_at, ts))
+                   FROM purchases WHERE id = ?""",
+                (purchase_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            
             await db.execute(
-                "UPDATE purchases SET payment_status = ? WHERE id = ?",
-                (status, purchase_id)
+                """UPDATE purchases SET payment_status = ?,
+                       completed_at = CASE
+                           WHEN ? != 'completed' THEN NULL
+                           WHEN payment_status = 'completed' THEN completed_at
+                           ELSE CURRENT_TIMESTAMP
+                       END
+                   WHERE id = ?""",
+                (status, status, purchase_id)
             )
+            
+            # Дохід враховується в день завершення оплати; скасування завершеної
+            # оплати знімає його з того ж дня (так само рахує rebuild_metrics_rollup)
+            if row and (row[0] == 'completed') != (status == 'completed'):
+                sign = 1 if status == 'completed' else -1
+                await _bump_rollup(
+                    db, _utc_day() if sign > 0 else row[2],
+                    completed_purchases=sign, revenue=sign * (row[1] or 0)
+                )
             await db.commit()
             return True
     except Exception as e:
@@ -294,11 +1043,12 @@ async def update_purchase_status(purchase_id: int, status: str):
         return False
 
 # Функції для роботи з доступами до курсів
+@db_timed
 async def grant_course_access(user_id: int, course_id: int, 
                              expires_at: datetime = None) -> bool:
     """Надати доступ до курсу"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
             await db.execute(
                 """INSERT OR REPLACE INTO user_course_access 
                    (user_id, course_id, access_expires_at) VALUES (?, ?, ?)""",
@@ -310,10 +1060,11 @@ async def grant_course_access(user_id: int, course_id: int,
         logger.error(f"Помилка надання доступу до курсу: {e}")
         return False
 
+@db_timed
 async def check_course_access(user_id: int, course_id: int) -> bool:
     """Перевірити доступ до курсу"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 """SELECT is_active FROM user_course_access 
                    WHERE user_id = ? AND course_id = ? AND 
@@ -327,10 +1078,11 @@ async def check_course_access(user_id: int, course_id: int) -> bool:
         return False
 
 # Функції для статистики
+@db_timed
 async def get_user_stats() -> Dict[str, Any]:
     """Отримати статистику користувачів"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             # Загальна кількість
             async with db.execute("SELECT COUNT(*) FROM users") as cursor:
                 total_users = (await cursor.fetchone())[0]
@@ -356,10 +1108,11 @@ async def get_user_stats() -> Dict[str, Any]:
         logger.error(f"Помилка отримання статистики: {e}")
         return {}
 
+@db_timed
 async def get_all_users() -> List[int]:
     """Отримати всіх користувачів (для розсилок)"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 "SELECT id FROM users WHERE is_blocked = FALSE"
             ) as cursor:
@@ -370,23 +1123,75 @@ async def get_all_users() -> List[int]:
         return [] 
 
 # Статистичні функції для адмін панелі
+
+# Середня кількість взаємодій активного користувача (для оцінки взаємодій)
+AVG_DAILY_INTERACTIONS = 4  # 3-5 взаємодій за день
+AVG_WEEKLY_INTERACTIONS = 18  # 15-20 взаємодій за тиждень
+
+@dataclass
+class DashboardSnapshot:
+    """Знімок метрик для екрану аналітики адмін панелі"""
+    users_count: int = 0
+    new_users_day: int = 0
+    new_users_week: int = 0
+    new_users_month: int = 0
+    active_day: int = 0
+    active_week: int = 0
+    course_purchases: int = 0
+    users_with_purchases: int = 0
+
+    @property
+    def daily_interactions(self) -> int:
+        return self.active_day * AVG_DAILY_INTERACTIONS
+
+    @property
+    def weekly_interactions(self) -> int:
+        return self.active_week * AVG_WEEKLY_INTERACTIONS
+
+@db_timed
+async def get_dashboard_snapshot() -> DashboardSnapshot:
+    """Отримує всі метрики аналітики з денних агрегатів metrics_rollup (O(днів))"""
+    try:
+        async with _reader() as db:
+            # Вікна в календарних днях UTC, включно з сьогоднішнім
+            async with db.execute(
+                """
+                SELECT SUM(new_users),
+                       SUM(CASE WHEN day >= date('now') THEN new_users END),
+                       SUM(CASE WHEN day >= date('now', '-6 days') THEN new_users END),
+                       SUM(CASE WHEN day >= date('now', '-29 days') THEN new_users END),
+                       SUM(CASE WHEN day >= date('now') THEN active_users END),
+                       SUM(CASE WHEN day >= date('now', '-6 days') THEN active_users END),
+                       SUM(purchases), SUM(new_buyers)
+                FROM metrics_rollup
+                """
+            ) as cursor:
+                row = await cursor.fetchone()
+        
+        return DashboardSnapshot(*(value or 0 for value in row))
+    except Exception as e:
+        logger.error(f"Помилка отримання знімку аналітики: {e}")
+        return DashboardSnapshot()
+
+@db_timed
 async def get_users_count() -> int:
-    """Отримує загальну кількість користувачів"""
+    """Отримує загальну кількість користувачів (лічильник з metrics_rollup)"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute("SELECT COUNT(*) FROM users")
+        async with _reader() as db:
+            cursor = await db.execute("SELECT COALESCE(SUM(new_users), 0) FROM metrics_rollup")
             result = await cursor.fetchone()
             return result[0] if result else 0
     except Exception as e:
         logger.error(f"Помилка отримання кількості користувачів: {e}")
         return 0
 
+@db_timed
 async def get_new_users_count(days: int = 30) -> int:
     """Отримує кількість нових користувачів за останні N днів"""
     try:
         date_threshold = datetime.now() - timedelta(days=days)
         
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             cursor = await db.execute(
                 "SELECT COUNT(*) FROM users WHERE joined_at >= ?",
                 (date_threshold,)
@@ -397,12 +1202,13 @@ async def get_new_users_count(days: int = 30) -> int:
         logger.error(f"Помилка отримання кількості нових користувачів: {e}")
         return 0
 
+@db_timed
 async def get_active_users_count(days: int = 7) -> int:
     """Отримує кількість активних користувачів за останні N днів"""
     try:
         date_threshold = datetime.now() - timedelta(days=days)
         
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             cursor = await db.execute(
                 "SELECT COUNT(*) FROM users WHERE last_activity >= ?",
                 (date_threshold,)
@@ -413,10 +1219,11 @@ async def get_active_users_count(days: int = 7) -> int:
         logger.error(f"Помилка отримання кількості активних користувачів: {e}")
         return 0
 
+@db_timed
 async def get_courses_count() -> int:
     """Отримує загальну кількість курсів"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             cursor = await db.execute("SELECT COUNT(*) FROM courses")
             result = await cursor.fetchone()
             return result[0] if result else 0
@@ -424,10 +1231,11 @@ async def get_courses_count() -> int:
         logger.error(f"Помилка отримання кількості курсів: {e}")
         return 0
 
+@db_timed
 async def get_purchases_count() -> int:
     """Отримує загальну кількість покупок"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             cursor = await db.execute("SELECT COUNT(*) FROM purchases")
             result = await cursor.fetchone()
             return result[0] if result else 0
@@ -435,10 +1243,11 @@ async def get_purchases_count() -> int:
         logger.error(f"Помилка отримання кількості покупок: {e}")
         return 0
 
+@db_timed
 async def get_users_with_purchases_count() -> int:
     """Отримує кількість користувачів які зробили покупки"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             cursor = await db.execute(
                 "SELECT COUNT(DISTINCT user_id) FROM purchases"
             )
@@ -448,38 +1257,35 @@ async def get_users_with_purchases_count() -> int:
         logger.error(f"Помилка отримання кількості користувачів з покупками: {e}")
         return 0
 
+@db_timed
 async def get_daily_interactions() -> int:
     """Розраховує приблизну кількість взаємодій за день"""
     try:
         # Отримуємо активних користувачів за день
         active_today = await get_active_users_count(days=1)
         
-        # Припускаємо в середньому 3-5 взаємодій на активного користувача за день
-        avg_interactions_per_user = 4
-        
-        return active_today * avg_interactions_per_user
+        return active_today * AVG_DAILY_INTERACTIONS
     except Exception as e:
         logger.error(f"Помилка розрахунку денних взаємодій: {e}")
         return 0
 
+@db_timed
 async def get_weekly_interactions() -> int:
     """Розраховує приблизну кількість взаємодій за тиждень"""
     try:
         # Отримуємо активних користувачів за тиждень
         active_week = await get_active_users_count(days=7)
         
-        # Припускаємо в середньому 15-20 взаємодій на активного користувача за тиждень
-        avg_interactions_per_user = 18
-        
-        return active_week * avg_interactions_per_user
+        return active_week * AVG_WEEKLY_INTERACTIONS
     except Exception as e:
         logger.error(f"Помилка розрахунку тижневих взаємодій: {e}")
         return 0
 
+@db_timed
 async def get_recent_purchases(limit: int = 10):
     """Отримує останні покупки"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             cursor = await db.execute("""
                 SELECT p.*, u.username, c.title 
                 FROM purchases p
@@ -493,10 +1299,11 @@ async def get_recent_purchases(limit: int = 10):
         logger.error(f"Помилка отримання останніх покупок: {e}")
         return []
 
+@db_timed
 async def get_course_statistics():
     """Отримує статистику по курсах"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             cursor = await db.execute("""
                 SELECT 
                     c.title,
@@ -514,24 +1321,60 @@ async def get_course_statistics():
         return []
 
 # Функції для управління користувачами (адмін панель)
-async def search_users(query: str) -> List[dict]:
-    """Пошук користувачів за ID або username"""
+def _escape_like(value: str) -> str:
+    """Екранувати спецсимволи LIKE (в username часто є '_')"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+@db_timed
+async def search_users(query: str, limit: int = 10) -> List[dict]:
+    """
+    Пошук користувачів за ID або username
+    Порядок: точний збіг username, збіг за префіксом, потім входження підрядка
+    """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        query = query.strip().lstrip("@")
+        if not query:
+            return []
+        
+        columns = "u.id, u.username, u.joined_at, u.is_blocked, u.last_activity"
+        async with _reader() as db:
             # Якщо запит - число, шукаємо за ID
             if query.isdigit():
-                user_id = int(query)
                 async with db.execute(
-                    "SELECT id, username, joined_at, is_blocked, last_activity FROM users WHERE id = ?",
-                    (user_id,)
+                    f"SELECT {columns} FROM users u WHERE u.id = ?",
+                    (int(query),)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            elif len(query) < FTS_MIN_QUERY_LENGTH or not _search_fts_enabled:
+                # Короткий запит - тільки префікс (діапазон по idx_users_username_nocase),
+                # без FTS5 - підрядок через LIKE
+                pattern = _escape_like(query) + "%"
+                if len(query) >= FTS_MIN_QUERY_LENGTH:
+                    pattern = "%" + pattern
+                async with db.execute(
+                    f"""
+                    SELECT {columns} FROM users u
+                    WHERE u.username LIKE ? ESCAPE '\\'
+                    ORDER BY u.username = ? COLLATE NOCASE DESC, length(u.username), u.id
+                    LIMIT ?
+                    """,
+                    (pattern, query, limit)
                 ) as cursor:
                     rows = await cursor.fetchall()
             else:
-                # Інакше шукаємо за username (частковий збіг)
-                username_pattern = f"%{query}%"
+                # Входження підрядка через trigram-індекс
+                phrase = '"' + query.replace('"', '""') + '"'
                 async with db.execute(
-                    "SELECT id, username, joined_at, is_blocked, last_activity FROM users WHERE username LIKE ?",
-                    (username_pattern,)
+                    f"""
+                    SELECT {columns} FROM users_fts f
+                    JOIN users u ON u.id = f.rowid
+                    WHERE users_fts MATCH ?
+                    ORDER BY u.username = ? COLLATE NOCASE DESC,
+                             u.username LIKE ? ESCAPE '\\' DESC,
+                             length(u.username), f.rank
+                    LIMIT ?
+                    """,
+                    (phrase, query, _escape_like(query) + "%", limit)
                 ) as cursor:
                     rows = await cursor.fetchall()
             
@@ -549,39 +1392,65 @@ async def search_users(query: str) -> List[dict]:
         logger.error(f"Помилка пошуку користувачів за запитом '{query}': {e}")
         return []
 
-async def get_users_list(offset: int = 0, limit: int = 10) -> List[dict]:
-    """Отримати список користувачів з пагінацією"""
+def _keyset_clause(table: str, sort_column: str, after_id: Optional[int],
+                   before_id: Optional[int], alias: str = "") -> tuple:
+    """
+    Умова WHERE, напрямок сортування та параметри для keyset-пагінації по (sort_column, id)
+    Курсор - id граничного рядка, його ключ сортування береться підзапитом по первинному ключу
+    """
+    prefix = f"{alias}." if alias else ""
+    cursor_key = f"(SELECT {sort_column}, id FROM {table} WHERE id = ?)"
+    if before_id is not None:
+        return f"WHERE ({prefix}{sort_column}, {prefix}id) > {cursor_key}", "ASC", (before_id,)
+    if after_id is not None:
+        return f"WHERE ({prefix}{sort_column}, {prefix}id) < {cursor_key}", "DESC", (after_id,)
+    return "", "DESC", ()
+
+@db_timed
+async def get_users_list(limit: int = 10, after_id: Optional[int] = None,
+                         before_id: Optional[int] = None) -> List[dict]:
+    """
+    Отримати список користувачів з keyset-пагінацією (від нових до старих)
+    after_id - наступна сторінка після цього користувача, before_id - попередня перед ним
+    """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        where, order, params = _keyset_clause("users", "joined_at", after_id, before_id)
+        
+        async with _reader() as db:
             async with db.execute(
-                """
+                f"""
                 SELECT id, username, joined_at, is_blocked, last_activity 
                 FROM users 
-                ORDER BY joined_at DESC 
-                LIMIT ? OFFSET ?
+                {where}
+                ORDER BY joined_at {order}, id {order}
+                LIMIT ?
                 """,
-                (limit, offset)
+                (*params, limit)
             ) as cursor:
                 rows = await cursor.fetchall()
-                
-            return [
-                {
-                    "id": row[0],
-                    "username": row[1],
-                    "joined_at": row[2],
-                    "is_blocked": bool(row[3]),
-                    "last_activity": row[4]
-                }
-                for row in rows
-            ]
+        
+        if order == "ASC":
+            rows.reverse()
+            
+        return [
+            {
+                "id": row[0],
+                "username": row[1],
+                "joined_at": row[2],
+                "is_blocked": bool(row[3]),
+                "last_activity": row[4]
+            }
+            for row in rows
+        ]
     except Exception as e:
         logger.error(f"Помилка отримання списку користувачів: {e}")
         return []
 
+@db_timed
 async def get_user_purchases(user_id: int) -> List[dict]:
     """Отримати покупки конкретного користувача"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 """
                 SELECT p.id, c.title, p.ts, p.payment_status, p.amount
@@ -608,65 +1477,71 @@ async def get_user_purchases(user_id: int) -> List[dict]:
         logger.error(f"Помилка отримання покупок користувача {user_id}: {e}")
         return []
 
-async def get_all_purchases(offset: int = 0, limit: int = 20) -> List[dict]:
-    """Отримати всі покупки з інформацією про користувачів"""
+@db_timed
+async def get_all_purchases(limit: int = 20, after_id: Optional[int] = None,
+                            before_id: Optional[int] = None) -> List[dict]:
+    """
+    Отримати всі покупки з інформацією про користувачів (keyset-пагінація від нових до старих)
+    after_id - наступна сторінка після цієї покупки, before_id - попередня перед нею
+    """
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        where, order, params = _keyset_clause("purchases", "ts", after_id, before_id, alias="p")
+        
+        async with _reader() as db:
             async with db.execute(
-                """
+                f"""
                 SELECT p.id, u.id, u.username, c.title, p.ts, p.payment_status, p.amount
                 FROM purchases p
                 JOIN users u ON p.user_id = u.id
                 JOIN courses c ON p.course_id = c.id
-                ORDER BY p.ts DESC
-                LIMIT ? OFFSET ?
+                {where}
+                ORDER BY p.ts {order}, p.id {order}
+                LIMIT ?
                 """,
-                (limit, offset)
+                (*params, limit)
             ) as cursor:
                 rows = await cursor.fetchall()
-                
-            return [
-                {
-                    "purchase_id": row[0],
-                    "user_id": row[1], 
-                    "username": row[2],
-                    "course_title": row[3],
-                    "purchase_date": row[4],
-                    "payment_status": row[5],
-                    "amount": row[6]
-                }
-                for row in rows
-            ]
+        
+        if order == "ASC":
+            rows.reverse()
+            
+        return [
+            {
+                "purchase_id": row[0],
+                "user_id": row[1], 
+                "username": row[2],
+                "course_title": row[3],
+                "purchase_date": row[4],
+                "payment_status": row[5],
+                "amount": row[6]
+            }
+            for row in rows
+        ]
     except Exception as e:
         logger.error(f"Помилка отримання всіх покупок: {e}")
         return []
 
+@db_timed
 async def get_purchases_stats() -> dict:
-    """Отримати статистику покупок"""
+    """Отримати статистику покупок (з денних агрегатів metrics_rollup)"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            # Загальна кількість покупок
-            async with db.execute("SELECT COUNT(*) FROM purchases") as cursor:
-                total_purchases = (await cursor.fetchone())[0]
-            
-            # Сума всіх покупок
-            async with db.execute("SELECT SUM(amount) FROM purchases WHERE payment_status = 'completed'") as cursor:
-                total_revenue = (await cursor.fetchone())[0] or 0
-            
-            # Покупки за останній місяць
+        async with _reader() as db:
             async with db.execute(
-                "SELECT COUNT(*) FROM purchases WHERE ts > datetime('now', '-30 days')"
+                """
+                SELECT SUM(purchases), SUM(revenue), SUM(completed_purchases),
+                       SUM(CASE WHEN day >= date('now', '-29 days') THEN purchases END)
+                FROM metrics_rollup
+                """
             ) as cursor:
-                monthly_purchases = (await cursor.fetchone())[0]
+                total_purchases, total_revenue, completed, monthly_purchases = await cursor.fetchone()
             
             # Середній чек
-            async with db.execute("SELECT AVG(amount) FROM purchases WHERE payment_status = 'completed'") as cursor:
-                avg_amount = (await cursor.fetchone())[0] or 0
+            avg_amount = (total_revenue or 0) / completed if completed else 0
             
             return {
-                "total_purchases": total_purchases,
-                "total_revenue": total_revenue,
-                "monthly_purchases": monthly_purchases,
+                "total_purchases": total_purchases or 0,
+                "total_revenue": total_revenue or 0,
+                "monthly_purchases": monthly_purchases or 0,
                 "avg_amount": round(avg_amount, 2)
             }
     except Exception as e:
@@ -674,50 +1549,91 @@ async def get_purchases_stats() -> dict:
         return {}
 
 # Функції для роботи з розсилками
+# Умови відбору користувачів (users u) для кожного сегменту аудиторії розсилок.
+# Без DISTINCT/GROUP BY, щоб SQLite міг застосувати keyset-умову по u.id до індексу
+_SEGMENT_FILTERS = {
+    # Всі активні користувачі
+    "all": "u.is_blocked = FALSE",
+    # Користувачі з покупками
+    "buyers": """
+        u.is_blocked = FALSE
+        AND EXISTS (SELECT 1 FROM purchases p WHERE p.user_id = u.id)
+    """,
+    # Неактивні 7+ днів
+    "inactive": """
+        u.is_blocked = FALSE
+        AND (u.last_activity IS NULL OR u.last_activity < datetime('now', '-7 days'))
+    """
+}
+
+@db_timed
 async def get_users_by_segment(segment: str) -> List[int]:
-    """Отримати користувачів за сегментом"""
-    try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            if segment == "all":
-                # Всі активні користувачі
-                query = "SELECT id FROM users WHERE is_blocked = FALSE"
-            elif segment == "buyers":
-                # Користувачі з покупками
-                query = """
-                    SELECT DISTINCT u.id FROM users u
-                    INNER JOIN purchases p ON u.id = p.user_id
-                    WHERE u.is_blocked = FALSE
-                """
-            elif segment == "inactive":
-                # Неактивні 7+ днів
-                query = """
-                    SELECT id FROM users 
-                    WHERE is_blocked = FALSE 
-                    AND (last_activity IS NULL OR last_activity < datetime('now', '-7 days'))
-                """
-            else:
-                return []
-            
-            async with db.execute(query) as cursor:
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows]
+    """Отримати користувачів за сегментом (весь список в пам'яті; для великих аудиторій - iter_users_by_segment)"""
+    return [user_id async for user_id in iter_users_by_segment(segment)]
+
+async def iter_users_by_segment(segment: str, chunk_size: int = 1000) -> AsyncIterator[int]:
+    """
+    Потоково віддати id користувачів сегменту в порядку зростання
+    Читає порціями по chunk_size (keyset по id), тож пам'ять не залежить від розміру аудиторії
+    """
+    condition = _SEGMENT_FILTERS.get(segment)
+    if condition is None:
+        return
+    
+    last_id = 0  # id користувачів Telegram додатні
+    while True:
+        try:
+            async with _reader() as db:
+                async with db.execute(
+                    f"""
+                    SELECT u.id FROM users u
+                    WHERE u.id > ? AND ({condition})
+                    ORDER BY u.id
+                    LIMIT ?
+                    """,
+                    (last_id, chunk_size)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Помилка отримання користувачів сегменту {segment}: {e}")
+            return
+        
+        for row in rows:
+            yield row[0]
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+@db_timed
+async def count_users_by_segment(segment: str) -> int:
+    """Кількість користувачів сегменту (для попереднього перегляду аудиторії)"""
+    condition = _SEGMENT_FILTERS.get(segment)
+    if condition is None:
+        return 0
+    
+    try:
+        async with _reader() as db:
+            async with db.execute(f"SELECT COUNT(*) FROM users u WHERE {condition}") as cursor:
+                return (await cursor.fetchone())[0]
     except Exception as e:
-        logger.error(f"Помилка отримання користувачів сегменту {segment}: {e}")
-        return []
+        logger.error(f"Помилка підрахунку користувачів сегменту {segment}: {e}")
+        return 0
 
+@db_timed
 async def save_broadcast(admin_id: int, message_text: str, audience: str, 
-                        scheduled_for: str = None, status: str = "pending") -> int:
-    """Зберегти розсилку в БД"""
+                        scheduled_for: str = None, status: str = "pending",
+                        media: str = None, media_file_id: str = None) -> int:
+    """Зберегти розсилку в БД (media - JSON медіа розсилки, media_file_id - file_id першого файлу)"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
             cursor = await db.execute(
                 """
                 INSERT INTO broadcasts (title, message, target_segment, 
-                                      scheduled_time, status, created_by)
-                VALUES (?, ?, ?, ?, ?, ?)
+                                      scheduled_time, status, created_by, media, media_file_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                 (f"Розсилка від {datetime.now().strftime('%d.%m.%Y %H:%M')}", 
-                 message_text, audience, scheduled_for, status, admin_id)
+                 message_text, audience, scheduled_for, status, admin_id, media, media_file_id)
             )
             await db.commit()
             return cursor.lastrowid
@@ -725,13 +1641,34 @@ async def save_broadcast(admin_id: int, message_text: str, audience: str,
         logger.error(f"Помилка збереження розсилки: {e}")
         return 0
 
+@db_timed
+async def update_broadcast_status(broadcast_id: int, status: str) -> bool:
+    """Оновити статус розсилки (для 'sent' також фіксується час відправки)"""
+    try:
+        async with _writer() as db:
+            await db.execute(
+                """
+                UPDATE broadcasts
+                SET status = ?,
+                    sent_at = CASE WHEN ? = 'sent' THEN CURRENT_TIMESTAMP ELSE sent_at END
+                WHERE id = ?
+                """,
+                (status, status, broadcast_id)
+            )
+            await db.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Помилка оновлення статусу розсилки {broadcast_id}: {e}")
+        return False
+
+@db_timed
 async def get_scheduled_broadcasts() -> List[dict]:
     """Отримати заплановані розсилки"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 """
-                SELECT id, message, target_segment, scheduled_time, created_at
+                SELECT id, message, target_segment, scheduled_time, created_at, media
                 FROM broadcasts 
                 WHERE status = 'pending' AND scheduled_time IS NOT NULL
                 ORDER BY scheduled_time ASC
@@ -744,7 +1681,8 @@ async def get_scheduled_broadcasts() -> List[dict]:
                         "message_text": row[1],
                         "audience_type": row[2], 
                         "scheduled_for": row[3],
-                        "created_at": row[4]
+                        "created_at": row[4],
+                        "media": row[5]
                     }
                     for row in rows
                 ]
@@ -752,10 +1690,11 @@ async def get_scheduled_broadcasts() -> List[dict]:
         logger.error(f"Помилка отримання запланованих розсилок: {e}")
         return []
 
+@db_timed
 async def get_broadcast_history(limit: int = 20) -> List[dict]:
     """Отримати історію розсилок"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 """
                 SELECT b.id, b.message, b.target_segment, b.status,
@@ -783,18 +1722,415 @@ async def get_broadcast_history(limit: int = 20) -> List[dict]:
         logger.error(f"Помилка отримання історії розсилок: {e}")
         return []
 
+# Функції для доставки розсилок (broadcast_log як журнал одержувачів)
+# Статуси рядка: pending -> claimed (взято в роботу) -> sent / blocked / not_found / failed.
+# claimed без результату після перезапуску стає unknown: повідомлення могло піти, повтору немає
+
+@db_timed
+async def create_broadcast_recipients(broadcast_id: int, segment: str) -> int:
+    """
+    Зафіксувати список одержувачів розсилки (один раз, в одній транзакції)
+    Повертає кількість одержувачів
+    """
+    condition = _SEGMENT_FILTERS.get(segment)
+    if condition is None:
+        raise ValueError(f"Невідомий сегмент аудиторії: {segment}")
+    
+    async with _writer() as db:
+        async with db.execute(
+            "SELECT COUNT(*) FROM broadcast_log WHERE broadcast_id = ?", (broadcast_id,)
+        ) as cursor:
+            existing = (await cursor.fetchone())[0]
+        if existing:
+            return existing
+        
+        cursor = await db.execute(
+            f"""
+            INSERT INTO broadcast_log (broadcast_id, user_id, status, sent_at)
+            SELECT ?, u.id, 'pending', NULL FROM users u WHERE {condition} ORDER BY u.id
+            """,
+            (broadcast_id,)
+        )
+        await db.commit()
+        return cursor.rowcount
+
+_RECORD_OUTCOME_SQL = """
+    UPDATE broadcast_log
+    SET status = ?, error_message = ?, latency_ms = ?, sent_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+"""
+
+@db_timed
+async def claim_broadcast_recipients(broadcast_id: int, limit: int, shard: Optional[tuple] = None,
+                                     outcomes: Optional[List[tuple]] = None) -> List[tuple]:
+    """
+    Взяти в роботу наступну порцію одержувачів: список (id рядка журналу, user_id)
+    shard=(номер, кількість) - лише одержувачі з user_id % кількість == номер;
+    outcomes - результати попередніх одержувачів, що записуються в тій же транзакції
+    """
+    shard_filter = "AND user_id % ? = ?" if shard else ""
+    shard_params = (shard[1], shard[0]) if shard else ()
+    async with _writer() as db:
+        if outcomes:
+            await db.executemany(_RECORD_OUTCOME_SQL, outcomes)
+        async with db.execute(
+            f"""
+            UPDATE broadcast_log SET status = 'claimed'
+            WHERE id IN (
+                SELECT id FROM broadcast_log
+                WHERE broadcast_id = ? AND status = 'pending' {shard_filter}
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, user_id
+            """,
+            (broadcast_id, *shard_params, limit)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        await db.commit()
+        return sorted(rows)
+
+@db_timed
+async def record_broadcast_outcomes(outcomes: List[tuple]):
+    """Зберегти результати доставки: список (status, error_message, latency_ms, id рядка журналу)"""
+    async with _writer() as db:
+        await db.executemany(_RECORD_OUTCOME_SQL, outcomes)
+        await db.commit()
+
+@db_timed
+async def release_claimed_recipients(broadcast_id: int) -> int:
+    """Позначити як unknown одержувачів, взятих в роботу до перезапуску (без повторної відправки)"""
+    async with _writer() as db:
+        cursor = await db.execute(
+            "UPDATE broadcast_log SET status = 'unknown' WHERE broadcast_id = ? AND status = 'claimed'",
+            (broadcast_id,)
+        )
+        await db.commit()
+        return cursor.rowcount
+
+@db_timed
+async def get_broadcast_progress(broadcast_id: int) -> Dict[str, int]:
+    """Кількість одержувачів розсилки за статусами"""
+    try:
+        async with _reader() as db:
+            async with db.execute(
+                "SELECT status, COUNT(*) FROM broadcast_log WHERE broadcast_id = ? GROUP BY status",
+                (broadcast_id,)
+            ) as cursor:
+                return {status: count for status, count in await cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Помилка отримання прогресу розсилки {broadcast_id}: {e}")
+        return {}
+
+async def _latency_percentile(db: aiosqlite.Connection, broadcast_id: int,
+                              count: int, fraction: float) -> Optional[int]:
+    """Перцентиль тривалості успішних відправок (вибірка одного рядка з відсортованих)"""
+    if not count:
+        return None
+    async with db.execute(
+        """
+        SELECT latency_ms FROM broadcast_log
+        WHERE broadcast_id = ? AND status = 'sent' AND latency_ms IS NOT NULL
+        ORDER BY latency_ms LIMIT 1 OFFSET ?
+        """,
+        (broadcast_id, int((count - 1) * fraction))
+    ) as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+@db_timed
+async def save_broadcast_stats(broadcast_id: int, elapsed: Optional[float] = None) -> bool:
+    """
+    Порахувати підсумки завершеної розсилки з broadcast_log та зберегти в broadcast_stats
+    Виконується один раз при завершенні; екран статистики читає лише broadcast_stats.
+    Агрегація йде через з'єднання для читання, тож не блокує інші записи
+    """
+    try:
+        async with _reader() as db:
+            async with db.execute(
+                """
+                SELECT status, COUNT(*), COUNT(latency_ms), COALESCE(SUM(latency_ms), 0)
+                FROM broadcast_log WHERE broadcast_id = ?
+                GROUP BY status
+                """,
+                (broadcast_id,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            error_classes = {status: count for status, count, _, _ in rows}
+            total = sum(error_classes.values())
+            sent = error_classes.pop("sent", 0)
+            latency_count, latency_sum = next(
+                ((count, total_ms) for status, _, count, total_ms in rows if status == "sent"), (0, 0)
+            )
+
+            async with db.execute(
+                """
+                SELECT error_message, COUNT(*) FROM broadcast_log
+                WHERE broadcast_id = ? AND status != 'sent' AND error_message IS NOT NULL
+                GROUP BY error_message ORDER BY COUNT(*) DESC LIMIT 5
+                """,
+                (broadcast_id,)
+            ) as cursor:
+                top_errors = [list(row) for row in await cursor.fetchall()]
+
+            median = await _latency_percentile(db, broadcast_id, latency_count, 0.5)
+            p95 = await _latency_percentile(db, broadcast_id, latency_count, 0.95)
+
+        async with _writer() as db:
+            await db.execute(
+                """
+                INSERT OR REPLACE INTO broadcast_stats (
+                    broadcast_id, total, sent, failed, error_classes, top_errors,
+                    latency_count, latency_sum_ms, median_latency_ms, p95_latency_ms, elapsed_seconds
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (broadcast_id, total, sent, total - sent,
+                 json.dumps(error_classes), json.dumps(top_errors, ensure_ascii=False),
+                 latency_count, latency_sum, median, p95, elapsed)
+            )
+            await db.execute("DELETE FROM broadcast_error_classes WHERE broadcast_id = ?", (broadcast_id,))
+            await db.executemany(
+                "INSERT INTO broadcast_error_classes (broadcast_id, status, count) VALUES (?, ?, ?)",
+                [(broadcast_id, status, count) for status, count in error_classes.items()]
+            )
+            await db.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Помилка збереження статистики розсилки {broadcast_id}: {e}")
+        return False
+
+@db_timed
+async def get_broadcast_stats_summary(recent: int = 5) -> dict:
+    """Статистика розсилок для адмінки: загальні підсумки та останні розсилки (з broadcast_stats)"""
+    try:
+        async with _reader() as db:
+            async with db.execute(
+                """
+                SELECT COUNT(*), COALESCE(SUM(total), 0), COALESCE(SUM(sent), 0),
+                       COALESCE(SUM(failed), 0), COALESCE(SUM(latency_count), 0),
+                       COALESCE(SUM(latency_sum_ms), 0)
+                FROM broadcast_stats
+                """
+            ) as cursor:
+                broadcasts, total, sent, failed, latency_count, latency_sum = await cursor.fetchone()
+
+            async with db.execute(
+                "SELECT status, SUM(count) FROM broadcast_error_classes GROUP BY status"
+            ) as cursor:
+                error_classes = {status: count for status, count in await cursor.fetchall()}
+
+            async with db.execute(
+                """
+                SELECT s.broadcast_id, b.message, s.total, s.sent, s.failed,
+                       s.median_latency_ms, s.p95_latency_ms, s.elapsed_seconds, s.completed_at,
+                       s.top_errors
+                FROM broadcast_stats s
+                LEFT JOIN broadcasts b ON b.id = s.broadcast_id
+                ORDER BY s.broadcast_id DESC LIMIT ?
+                """,
+                (recent,)
+            ) as cursor:
+                recent_rows = await cursor.fetchall()
+
+            return {
+                "broadcasts": broadcasts,
+                "total": total,
+                "sent": sent,
+                "failed": failed,
+                "delivery_rate": round(sent / total * 100, 1) if total else 0.0,
+                "avg_latency_ms": round(latency_sum / latency_count) if latency_count else None,
+                "error_classes": error_classes,
+                "recent": [
+                    {
+                        "broadcast_id": row[0],
+                        "message_text": row[1] or "",
+                        "total": row[2],
+                        "sent": row[3],
+                        "failed": row[4],
+                        "median_latency_ms": row[5],
+                        "p95_latency_ms": row[6],
+                        "elapsed_seconds": row[7],
+                        "completed_at": row[8],
+                        "top_errors": json.loads(row[9] or "[]")
+                    }
+                    for row in recent_rows
+                ]
+            }
+    except Exception as e:
+        logger.error(f"Помилка отримання статистики розсилок: {e}")
+        return {}
+
+# Функції зберігання журналу розсилок (архівація старих рядків broadcast_log)
+@db_timed
+async def get_archivable_broadcasts(older_than_days: int, max_rows: int) -> List[int]:
+    """
+    Завершені розсилки, журнал яких час перенести в архів: завершені понад older_than_days
+    днів тому, а також найстаріші з решти, поки в broadcast_log більше max_rows рядків
+    """
+    try:
+        async with _reader() as db:
+            async with db.execute("SELECT COUNT(*) FROM broadcast_log") as cursor:
+                hot_rows = (await cursor.fetchone())[0]
+            async with db.execute(
+                """
+                SELECT b.id, COUNT(*),
+                       COALESCE(b.sent_at, b.created_at) < datetime('now', ?)
+                FROM broadcasts b
+                JOIN broadcast_log l ON l.broadcast_id = b.id
+                WHERE b.status IN ('sent', 'failed')
+                GROUP BY b.id
+                ORDER BY b.id
+                """,
+                (f"-{older_than_days} days",)
+            ) as cursor:
+                rows = await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Помилка вибору розсилок для архівації: {e}")
+        return []
+
+    archivable = []
+    for broadcast_id, count, expired in rows:
+        if expired or hot_rows > max_rows:
+            archivable.append(broadcast_id)
+            hot_rows -= count
+    return archivable
+
+async def iter_broadcast_log(broadcast_id: int, chunk_size: int = 5000) -> AsyncIterator[List[dict]]:
+    """Рядки журналу розсилки порціями по chunk_size (keyset за id)"""
+    last_id = 0
+    while True:
+        async with _reader() as db:
+            async with db.execute(
+                """
+                SELECT id, user_id, status, error_message, latency_ms, sent_at
+                FROM broadcast_log
+                WHERE broadcast_id = ? AND id > ?
+                ORDER BY id LIMIT ?
+                """,
+                (broadcast_id, last_id, chunk_size)
+            ) as cursor:
+                rows = await cursor.fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [
+            {
+                "id": row[0],
+                "user_id": row[1],
+                "status": row[2],
+                "error_message": row[3],
+                "latency_ms": row[4],
+                "sent_at": row[5]
+            }
+            for row in rows
+        ]
+
+@db_timed
+async def archive_broadcast_log(broadcast_id: int, archive_path: str, last_log_id: int) -> int:
+    """
+    Видалити заархівовані рядки розсилки (id <= last_log_id) та додати archive_path до
+    archive_paths (JSON список частин архіву) в одній транзакції
+    Викликається лише після того, як файл повністю записано в тимчасовий і перейменовано
+    (services.retention): якщо збій стався до цього виклику, рядки лишаються в БД, а
+    повторний прохід перепише той самий файл (ім'я задає діапазон id); після commit рядки
+    видалено і шлях до файлу вже збережено
+    """
+    async with _writer() as db:
+        cursor = await db.execute(
+            "DELETE FROM broadcast_log WHERE broadcast_id = ? AND id <= ?",
+            (broadcast_id, last_log_id)
+        )
+        await db.execute(
+            """
+            UPDATE broadcast_stats
+            SET archived_at = CURRENT_TIMESTAMP,
+                archive_paths = json_insert(COALESCE(archive_paths, '[]'), '$[#]', ?)
+            WHERE broadcast_id = ?
+            """,
+            (archive_path, broadcast_id)
+        )
+        await db.commit()
+        return cursor.rowcount
+
+@db_timed
+async def has_broadcast_stats(broadcast_id: int) -> bool:
+    """Чи пораховані підсумки розсилки"""
+    async with _reader() as db:
+        async with db.execute(
+            "SELECT 1 FROM broadcast_stats WHERE broadcast_id = ?", (broadcast_id,)
+        ) as cursor:
+            return await cursor.fetchone() is not None
+
+@db_timed
+async def enable_incremental_vacuum(convert: bool = True) -> bool:
+    """
+    Увімкнути auto_vacuum = INCREMENTAL для БД, створеної без нього
+    Потребує одного повного VACUUM (перезапис файлу БД, тільки якщо convert);
+    повертає True, якщо режим вже увімкнено
+    """
+    async with _writer() as db:
+        async with db.execute("PRAGMA auto_vacuum") as cursor:
+            if (await cursor.fetchone())[0] == 2:
+                return True
+        if not convert:
+            return False
+        logger.info("Перемикання БД на auto_vacuum = INCREMENTAL (одноразовий VACUUM)")
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await db.execute("VACUUM")
+        return False
+
+@db_timed
+async def incremental_vacuum() -> int:
+    """Повернути вільні сторінки БД файловій системі; повертає кількість звільнених сторінок"""
+    async with _writer() as db:
+        async with db.execute("PRAGMA freelist_count") as cursor:
+            free_pages = (await cursor.fetchone())[0]
+        # executescript виконує PRAGMA до кінця (execute звільняє лише одну сторінку за крок)
+        await db.executescript("PRAGMA incremental_vacuum;")
+        return free_pages
+
+@db_timed
+async def get_broadcasts_by_status(status: str) -> List[dict]:
+    """Отримати розсилки з заданим статусом (для відновлення після перезапуску)"""
+    try:
+        async with _reader() as db:
+            async with db.execute(
+                """
+                SELECT id, message, target_segment, created_by, media
+                FROM broadcasts WHERE status = ?
+                ORDER BY id
+                """,
+                (status,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                return [
+                    {
+                        "id": row[0],
+                        "message_text": row[1],
+                        "audience_type": row[2],
+                        "admin_id": row[3],
+                        "media": row[4]
+                    }
+                    for row in rows
+                ]
+    except Exception as e:
+        logger.error(f"Помилка отримання розсилок зі статусом {status}: {e}")
+        return []
+
+@db_timed
 async def save_recurring_broadcast(admin_id: int, message_text: str, audience: str, 
-                                 recurring_type: str, cron_expression: str = None) -> int:
+                                 recurring_type: str, cron_expression: str = None,
+                                 media: str = None) -> int:
     """Зберегти регулярну розсилку"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
             cursor = await db.execute(
                 """
                 INSERT INTO recurring_broadcasts (admin_id, message_text, audience_type, 
-                                                 recurring_type, cron_expression, status)
-                VALUES (?, ?, ?, ?, ?, 'active')
+                                                 recurring_type, cron_expression, media, status)
+                VALUES (?, ?, ?, ?, ?, ?, 'active')
                 """,
-                (admin_id, message_text, audience, recurring_type, cron_expression)
+                (admin_id, message_text, audience, recurring_type, cron_expression, media)
             )
             await db.commit()
             return cursor.lastrowid
@@ -802,14 +2138,15 @@ async def save_recurring_broadcast(admin_id: int, message_text: str, audience: s
         logger.error(f"Помилка збереження регулярної розсилки: {e}")
         return 0
 
+@db_timed
 async def get_active_recurring_broadcasts() -> List[dict]:
     """Отримати активні регулярні розсилки"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 """
                 SELECT id, message_text, audience_type, recurring_type, 
-                       cron_expression, created_at
+                       cron_expression, created_at, admin_id, next_run, media
                 FROM recurring_broadcasts 
                 WHERE status = 'active'
                 ORDER BY created_at DESC
@@ -823,7 +2160,10 @@ async def get_active_recurring_broadcasts() -> List[dict]:
                         "audience_type": row[2], 
                         "recurring_type": row[3],
                         "cron_expression": row[4],
-                        "created_at": row[5]
+                        "created_at": row[5],
+                        "admin_id": row[6],
+                        "next_run": row[7],
+                        "media": row[8]
                     }
                     for row in rows
                 ]
@@ -831,10 +2171,32 @@ async def get_active_recurring_broadcasts() -> List[dict]:
         logger.error(f"Помилка отримання регулярних розсилок: {e}")
         return []
 
+@db_timed
+async def update_recurring_schedule(broadcast_id: int, next_run: Optional[str],
+                                    mark_run: bool = False) -> bool:
+    """Зберегти час наступного запуску регулярної розсилки (mark_run - також last_run = зараз)"""
+    try:
+        async with _writer() as db:
+            await db.execute(
+                """
+                UPDATE recurring_broadcasts
+                SET next_run = ?,
+                    last_run = CASE WHEN ? THEN CURRENT_TIMESTAMP ELSE last_run END
+                WHERE id = ?
+                """,
+                (next_run, mark_run, broadcast_id)
+            )
+            await db.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Помилка оновлення розкладу регулярної розсилки {broadcast_id}: {e}")
+        return False
+
+@db_timed
 async def delete_scheduled_broadcast(broadcast_id: int) -> bool:
     """Видалити заплановану розсилку"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
             await db.execute(
                 "DELETE FROM broadcasts WHERE id = ? AND status = 'pending'",
                 (broadcast_id,)
@@ -845,10 +2207,11 @@ async def delete_scheduled_broadcast(broadcast_id: int) -> bool:
         logger.error(f"Помилка видалення запланованої розсилки {broadcast_id}: {e}")
         return False
 
+@db_timed
 async def delete_recurring_broadcast(broadcast_id: int) -> bool:
     """Видалити регулярну розсилку"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
             await db.execute(
                 "UPDATE recurring_broadcasts SET status = 'deleted' WHERE id = ?",
                 (broadcast_id,)
@@ -859,13 +2222,14 @@ async def delete_recurring_broadcast(broadcast_id: int) -> bool:
         logger.error(f"Помилка видалення регулярної розсилки {broadcast_id}: {e}")
         return False
 
+@db_timed
 async def get_broadcast_by_id(broadcast_id: int) -> dict:
     """Отримати розсилку за ID"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 """
-                SELECT id, message, target_segment, scheduled_time, status, created_at
+                SELECT id, message, target_segment, scheduled_time, status, created_at, created_by, media
                 FROM broadcasts WHERE id = ?
                 """,
                 (broadcast_id,)
@@ -878,21 +2242,24 @@ async def get_broadcast_by_id(broadcast_id: int) -> dict:
                         "audience_type": row[2],
                         "scheduled_for": row[3],
                         "status": row[4],
-                        "created_at": row[5]
+                        "created_at": row[5],
+                        "admin_id": row[6],
+                        "media": row[7]
                     }
                 return {}
     except Exception as e:
         logger.error(f"Помилка отримання розсилки {broadcast_id}: {e}")
         return {}
 
+@db_timed
 async def get_recurring_broadcast_by_id(broadcast_id: int) -> dict:
     """Отримати регулярну розсилку за ID"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _reader() as db:
             async with db.execute(
                 """
                 SELECT id, message_text, audience_type, recurring_type, 
-                       cron_expression, status, created_at
+                       cron_expression, status, created_at, admin_id, last_run, next_run, media
                 FROM recurring_broadcasts WHERE id = ?
                 """,
                 (broadcast_id,)
@@ -906,7 +2273,11 @@ async def get_recurring_broadcast_by_id(broadcast_id: int) -> dict:
                         "recurring_type": row[3],
                         "cron_expression": row[4],
                         "status": row[5],
-                        "created_at": row[6]
+                        "created_at": row[6],
+                        "admin_id": row[7],
+                        "last_run": row[8],
+                        "next_run": row[9],
+                        "media": row[10]
                     }
                 return {}
     except Exception as e:
@@ -4,29 +4,29 @@
 
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import re
 
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 
-from config import ADMIN_ID, CALLBACK_PREFIXES
+from config import ADMIN_ID, CALLBACK_PREFIXES, AUDIENCE_NAMES
 from db import (
-    get_users_count, get_active_users_count, get_new_users_count,
-    get_courses_count, get_purchases_count, get_users_with_purchases_count,
-    get_daily_interactions, get_weekly_interactions,
-    get_users_by_segment, save_broadcast, get_scheduled_broadcasts, get_broadcast_history,
+    get_users_count, get_courses_count, get_dashboard_snapshot,
+    count_users_by_segment, save_broadcast, get_scheduled_broadcasts, get_broadcast_history,
     save_recurring_broadcast, get_active_recurring_broadcasts,
     delete_scheduled_broadcast, delete_recurring_broadcast,
     get_broadcast_by_id, get_recurring_broadcast_by_id,
     search_users, get_users_list, get_user_purchases, get_all_purchases,
-    get_purchases_stats, block_user, get_user
+    get_purchases_stats, block_user, get_user, checkpoint_db, get_broadcast_stats_summary,
+    enable_incremental_vacuum
 )
 from keyboards import (
     admin_main_menu, admin_broadcasts_menu, admin_users_menu,
-    admin_courses_menu, admin_settings_menu, admin_back_to_main,
+    admin_courses_menu, admin_settings_menu, admin_back_to_main, admin_compact_db_confirm_keyboard,
     main_menu, broadcast_audience_keyboard, broadcast_schedule_keyboard,
     broadcast_confirm_keyboard, broadcast_back_to_menu_keyboard,
     broadcast_recurring_type_keyboard, broadcast_datetime_keyboard,
@@ -40,6 +40,11 @@ from messages import (
     ERROR_MESSAGE
 )
 from services.zenedu_client import sync_courses, check_zenedu_connection
+from services.broadcast_sender import start_broadcast
+from services.broadcast_media import BroadcastMedia, album_collector
+from services.scheduler import broadcast_scheduler, local_now
+from services.retention import broadcast_log_retention
+from services.cron import CronExpression, CronError, parse_cron
 from middleware.auth import is_admin
 from states.broadcast_states import BroadcastStates, UserManagementStates
 
@@ -151,29 +156,19 @@ async def admin_analytics_handler(callback: CallbackQuery):
     
     try:
         logger.info("🔄 Збираю статистику...")
-        # Збираємо статистику
-        total_users = await get_users_count()
-        new_users_day = await get_new_users_count(days=1)
-        new_users_week = await get_new_users_count(days=7)
-        new_users_month = await get_new_users_count(days=30)
-        active_week = await get_active_users_count(days=7)
-        course_purchases = await get_purchases_count()
-        users_with_purchases = await get_users_with_purchases_count()
-        
-        # Розраховуємо взаємодії
-        daily_interactions = await get_daily_interactions()
-        weekly_interactions = await get_weekly_interactions()
+        # Збираємо всю статистику одним запитом
+        snapshot = await get_dashboard_snapshot()
         
         analytics_text = ADMIN_ANALYTICS_MESSAGE.format(
-            users_count=total_users,
-            new_users_day=new_users_day,
-            new_users_week=new_users_week,
-            new_users_month=new_users_month,
-            active_week=active_week,
-            course_purchases=course_purchases,
-            users_with_purchases=users_with_purchases,
-            daily_interactions=daily_interactions,
-            weekly_interactions=weekly_interactions
+            users_count=snapshot.users_count,
+            new_users_day=snapshot.new_users_day,
+            new_users_week=snapshot.new_users_week,
+            new_users_month=snapshot.new_users_month,
+            active_week=snapshot.active_week,
+            course_purchases=snapshot.course_purchases,
+            users_with_purchases=snapshot.users_with_purchases,
+            daily_interactions=snapshot.daily_interactions,
+            weekly_interactions=snapshot.weekly_interactions
         )
         
         logger.info("📊 Відправляю аналітику...")
@@ -314,7 +309,7 @@ async def admin_broadcast_new_handler(callback: CallbackQuery, state: FSMContext
         await callback.message.edit_text(
             "📬 Створення нової розсилки\n\n"
             "📝 Надішліть текст повідомлення для розсилки.\n"
-            "Можна додати медіа (фото, відео).",
+            "Можна надіслати фото, відео, документ або альбом з підписом.",
             reply_markup=broadcast_back_to_menu_keyboard()
         )
         await callback.answer()
@@ -325,6 +320,49 @@ async def admin_broadcast_new_handler(callback: CallbackQuery, state: FSMContext
         logger.error(f"Помилка в admin_broadcast_new_handler: {e}")
         await callback.answer("Помилка створення розсилки")
 
+async def read_broadcast_message(message: Message) -> Optional[Dict[str, Any]]:
+    """
+    Дані розсилки з повідомлення адміна: текст або медіа (частини альбому збираються разом)
+    None - чекаємо решту альбому або тип повідомлення не підтримується (адміну вже відповіли)
+    """
+    if message.media_group_id:
+        messages = await album_collector.collect(message)
+        if messages is None:
+            return None
+    else:
+        messages = [message]
+    
+    try:
+        media = BroadcastMedia.from_messages(messages)
+    except ValueError as e:
+        await message.answer(
+            f"❌ Таке повідомлення не можна розіслати: {e}.\n\n"
+            "Надішліть текст, фото, відео, документ або альбом.",
+            reply_markup=broadcast_back_to_menu_keyboard()
+        )
+        return None
+    
+    if media is None:
+        # Текст розсилається з HTML-розміткою бота за замовчуванням; попередній перегляд
+        # перевіряє розмітку, щоб помилка в ній не зіпсувала доставку всім одержувачам
+        try:
+            await message.answer(f"👁 Попередній перегляд:\n\n{message.text}")
+        except TelegramBadRequest as e:
+            await message.answer(
+                f"❌ Помилка в HTML-розмітці: {e.message}\n\n"
+                "Виправте текст і надішліть ще раз.",
+                reply_markup=broadcast_back_to_menu_keyboard(),
+                parse_mode=None
+            )
+            return None
+    
+    return {
+        # Для медіа - опис (тип та підпис) для списків і підтверджень
+        "message_text": media.describe() if media else message.text,
+        "media": media.to_json() if media else None,
+        "message_id": messages[0].message_id
+    }
+
 # Обробник тексту розсилки
 @router.message(BroadcastStates.waiting_for_message)
 async def broadcast_message_handler(message: Message, state: FSMContext):
@@ -335,21 +373,13 @@ async def broadcast_message_handler(message: Message, state: FSMContext):
         return
     
     try:
-        # Зберігаємо текст повідомлення
-        message_text = message.text or message.caption or ""
-        if not message_text:
-            await message.answer(
-                "❌ Повідомлення має містити текст.\n\n"
-                "Спробуйте ще раз або скасуйте створення розсилки.",
-                reply_markup=broadcast_back_to_menu_keyboard()
-            )
+        broadcast_message = await read_broadcast_message(message)
+        if broadcast_message is None:
             return
+        message_text = broadcast_message["message_text"]
         
         # Зберігаємо дані в стан
-        await state.update_data(
-            message_text=message_text,
-            message_id=message.message_id
-        )
+        await state.update_data(**broadcast_message)
         
         # Переходимо до вибору аудиторії
         await state.set_state(BroadcastStates.selecting_audience)
@@ -378,19 +408,13 @@ async def broadcast_audience_handler(callback: CallbackQuery, state: FSMContext)
     try:
         audience_type = callback.data.split("_")[1]  # all, buyers, inactive
         
-        audience_names = {
-            "all": "👥 Усі користувачі",
-            "buyers": "💰 Покупці курсів", 
-            "inactive": "😴 Неактивні 7+ днів"
-        }
-        
         # Отримуємо кількість користувачів в сегменті
-        users_count = len(await get_users_by_segment(audience_type))
+        users_count = await count_users_by_segment(audience_type)
         
         # Перевіряємо чи є користувачі в сегменті ОДРАЗУ
         if users_count == 0:
             await callback.message.edit_text(
-                f"❌ Не знайдено користувачів для розсилки в сегменті: {audience_names[audience_type]}\n\n"
+                f"❌ Не знайдено користувачів для розсилки в сегменті: {AUDIENCE_NAMES[audience_type]}\n\n"
                 "👥 Оберіть інший сегмент аудиторії:",
                 reply_markup=broadcast_audience_keyboard()
             )
@@ -401,7 +425,7 @@ async def broadcast_audience_handler(callback: CallbackQuery, state: FSMContext)
         # Зберігаємо вибір аудиторії
         await state.update_data(
             audience_type=audience_type,
-            audience_name=audience_names[audience_type],
+            audience_name=AUDIENCE_NAMES[audience_type],
             users_count=users_count
         )
         
@@ -409,7 +433,7 @@ async def broadcast_audience_handler(callback: CallbackQuery, state: FSMContext)
         await state.set_state(BroadcastStates.selecting_schedule)
         
         await callback.message.edit_text(
-            f"✅ Обрано: {audience_names[audience_type]}\n"
+            f"✅ Обрано: {AUDIENCE_NAMES[audience_type]}\n"
             f"📊 Користувачів в сегменті: {users_count}\n\n"
             f"📅 Коли відправити розсилку?",
             reply_markup=broadcast_schedule_keyboard()
@@ -645,6 +669,8 @@ async def broadcast_confirm_delete_scheduled_handler(callback: CallbackQuery):
         
         # Видаляємо розсилку
         success = await delete_scheduled_broadcast(broadcast_id)
+        if success:
+            broadcast_scheduler.unschedule_broadcast(broadcast_id)
         
         if success:
             await callback.answer("✅ Розсилку успішно видалено!")
@@ -674,6 +700,8 @@ async def broadcast_confirm_delete_recurring_handler(callback: CallbackQuery):
         
         # Видаляємо регулярну розсилку
         success = await delete_recurring_broadcast(broadcast_id)
+        if success:
+            broadcast_scheduler.unschedule_recurring(broadcast_id)
         
         if success:
             await callback.answer("✅ Регулярну розсилку успішно видалено!")
@@ -690,6 +718,18 @@ async def broadcast_confirm_delete_recurring_handler(callback: CallbackQuery):
         await callback.answer("Помилка видалення регулярної розсилки")
 
 # Статистика розсилок
+# Підписи статусів доставки в статистиці розсилок
+BROADCAST_ERROR_LABELS = {
+    "blocked": "заблокували бота",
+    "not_found": "чат не знайдено",
+    "failed": "інші помилки",
+    "unknown": "невідомо (перезапуск)",
+}
+
+def format_latency(latency_ms) -> str:
+    """Тривалість відправки для статистики"""
+    return f"{latency_ms} мс" if latency_ms is not None else "—"
+
 @router.callback_query(F.data == "adm:broadcast_stats")
 async def admin_broadcast_stats_handler(callback: CallbackQuery):
     """Показати статистику розсилок"""
@@ -700,17 +740,38 @@ async def admin_broadcast_stats_handler(callback: CallbackQuery):
         return
     
     try:
-        # Базова статистика (заглушка, можна розширити)
-        text = "📊 Статистика розсилок\n\n" \
-               "📤 Всього відправлено: 0\n" \
-               "✅ Успішних: 0\n" \
-               "❌ Помилок: 0\n" \
-               "📈 Середня доставка: 0%\n\n" \
-               "📊 Детальна статистика буде доступна після перших розсилок."
+        # Підсумки рахуються при завершенні кожної розсилки (таблиця broadcast_stats)
+        stats = await get_broadcast_stats_summary()
         
+        if not stats.get("broadcasts"):
+            text = "📊 Статистика розсилок\n\n" \
+                   "📊 Детальна статистика буде доступна після перших розсилок."
+        else:
+            text = "📊 Статистика розсилок\n\n" \
+                   f"📬 Завершених розсилок: {stats['broadcasts']}\n" \
+                   f"📤 Всього одержувачів: {stats['total']}\n" \
+                   f"✅ Доставлено: {stats['sent']}\n" \
+                   f"❌ Помилок: {stats['failed']}\n"
+            for status, count in sorted(stats['error_classes'].items(), key=lambda item: -item[1]):
+                text += f"   • {BROADCAST_ERROR_LABELS.get(status, status)}: {count}\n"
+            text += f"📈 Середня доставка: {stats['delivery_rate']}%\n" \
+                    f"⏱ Середній час відправки: {format_latency(stats['avg_latency_ms'])}\n\n" \
+                    "🗂 Останні розсилки:\n"
+            for broadcast in stats['recent']:
+                rate = round(broadcast['sent'] / broadcast['total'] * 100, 1) if broadcast['total'] else 0.0
+                text += f"\n#{broadcast['broadcast_id']} {broadcast['message_text'][:25]}...\n" \
+                        f"   ✅ {broadcast['sent']}/{broadcast['total']} ({rate}%), ❌ {broadcast['failed']}\n" \
+                        f"   ⏱ медіана {format_latency(broadcast['median_latency_ms'])}, " \
+                        f"p95 {format_latency(broadcast['p95_latency_ms'])}\n"
+                if broadcast['top_errors']:
+                    error, count = broadcast['top_errors'][0]
+                    text += f"   ⚠️ {error[:60]} ({count})\n"
+        
+        # Без розмітки: текст розсилок може містити символи HTML
         await callback.message.edit_text(
             text,
-            reply_markup=broadcast_back_to_menu_keyboard()
+            reply_markup=broadcast_back_to_menu_keyboard(),
+            parse_mode=None
         )
         await callback.answer()
         
@@ -807,19 +868,23 @@ async def broadcast_confirm_send_handler(callback: CallbackQuery, state: FSMCont
         # Отримуємо дані з стану
         data = await state.get_data()
         
-        # Отримуємо список користувачів для розсилки
-        users = await get_users_by_segment(data['audience_type'])
+        # Кількість користувачів для розсилки (самі одержувачі фіксуються при доставці)
+        users_count = await count_users_by_segment(data['audience_type'])
+        media = BroadcastMedia.from_json(data.get('media'))
+        media_file_id = media.file_id if media else None
         
         # Перевірка користувачів вже виконується на етапі вибору аудиторії
         
         # Обробляємо різні типи розсилок
         if data.get('schedule_type') == 'immediate':
-            # Миттєва відправка
+            # Миттєва відправка (статус змінює рушій доставки)
             broadcast_id = await save_broadcast(
                 admin_id=user_id,
                 message_text=data['message_text'],
                 audience=data['audience_type'],
-                status="sent"
+                status="sending",
+                media=data.get('media'),
+                media_file_id=media_file_id
             )
             
         elif data.get('schedule_type') == 'scheduled':
@@ -829,8 +894,12 @@ async def broadcast_confirm_send_handler(callback: CallbackQuery, state: FSMCont
                 message_text=data['message_text'],
                 audience=data['audience_type'],
                 scheduled_for=data['scheduled_datetime'],
-                status="pending"
+                status="pending",
+                media=data.get('media'),
+                media_file_id=media_file_id
             )
+            if broadcast_id:
+                broadcast_scheduler.schedule_broadcast(broadcast_id, data['scheduled_datetime'])
             
         elif data.get('schedule_type') == 'recurring':
             # Регулярна розсилка
@@ -839,48 +908,41 @@ async def broadcast_confirm_send_handler(callback: CallbackQuery, state: FSMCont
                 message_text=data['message_text'],
                 audience=data['audience_type'],
                 recurring_type=data['recurring_type'],
-                cron_expression=data['cron_expression']
+                cron_expression=data['cron_expression'],
+                media=data.get('media')
             )
+            if broadcast_id:
+                await broadcast_scheduler.schedule_recurring(broadcast_id, data['cron_expression'])
         
         # Обробляємо результат залежно від типу розсилки
         if data.get('schedule_type') == 'immediate':
-            # Миттєва відправка - показуємо прогрес
+            # Миттєва відправка - доставка йде у фоні, звіт з'явиться в цьому ж повідомленні
             await callback.message.edit_text(
                 f"📤 Відправляємо розсилку...\n\n"
-                f"👥 Користувачів: {len(users)}\n"
+                f"👥 Користувачів: {users_count}\n"
                 f"📝 Текст: {data['message_text'][:50]}...",
                 reply_markup=None
             )
+            start_broadcast(
+                callback.bot, broadcast_id, data['message_text'], data['audience_type'],
+                audience_name=data['audience_name'],
+                report_chat_id=callback.message.chat.id,
+                report_message_id=callback.message.message_id,
+                media=media
+            )
+            await callback.answer()
+            await state.clear()
+            logger.info(f"Адмін {user_id} запустив розсилку {broadcast_id} для {users_count} користувачів")
+            return
             
-            # Імітуємо відправку (потрібно реалізувати реальну відправку)
-            sent_count = 0
-            error_count = 0
-            
-            # TODO: Реалізувати реальну відправку повідомлень
-            # Поки що просто імітуємо успішну відправку
-            sent_count = len(users)
-            
-            # Результат миттєвої відправки
-            result_text = f"""
-✅ Розсилка завершена!
-
-📊 Статистика:
-📤 Відправлено: {sent_count}
-❌ Помилок: {error_count}
-📈 Успішність: {round(sent_count / len(users) * 100, 1)}%
-
-📝 Текст: {data['message_text'][:50]}...
-👥 Аудиторія: {data['audience_name']}
-            """
-            
-        elif data.get('schedule_type') == 'scheduled':
+        if data.get('schedule_type') == 'scheduled':
             # Запланована розсилка
             result_text = f"""
 ✅ Розсилка заплановано!
 
 📅 Час відправки: {data['schedule_time']}
 👥 Аудиторія: {data['audience_name']}
-📊 Користувачів: {len(users)}
+📊 Користувачів: {users_count}
 
 📝 Текст: {data['message_text'][:100]}...
 
@@ -894,7 +956,7 @@ async def broadcast_confirm_send_handler(callback: CallbackQuery, state: FSMCont
 
 🔄 Розклад: {data['recurring_name']}
 👥 Аудиторія: {data['audience_name']}
-📊 Користувачів: {len(users)}
+📊 Користувачів: {users_count}
 
 📝 Текст: {data['message_text'][:100]}...
 
@@ -906,7 +968,7 @@ async def broadcast_confirm_send_handler(callback: CallbackQuery, state: FSMCont
 ✅ Розсилка налаштована!
 
 👥 Аудиторія: {data['audience_name']}
-📊 Користувачів: {len(users)}
+📊 Користувачів: {users_count}
 📝 Текст: {data['message_text'][:50]}...
             """
         
@@ -918,7 +980,7 @@ async def broadcast_confirm_send_handler(callback: CallbackQuery, state: FSMCont
         # Очищуємо стан
         await state.clear()
         
-        logger.info(f"Адмін {user_id} відправив розсилку {broadcast_id} для {len(users)} користувачів")
+        logger.info(f"Адмін {user_id} відправив розсилку {broadcast_id} для {users_count} користувачів")
         
     except Exception as e:
         logger.error(f"Помилка в broadcast_confirm_send_handler: {e}")
@@ -988,8 +1050,8 @@ async def broadcast_datetime_handler(message: Message, state: FSMContext):
                 int(hour), int(minute)
             )
             
-            # Перевіряємо що дата в майбутньому
-            if scheduled_datetime <= datetime.now():
+            # Перевіряємо що дата в майбутньому (час вводиться в часовому поясі розкладу)
+            if scheduled_datetime <= local_now():
                 await message.answer(
                     "❌ Дата має бути в майбутньому\n\n"
                     "Введіть правильну дату та час:",
@@ -1123,6 +1185,11 @@ async def broadcast_recurring_handler(callback: CallbackQuery, state: FSMContext
         logger.error(f"Помилка в broadcast_recurring_handler: {e}")
         await callback.answer("Помилка налаштування регулярної розсилки")
 
+def cron_preview_text(cron: CronExpression, count: int = 3) -> str:
+    """Найближчі запуски регулярної розсилки (в часовому поясі розкладу)"""
+    runs = cron.preview(count, local_now())
+    return "\n".join(f"• {run.strftime('%d.%m.%Y %H:%M')}" for run in runs)
+
 # Обробник CRON виразу
 @router.message(BroadcastStates.waiting_for_cron)
 async def broadcast_cron_handler(message: Message, state: FSMContext):
@@ -1135,17 +1202,20 @@ async def broadcast_cron_handler(message: Message, state: FSMContext):
     try:
         cron_expression = message.text.strip()
         
-        # Базова валідація CRON виразу (5 частин розділених пробілами)
-        parts = cron_expression.split()
-        if len(parts) != 5:
+        # Розбір та перевірка CRON виразу
+        try:
+            cron = parse_cron(cron_expression)
+        except CronError as e:
+            # Без розмітки: текст помилки містить введення адміна
             await message.answer(
-                "❌ Неправильний CRON вираз\n\n"
-                "Має бути 5 частин розділених пробілами:\n"
-                "`хвилина година день місяць день_тижня`",
+                f"❌ Неправильний CRON вираз: {e}\n\n"
+                "Формат (5 частин розділених пробілами):\n"
+                "хвилина година день місяць день_тижня",
                 reply_markup=broadcast_datetime_keyboard(),
-                parse_mode="Markdown"
+                parse_mode=None
             )
             return
+        cron_expression = str(cron)
         
         # Зберігаємо CRON вираз
         await state.update_data(
@@ -1170,6 +1240,9 @@ async def broadcast_cron_handler(message: Message, state: FSMContext):
 📊 Користувачів: {data['users_count']}
 🔄 Розклад: {data['recurring_name']}
 
+🗓 Найближчі запуски:
+{cron_preview_text(cron)}
+
 Продовжити?
         """
         
@@ -1219,7 +1292,7 @@ async def broadcast_edit_message_handler(callback: CallbackQuery, state: FSMCont
         await callback.message.edit_text(
             "✏️ Редагування тексту розсилки\n\n"
             "📝 Надішліть новий текст повідомлення для розсилки.\n"
-            "Можна додати медіа (фото, відео).",
+            "Можна надіслати фото, відео, документ або альбом з підписом.",
             reply_markup=broadcast_back_to_menu_keyboard()
         )
         await callback.answer()
@@ -1290,21 +1363,12 @@ async def broadcast_editing_message_handler(message: Message, state: FSMContext)
         return
     
     try:
-        # Зберігаємо новий текст
-        message_text = message.text or message.caption or ""
-        if not message_text:
-            await message.answer(
-                "❌ Повідомлення має містити текст.\n\n"
-                "Спробуйте ще раз:",
-                reply_markup=broadcast_back_to_menu_keyboard()
-            )
+        broadcast_message = await read_broadcast_message(message)
+        if broadcast_message is None:
             return
         
-        # Оновлюємо текст в стані
-        await state.update_data(
-            message_text=message_text,
-            message_id=message.message_id
-        )
+        # Оновлюємо текст та медіа в стані
+        await state.update_data(**broadcast_message)
         
         # Повертаємося до підтвердження
         await state.set_state(BroadcastStates.confirming_broadcast)
@@ -1357,19 +1421,13 @@ async def broadcast_editing_audience_handler(callback: CallbackQuery, state: FSM
     try:
         audience_type = callback.data.split("_")[1]  # all, buyers, inactive
         
-        audience_names = {
-            "all": "👥 Усі користувачі",
-            "buyers": "💰 Покупці курсів", 
-            "inactive": "😴 Неактивні 7+ днів"
-        }
-        
         # Отримуємо кількість користувачів в сегменті
-        users_count = len(await get_users_by_segment(audience_type))
+        users_count = await count_users_by_segment(audience_type)
         
         # Перевіряємо чи є користувачі в сегменті
         if users_count == 0:
             await callback.message.edit_text(
-                f"❌ Не знайдено користувачів для розсилки в сегменті: {audience_names[audience_type]}\n\n"
+                f"❌ Не знайдено користувачів для розсилки в сегменті: {AUDIENCE_NAMES[audience_type]}\n\n"
                 "👥 Оберіть інший сегмент аудиторії:",
                 reply_markup=broadcast_audience_keyboard()
             )
@@ -1379,7 +1437,7 @@ async def broadcast_editing_audience_handler(callback: CallbackQuery, state: FSM
         # Оновлюємо аудиторію в стані
         await state.update_data(
             audience_type=audience_type,
-            audience_name=audience_names[audience_type],
+            audience_name=AUDIENCE_NAMES[audience_type],
             users_count=users_count
         )
         
@@ -1531,8 +1589,8 @@ async def broadcast_editing_datetime_handler(message: Message, state: FSMContext
                 int(hour), int(minute)
             )
             
-            # Перевіряємо що дата в майбутньому
-            if scheduled_datetime <= datetime.now():
+            # Перевіряємо що дата в майбутньому (час вводиться в часовому поясі розкладу)
+            if scheduled_datetime <= local_now():
                 await message.answer(
                     "❌ Дата має бути в майбутньому\n\n"
                     "Введіть правильну дату та час:",
@@ -1676,17 +1734,20 @@ async def broadcast_editing_cron_handler(message: Message, state: FSMContext):
     try:
         cron_expression = message.text.strip()
         
-        # Базова валідація CRON виразу (5 частин розділених пробілами)
-        parts = cron_expression.split()
-        if len(parts) != 5:
+        # Розбір та перевірка CRON виразу
+        try:
+            cron = parse_cron(cron_expression)
+        except CronError as e:
+            # Без розмітки: текст помилки містить введення адміна
             await message.answer(
-                "❌ Неправильний CRON вираз\n\n"
-                "Має бути 5 частин розділених пробілами:\n"
-                "`хвилина година день місяць день_тижня`",
+                f"❌ Неправильний CRON вираз: {e}\n\n"
+                "Формат (5 частин розділених пробілами):\n"
+                "хвилина година день місяць день_тижня",
                 reply_markup=broadcast_datetime_keyboard(),
-                parse_mode="Markdown"
+                parse_mode=None
             )
             return
+        cron_expression = str(cron)
         
         # Зберігаємо CRON вираз
         await state.update_data(
@@ -1711,6 +1772,9 @@ async def broadcast_editing_cron_handler(message: Message, state: FSMContext):
 📊 Користувачів: {data['users_count']}
 🔄 Розклад: {data['recurring_name']}
 
+🗓 Найближчі запуски:
+{cron_preview_text(cron)}
+
 Продовжити?
         """
         
@@ -1780,6 +1844,77 @@ Telegram API: ✅ Працює
         logger.error(f"Помилка в admin_check_api_handler: {e}")
         await callback.answer("Помилка перевірки API")
 
+# Стиснення БД (одноразове перемикання старої БД на auto_vacuum = INCREMENTAL)
+@router.callback_query(F.data == "adm:compact_db")
+async def admin_compact_db_handler(callback: CallbackQuery):
+    """Стан стиснення БД та підтвердження повного VACUUM"""
+    user_id = callback.from_user.id
+    
+    if not await is_admin(user_id):
+        await callback.answer("🔒 Доступ заборонено", show_alert=True)
+        return
+    
+    try:
+        if await enable_incremental_vacuum(convert=False):
+            await callback.message.edit_text(
+                "🗜 Стиснення БД\n\n"
+                "✅ Вже увімкнено: місце після архівації журналу розсилок повертається автоматично.",
+                reply_markup=admin_back_to_main()
+            )
+        else:
+            await callback.message.edit_text(
+                "🗜 Стиснення БД\n\n"
+                "БД створена без auto_vacuum, тож місце після архівації журналу розсилок "
+                "не повертається.\n\n"
+                "⚠️ Потрібен одноразовий повний VACUUM: файл БД перезаписується, і на цей час "
+                "(від секунд до кількох хвилин) бот не зберігає нових даних. "
+                "Краще запускати в період найменшої активності.",
+                reply_markup=admin_compact_db_confirm_keyboard()
+            )
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Помилка в admin_compact_db_handler: {e}")
+        await callback.answer("Помилка перевірки стану БД")
+
+@router.callback_query(F.data == "adm:compact_db_run")
+async def admin_compact_db_run_handler(callback: CallbackQuery):
+    """Виконати повний VACUUM за підтвердженням адміна"""
+    user_id = callback.from_user.id
+    
+    if not await is_admin(user_id):
+        await callback.answer("🔒 Доступ заборонено", show_alert=True)
+        return
+    
+    try:
+        import os
+        from config import DATABASE_PATH
+        
+        await callback.answer("⏳ Стискаю БД...")
+        await callback.message.edit_text("🗜 Стиснення БД...\n\n⏳ Перезапис файлу БД", reply_markup=None)
+        
+        size_before = os.path.getsize(DATABASE_PATH)
+        started = datetime.now()
+        converted = await broadcast_log_retention.compact_database()
+        seconds = (datetime.now() - started).total_seconds()
+        size_after = os.path.getsize(DATABASE_PATH)
+        
+        if converted:
+            text = (
+                "✅ БД стиснуто\n\n"
+                f"📊 Розмір: {size_before / 1024 / 1024:.1f} МБ → {size_after / 1024 / 1024:.1f} МБ\n"
+                f"⏱ Тривалість: {seconds:.1f} с"
+            )
+            logger.info(f"Адмін {user_id} стиснув БД: {size_before} -> {size_after} байт за {seconds:.1f} с")
+        else:
+            text = "✅ Стиснення вже було увімкнено, нічого не змінено"
+        await callback.message.edit_text(text, reply_markup=admin_back_to_main())
+    except Exception as e:
+        logger.error(f"Помилка в admin_compact_db_run_handler: {e}")
+        await callback.message.edit_text(
+            "❌ Не вдалося стиснути БД, подробиці в лозі",
+            reply_markup=admin_back_to_main()
+        )
+
 # Обробники управління користувачами
 
 # 🔍 Пошук користувачів
@@ -1831,8 +1966,11 @@ async def process_user_search(message: Message, state: FSMContext):
             )
             return
         
-        # Шукаємо користувачів
-        results = await search_users(query)
+        # Шукаємо користувачів (на одного більше, щоб знати чи є ще збіги)
+        limit = 10
+        results = await search_users(query, limit=limit + 1)
+        has_more = len(results) > limit
+        results = results[:limit]
         
         if not results:
             await message.answer(
@@ -1846,7 +1984,7 @@ async def process_user_search(message: Message, state: FSMContext):
         # Формуємо результати пошуку
         text = f"🔍 **Результати пошуку:** `{query}`\n\n"
         
-        for user in results[:10]:  # Показуємо перші 10 результатів
+        for user in results:
             status = "🚫 Заблокований" if user['is_blocked'] else "✅ Активний"
             username = f"@{user['username']}" if user['username'] else "не вказано"
             
@@ -1855,8 +1993,8 @@ async def process_user_search(message: Message, state: FSMContext):
             text += f"Статус: {status}\n"
             text += f"Приєднався: {user['joined_at'][:10]}\n\n"
         
-        if len(results) > 10:
-            text += f"... та ще {len(results) - 10} користувачів"
+        if has_more:
+            text += "... є ще збіги, уточніть запит"
         
         # Створюємо клавіатуру з користувачами
         keyboard = []
@@ -1890,6 +2028,20 @@ async def process_user_search(message: Message, state: FSMContext):
         await message.answer("Помилка пошуку користувачів")
         await state.clear()
 
+def parse_page_cursor(callback_data: str) -> tuple:
+    """
+    Розбір callback_data пагінації виду "<prefix>:<page>:<n|p>:<id>"
+    Повертає (page, after_id, before_id); для старого формату без курсора - перша сторінка
+    """
+    parts = callback_data.split(":")
+    if len(parts) != 4:
+        return 0, None, None
+    
+    page, direction, cursor_id = int(parts[1]), parts[2], int(parts[3])
+    if direction == "p":
+        return page, None, cursor_id
+    return page, cursor_id, None
+
 # 📑 Список користувачів
 @router.callback_query(F.data == "adm:user_list")
 async def admin_user_list_handler(callback: CallbackQuery):
@@ -1911,15 +2063,15 @@ async def users_page_handler(callback: CallbackQuery):
             await callback.answer()
             return
         
-        page = int(page_data)
-        await show_users_list(callback, page)
+        page, after_id, before_id = parse_page_cursor(callback.data)
+        await show_users_list(callback, page, after_id, before_id)
         
     except Exception as e:
         logger.error(f"Помилка в users_page_handler: {e}")
         await callback.answer("Помилка навігації")
 
-async def show_users_list(callback: CallbackQuery, page: int = 0):
-    """Відображення списку користувачів з пагінацією"""
+async def show_users_list(callback: CallbackQuery, page: int = 0, after_id: int = None, before_id: int = None):
+    """Відображення списку користувачів з keyset-пагінацією"""
     user_id = callback.from_user.id
     
     if not await is_admin(user_id):
@@ -1928,12 +2080,23 @@ async def show_users_list(callback: CallbackQuery, page: int = 0):
     
     try:
         limit = 8
-        offset = page * limit
         
-        # Отримуємо користувачів
-        users = await get_users_list(offset, limit)
+        # Отримуємо на одного користувача більше, щоб знати чи є наступна сторінка
+        users = await get_users_list(limit + 1, after_id, before_id)
+        if before_id is not None:
+            # При русі назад зайвий рядок - з попередньої сторінки
+            has_prev = len(users) > limit
+            users = users[-limit:]
+            has_next = True
+        else:
+            has_prev = page > 0
+            has_next = len(users) > limit
+            users = users[:limit]
+        if not has_prev:
+            page = 0
+        
         total_users = await get_users_count()
-        total_pages = (total_users + limit - 1) // limit
+        total_pages = max((total_users + limit - 1) // limit, page + 1)
         
         if not users:
             await callback.message.edit_text(
@@ -1969,9 +2132,10 @@ async def show_users_list(callback: CallbackQuery, page: int = 0):
             ])
         
         # Використовуємо нову клавіатуру
-        has_prev = page > 0
-        has_next = page < total_pages - 1
-        pagination_keyboard = users_list_pagination_keyboard(page, total_pages, has_prev, has_next)
+        pagination_keyboard = users_list_pagination_keyboard(
+            page, total_pages, has_prev, has_next,
+            first_id=users[0]['id'], last_id=users[-1]['id']
+        )
         
         # Додаємо кнопки користувачів до клавіатури
         for i, button_row in enumerate(keyboard):
@@ -2067,15 +2231,15 @@ async def purchases_page_handler(callback: CallbackQuery):
             await callback.answer()
             return
         
-        page = int(page_data)
-        await show_purchases_list(callback, page)
+        page, after_id, before_id = parse_page_cursor(callback.data)
+        await show_purchases_list(callback, page, after_id, before_id)
         
     except Exception as e:
         logger.error(f"Помилка в purchases_page_handler: {e}")
         await callback.answer("Помилка навігації")
 
-async def show_purchases_list(callback: CallbackQuery, page: int = 0):
-    """Відображення списку покупок"""
+async def show_purchases_list(callback: CallbackQuery, page: int = 0, after_id: int = None, before_id: int = None):
+    """Відображення списку покупок з keyset-пагінацією"""
     user_id = callback.from_user.id
     
     if not await is_admin(user_id):
@@ -2084,10 +2248,22 @@ async def show_purchases_list(callback: CallbackQuery, page: int = 0):
     
     try:
         limit = 10
-        offset = page * limit
         
-        # Отримуємо покупки та статистику
-        purchases = await get_all_purchases(offset, limit)
+        # Отримуємо на одну покупку більше, щоб знати чи є наступна сторінка
+        purchases = await get_all_purchases(limit + 1, after_id, before_id)
+        if before_id is not None:
+            # При русі назад зайвий рядок - з попередньої сторінки
+            has_prev = len(purchases) > limit
+            purchases = purchases[-limit:]
+            has_next = True
+        else:
+            has_prev = page > 0
+            has_next = len(purchases) > limit
+            purchases = purchases[:limit]
+        if not has_prev:
+            page = 0
+        
+        # Статистика (з денних агрегатів)
         stats = await get_purchases_stats()
         
         if not purchases and page == 0:
@@ -2102,7 +2278,7 @@ async def show_purchases_list(callback: CallbackQuery, page: int = 0):
         
         # Розрахунок пагінації
         total_purchases = stats.get('total_purchases', 0)
-        total_pages = (total_purchases + limit - 1) // limit if total_purchases > 0 else 1
+        total_pages = max((total_purchases + limit - 1) // limit, page + 1)
         
         # Формуємо текст
         text = f"💰 **Покупки користувачів**\n\n"
@@ -2126,34 +2302,17 @@ async def show_purchases_list(callback: CallbackQuery, page: int = 0):
             text += f"💰 ₴{purchase['amount']} • {purchase['purchase_date'][:10]}\n\n"
         
         # Пагінація
-        has_prev = page > 0
-        has_next = page < total_pages - 1
-        
-        keyboard = []
-        pagination_row = []
-        
-        if has_prev:
-            pagination_row.append(InlineKeyboardButton(text="⬅️", callback_data=f"purchases_page:{page-1}"))
-        
-        pagination_row.append(InlineKeyboardButton(text=f"{page+1}/{total_pages}", callback_data="purchases_page:current"))
-        
-        if has_next:
-            pagination_row.append(InlineKeyboardButton(text="➡️", callback_data=f"purchases_page:{page+1}"))
-        
-        if pagination_row:
-            keyboard.append(pagination_row)
-        
-        # Кнопки управління
-        keyboard.extend([
-            [
-                InlineKeyboardButton(text="🔄 Оновити", callback_data="adm:user_purchases"),
-                InlineKeyboardButton(text="👥 Меню", callback_data="adm:users")
-            ]
-        ])
+        if purchases:
+            keyboard = purchases_list_keyboard(
+                page, total_pages, has_prev, has_next,
+                first_id=purchases[0]['purchase_id'], last_id=purchases[-1]['purchase_id']
+            )
+        else:
+            keyboard = purchases_list_keyboard(page, total_pages)
         
         await callback.message.edit_text(
             text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+            reply_markup=keyboard,
             parse_mode="Markdown"
         )
         await callback.answer()
@@ -2363,7 +2522,7 @@ async def user_purchases_handler(callback: CallbackQuery):
         await callback.answer("Помилка завантаження покупок користувача")
 
 # Заглушка для нереалізованих функцій (більш специфічна)
-@router.callback_query(F.data.in_(["adm:broadcast_stats", "adm:user_stats", "adm:courses_list", "adm:course_access"]))
+@router.callback_query(F.data.in_(["adm:user_stats", "adm:courses_list", "adm:course_access"]))
 async def admin_placeholder_handler(callback: CallbackQuery):
     """Заглушка для функцій що ще не реалізовані"""
     user_id = callback.from_user.id
@@ -2461,6 +2620,9 @@ async def admin_backup_db_handler(callback: CallbackQuery):
             parse_mode="Markdown"
         )
         
+        # Переносимо WAL в основний файл, щоб копія містила всі транзакції
+        await checkpoint_db()
+        
         # Створюємо бекап (копіюємо файл)
         shutil.copy2(DATABASE_PATH, backup_path)
         
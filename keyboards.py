@@ -346,12 +346,24 @@ def admin_settings_menu():
             InlineKeyboardButton(text="🔗 Перевірити API", callback_data="adm:check_api"),
             InlineKeyboardButton(text="📦 Бекап БД", callback_data="adm:backup_db")
         ],
+        [
+            InlineKeyboardButton(text="🗜 Стиснути БД", callback_data="adm:compact_db")
+        ],
         [
             InlineKeyboardButton(text="⬅️ Назад", callback_data="adm:main")
         ]
     ])
     return keyboard
 
+def admin_compact_db_confirm_keyboard():
+    """Підтвердження стиснення БД"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Стиснути зараз", callback_data="adm:compact_db_run"),
+            InlineKeyboardButton(text="❌ Скасувати", callback_data="adm:settings")
+        ]
+    ])
+
 def admin_back_to_main():
     """Кнопка повернення до головного адмін меню"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -430,8 +442,12 @@ def confirm_keyboard(action: str, item_id: str = "") -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 # Клавіатури для управління користувачами
-def users_list_pagination_keyboard(page: int = 0, total_pages: int = 1, has_prev: bool = False, has_next: bool = False):
-    """Клавіатура для пагінації списку користувачів"""
+def users_list_pagination_keyboard(page: int = 0, total_pages: int = 1, has_prev: bool = False, has_next: bool = False,
+                                   first_id: int = None, last_id: int = None):
+    """
+    Клавіатура для пагінації списку користувачів
+    Курсор (id першого/останнього користувача на сторінці) передається в callback_data
+    """
     keyboard = []
     
     # Кнопки користувачів (додаються динамічно в обробнику)
@@ -439,10 +455,10 @@ def users_list_pagination_keyboard(page: int = 0, total_pages: int = 1, has_prev
     # Пагінація (без показу поточної сторінки)
     pagination_row = []
     if has_prev:
-        pagination_row.append(InlineKeyboardButton(text="⬅️", callback_data=f"users_page:{page-1}"))
+        pagination_row.append(InlineKeyboardButton(text="⬅️", callback_data=f"users_page:{page-1}:p:{first_id}"))
     
     if has_next:
-        pagination_row.append(InlineKeyboardButton(text="➡️", callback_data=f"users_page:{page+1}"))
+        pagination_row.append(InlineKeyboardButton(text="➡️", callback_data=f"users_page:{page+1}:n:{last_id}"))
     
     if pagination_row:
         keyboard.append(pagination_row)
@@ -491,19 +507,23 @@ def user_detail_keyboard(user_id: int, is_blocked: bool = False):
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def purchases_list_keyboard(page: int = 0, total_pages: int = 1, has_prev: bool = False, has_next: bool = False):
-    """Клавіатура для списку покупок"""
+def purchases_list_keyboard(page: int = 0, total_pages: int = 1, has_prev: bool = False, has_next: bool = False,
+                            first_id: int = None, last_id: int = None):
+    """
+    Клавіатура для списку покупок
+    Курсор (id першої/останньої покупки на сторінці) передається в callback_data
+    """
     keyboard = []
     
     # Пагінація
     pagination_row = []
     if has_prev:
-        pagination_row.append(InlineKeyboardButton(text="⬅️", callback_data=f"purchases_page:{page-1}"))
+        pagination_row.append(InlineKeyboardButton(text="⬅️", callback_data=f"purchases_page:{page-1}:p:{first_id}"))
     
     pagination_row.append(InlineKeyboardButton(text=f"{page+1}/{total_pages}", callback_data="purchases_page:current"))
     
     if has_next:
-        pagination_row.append(InlineKeyboardButton(text="➡️", callback_data=f"purchases_page:{page+1}"))
+        pagination_row.append(InlineKeyboardButton(text="➡️", callback_data=f"purchases_page:{page+1}:n:{last_id}"))
     
     if pagination_row:
         keyboard.append(pagination_row)
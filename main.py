@@ -16,11 +16,14 @@ sys.path.insert(0, str(Path(__file__).parent))
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.webhook.aiohttp_server import setup_application
 from aiohttp import web
 
-from db import init_db
+from db import init_db, close_db, activity_buffer, broadcast_log_sink
 from config import BOT_TOKEN, ADMIN_ID, ENVIRONMENT, WEBHOOK_URL, PORT
+from services.update_pipeline import UpdatePipeline, FastAckRequestHandler
+from services.metrics import registry, loop_monitor, metrics_handler, HandlerMetricsMiddleware
+from services.tracing import TracingMiddleware, TelegramTimingMiddleware
 
 # Налаштування логування
 logging.basicConfig(
@@ -79,6 +82,10 @@ async def setup_handlers():
         from handlers import user, admin, payments
         from middleware.auth import AuthMiddleware
         
+        # Трасування: час кожного апдейта по частинах (middleware, обробник, БД, Telegram API, ZenEdu)
+        dp.update.outer_middleware(TracingMiddleware())
+        bot.session.middleware(TelegramTimingMiddleware())
+        
         # Підключаємо middleware авторизації
         dp.message.middleware(AuthMiddleware())
         dp.callback_query.middleware(AuthMiddleware())
@@ -88,8 +95,29 @@ async def setup_handlers():
         dp.include_router(payments.router)
         dp.include_router(user.router)   # Користувацький роутер останнім
         
+        # Метрики обробників кожного роутера та черг запису в БД
+        for name, router in (("admin", admin.router), ("payments", payments.router), ("user", user.router)):
+            router.message.middleware(HandlerMetricsMiddleware(name))
+            router.callback_query.middleware(HandlerMetricsMiddleware(name))
+        registry.gauge("bot_activity_buffer_pending", "Активність користувачів, що чекає запису в БД",
+                       callback=lambda: activity_buffer.pending)
+        registry.gauge("bot_broadcast_log_pending", "Результати розсилок, що чекають запису в БД",
+                       callback=lambda: broadcast_log_sink.pending)
+        loop_monitor.start()
+        
         logger.info(f"✅ Handlers налаштовані для @PrometeyLabs (ADMIN_ID: {ADMIN_ID})")
         
+        # Продовжуємо розсилки, перервані перезапуском
+        from services.broadcast_sender import resume_broadcasts
+        resumed = await resume_broadcasts(bot)
+        if resumed:
+            logger.info(f"✅ Відновлено розсилок: {resumed}")
+        
+        # Запускаємо планувальник запланованих та регулярних розсилок
+        from services.scheduler import broadcast_scheduler
+        jobs = await broadcast_scheduler.start(bot)
+        logger.info(f"✅ Планувальник розсилок запущено (задач: {jobs})")
+        
     except Exception as e:
         logger.error(f"❌ Помилка налаштування handlers: {e}")
         raise
@@ -150,13 +178,31 @@ async def create_webhook_app():
     app.router.add_get('/health', health_check)
     app.router.add_get('/', health_check)
     
-    # Налаштовуємо webhook handler
-    webhook_requests_handler = SimpleRequestHandler(
-        dispatcher=dp,
-        bot=bot,
+    # Налаштовуємо webhook handler: відповідь Telegram одразу, обробка в черзі воркерів
+    update_pipeline = UpdatePipeline(dp, bot)
+    update_pipeline.start()
+    webhook_requests_handler = FastAckRequestHandler(
+        update_pipeline,
         secret_token=None  # Можна додати секретний токен для безпеки
     )
     webhook_requests_handler.register(app, path=WEBHOOK_PATH)
+    app.router.add_get('/health/updates', webhook_requests_handler.stats_handler)
+    app.router.add_get('/metrics', metrics_handler)
+    
+    # Стан черг апдейтів для /metrics
+    stats = update_pipeline.stats
+    registry.gauge("bot_update_queue_depth", "Апдейти в чергах та в обробці", callback=lambda: update_pipeline.depth)
+    registry.gauge("bot_update_lanes", "Активні черги чатів", callback=lambda: update_pipeline.lanes)
+    registry.counter("bot_updates_received_total", "Апдейти, отримані через webhook", callback=lambda: stats.received)
+    registry.counter("bot_updates_rejected_total", "Апдейти, відхилені через переповнені черги (503)",
+                     callback=lambda: stats.rejected)
+    registry.counter("bot_updates_duplicate_total", "Повторні доставки апдейтів", callback=lambda: stats.duplicates)
+    registry.counter("bot_updates_failed_total", "Апдейти, обробка яких завершилась помилкою",
+                     callback=lambda: stats.failed)
+    
+    async def stop_update_pipeline(app):
+        await update_pipeline.stop()
+    app.on_shutdown.append(stop_update_pipeline)
     
     # Альтернативний спосіб реєстрації
     # app.router.add_post(WEBHOOK_PATH, webhook_requests_handler.handle)
@@ -210,6 +256,16 @@ async def start_polling_server():
 async def shutdown():
     """Очищення ресурсів при зупинці"""
     try:
+        from services.scheduler import broadcast_scheduler
+        broadcast_scheduler.shutdown()
+        await loop_monitor.stop()
+        
+        from services.retention import broadcast_log_retention
+        await broadcast_log_retention.stop()
+        
+        await close_db()
+        logger.info("✅ З'єднання з базою даних закрито")
+        
         session = await bot.get_session()
         if session:
             await session.close()
@@ -92,7 +92,7 @@ class AuthMiddleware(BaseMiddleware):
         Логує активність користувача
         """
         try:
-            # Додаємо/оновлюємо користувача в БД
+            # Додаємо/оновлюємо користувача в БД (вже відомих add_user пропускає через кеш)
             if isinstance(event, Message):
                 username = event.from_user.username
                 await add_user(user_id, username)
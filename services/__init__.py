@@ -2,4 +2,4 @@
 Сервіси для PrometeyLabs Bot
 """
 
-__all__ = ['zenedu_client'] 
\ No newline at end of file
+__all__ = ['zenedu_client', 'broadcast_sender', 'broadcast_media', 'broadcast_shards', 'scheduler', 'cron', 'retention', 'update_pipeline', 'metrics', 'tracing'] 
\ No newline at end of file
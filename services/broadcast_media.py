@@ -0,0 +1,208 @@
+"""
+Медіа в розсилках
+Повідомлення адміна (фото, відео, документ, альбом) зберігається як посилання на
+оригінал та file_id файлів: Telegram завантажує файл один раз, а одержувачам
+розсилається копія без повторного завантаження
+"""
+
+import asyncio
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import (
+    Message, MessageEntity, InputMediaPhoto, InputMediaVideo,
+    InputMediaDocument, InputMediaAudio
+)
+
+from config import BROADCAST_ALBUM_DELAY
+
+logger = logging.getLogger(__name__)
+
+# Підтримувані типи медіа та їх підписи в списках розсилок
+MEDIA_LABELS = {
+    "photo": "🖼 Фото",
+    "video": "🎬 Відео",
+    "document": "📄 Документ",
+    "animation": "🎞 GIF",
+    "audio": "🎵 Аудіо",
+    "voice": "🎤 Голосове",
+}
+
+# Типи, які можуть бути частиною альбому
+_ALBUM_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+
+@dataclass
+class MediaItem:
+    """Один файл повідомлення з підписом"""
+    type: str
+    file_id: str
+    caption: Optional[str] = None
+    caption_entities: Optional[List[dict]] = None
+
+    def entities(self) -> Optional[List[MessageEntity]]:
+        """Форматування підпису (жирний, посилання тощо)"""
+        if not self.caption_entities:
+            return None
+        return [MessageEntity.model_validate(entity) for entity in self.caption_entities]
+
+    def input_media(self):
+        """Елемент альбому для send_media_group"""
+        return _ALBUM_MEDIA[self.type](
+            media=self.file_id, caption=self.caption,
+            caption_entities=self.entities(), parse_mode=None
+        )
+
+def _media_item(message: Message) -> Optional[MediaItem]:
+    """Файл з повідомлення адміна (None - повідомлення без медіа)"""
+    for media_type in MEDIA_LABELS:
+        media = getattr(message, media_type)
+        if not media:
+            continue
+        # Для фото беремо найбільший розмір
+        file_id = media[-1].file_id if media_type == "photo" else media.file_id
+        entities = [
+            entity.model_dump(exclude_none=True) for entity in message.caption_entities or []
+        ]
+        return MediaItem(media_type, file_id, message.caption, entities or None)
+    return None
+
+@dataclass
+class BroadcastMedia:
+    """Медіа розсилки: оригінальне повідомлення адміна (або альбом) та file_id його файлів"""
+    source_chat_id: int
+    message_ids: List[int]
+    items: List[MediaItem]
+    # Оригінал видалено - далі відправляємо напряму за file_id
+    _source_gone: bool = field(default=False, repr=False, compare=False)
+
+    @property
+    def is_album(self) -> bool:
+        return len(self.items) > 1
+
+    @property
+    def media_type(self) -> str:
+        return "album" if self.is_album else self.items[0].type
+
+    @property
+    def message_cost(self) -> int:
+        """Скільки повідомлень Telegram зараховує за одну доставку"""
+        return len(self.items)
+
+    @property
+    def file_id(self) -> str:
+        """file_id першого файлу (для колонки broadcasts.media_file_id)"""
+        return self.items[0].file_id
+
+    def describe(self) -> str:
+        """Опис для списків та підтверджень: тип медіа та підпис"""
+        if self.is_album:
+            label = f"🗂 Альбом ({len(self.items)})"
+        else:
+            label = MEDIA_LABELS[self.items[0].type]
+        caption = next((item.caption for item in self.items if item.caption), "")
+        return f"[{label}] {caption}".strip()
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "source_chat_id": self.source_chat_id,
+            "message_ids": self.message_ids,
+            "media_type": self.media_type,
+            "items": [asdict(item) for item in self.items],
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: Optional[str]) -> Optional["BroadcastMedia"]:
+        """Відновити медіа з БД (None - текстова розсилка)"""
+        if not data:
+            return None
+        raw = json.loads(data)
+        return cls(
+            source_chat_id=raw["source_chat_id"],
+            message_ids=raw["message_ids"],
+            items=[MediaItem(**item) for item in raw["items"]],
+        )
+
+    @classmethod
+    def from_messages(cls, messages: List[Message]) -> Optional["BroadcastMedia"]:
+        """
+        Медіа з повідомлення адміна або частин альбому
+        None - звичайний текст; ValueError - тип повідомлення не підтримується
+        """
+        items = [_media_item(message) for message in messages]
+        if len(messages) == 1 and items[0] is None:
+            if messages[0].text:
+                return None
+            raise ValueError("непідтримуваний тип повідомлення")
+        if any(item is None for item in items):
+            raise ValueError("непідтримуваний тип медіа в альбомі")
+        if len(items) > 1 and any(item.type not in _ALBUM_MEDIA for item in items):
+            raise ValueError("альбом може містити лише фото, відео, документи або аудіо")
+        return cls(
+            source_chat_id=messages[0].chat.id,
+            message_ids=[message.message_id for message in messages],
+            items=items,
+        )
+
+    async def send(self, bot: Bot, chat_id: int):
+        """
+        Доставити медіа одержувачу
+        Альбом - send_media_group з file_id; одиночне повідомлення - copy_message
+        (зберігає підпис та форматування), а якщо оригінал видалено - відправка за file_id
+        """
+        if self.is_album:
+            await bot.send_media_group(chat_id, [item.input_media() for item in self.items])
+            return
+
+        if not self._source_gone:
+            try:
+                await bot.copy_message(chat_id, self.source_chat_id, self.message_ids[0])
+                return
+            except TelegramBadRequest as e:
+                if "message to copy not found" not in e.message.lower():
+                    raise
+                self._source_gone = True
+                logger.warning("Оригінал повідомлення розсилки видалено, відправка за file_id")
+
+        item = self.items[0]
+        send_method = getattr(bot, f"send_{item.type}")
+        await send_method(
+            chat_id, **{item.type: item.file_id},
+            caption=item.caption, caption_entities=item.entities(), parse_mode=None
+        )
+
+class AlbumCollector:
+    """
+    Збирання альбому з окремих повідомлень
+    Telegram надсилає кожен файл альбому окремим апдейтом з однаковим media_group_id;
+    альбом вважається повним, коли за delay секунд не прийшло нових частин
+    """
+
+    def __init__(self, delay: float = BROADCAST_ALBUM_DELAY):
+        self.delay = delay
+        self._albums: Dict[Tuple[int, str], List[Message]] = {}
+
+    async def collect(self, message: Message) -> Optional[List[Message]]:
+        """Додати частину альбому; повертає всі частини лише для останньої з них, інакше None"""
+        key = (message.chat.id, message.media_group_id)
+        parts = self._albums.setdefault(key, [])
+        parts.append(message)
+        count = len(parts)
+
+        await asyncio.sleep(self.delay)
+        # За час очікування прийшла ще частина - альбом завершить її обробник
+        if len(parts) != count or self._albums.get(key) is not parts:
+            return None
+        del self._albums[key]
+        return sorted(parts, key=lambda part: part.message_id)
+
+# Глобальний збирач альбомів
+album_collector = AlbumCollector()
@@ -0,0 +1,529 @@
+"""
+Рушій доставки розсилок
+Глобальний token bucket тримає темп в межах ліміту Telegram (~30 повідомлень/с),
+а пул воркерів обмежує кількість одночасних запитів до Bot API
+"""
+
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest,
+    TelegramNotFound, TelegramNetworkError, TelegramServerError
+)
+
+from config import (
+    BROADCAST_DELAY, BROADCAST_BURST, BROADCAST_CONCURRENCY,
+    BROADCAST_PROGRESS_INTERVAL, BROADCAST_PROCESSES, MAX_RETRIES, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX,
+    BROADCAST_MAX_FLOOD_WAITS, AUDIENCE_NAMES
+)
+from db import (
+    update_broadcast_status, block_user, create_broadcast_recipients, release_claimed_recipients,
+    get_broadcast_progress, get_broadcasts_by_status, save_broadcast_stats, broadcast_log_sink,
+    RecipientClaimer
+)
+from keyboards import broadcast_back_to_menu_keyboard
+from services.broadcast_media import BroadcastMedia
+from services.retention import broadcast_log_retention
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Token bucket: rate токенів на секунду, не більше capacity в запасі
+    Один токен - одне повідомлення
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        """Поповнити запас токенів за час, що минув"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def pause(self, seconds: float):
+        """Зупинити видачу токенів на seconds (flood control від Telegram)"""
+        resume_at = time.monotonic() + seconds
+        if resume_at > self._paused_until:
+            self._paused_until = resume_at
+            # Після паузи темп відновлюється з нуля, без накопиченого запасу
+            self._tokens = 0.0
+            self._updated = resume_at
+
+    async def acquire(self):
+        """Дочекатися та забрати один токен"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+# Результати доставки одному користувачу
+SENT = "sent"
+BLOCKED = "blocked"        # Користувач заблокував бота (Forbidden)
+NOT_FOUND = "not_found"    # Чат не існує / недоступний
+FAILED = "failed"          # Інша постійна помилка або вичерпано повтори
+UNKNOWN = "unknown"        # Перервано перезапуском після взяття в роботу
+
+# Тексти помилок Bad Request, після яких повтор не має сенсу
+_CHAT_GONE_ERRORS = ("chat not found", "user not found", "peer_id_invalid", "user is deactivated")
+
+def is_transient_error(error: Exception) -> bool:
+    """Чи варто повторити запит після цієї помилки"""
+    return isinstance(error, (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError))
+
+def backoff_delay(attempt: int) -> float:
+    """Затримка перед повтором: експоненційна з повним jitter"""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+@dataclass
+class BroadcastResult:
+    """Підсумок доставки розсилки"""
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    not_found: int = 0
+    unknown: int = 0
+    retries: int = 0
+    flood_waits: int = 0
+    elapsed: float = 0.0
+    # Підсумки окремих процесів при розсилці шардами
+    shards: List[dict] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        """Фактичний темп відправки, повідомлень/с"""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def success_rate(self) -> float:
+        """Частка успішно доставлених, %"""
+        return round(self.sent / self.total * 100, 1) if self.total else 0.0
+
+def format_duration(seconds: float) -> str:
+    """Тривалість для людини: 45 с, 3 хв 20 с, 1 год 5 хв"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} хв {seconds % 60} с"
+    return f"{seconds // 3600} год {seconds % 3600 // 60} хв"
+
+class ProgressReporter:
+    """
+    Живий прогрес розсилки в повідомленні адміна
+    Повідомлення редагується не частіше ніж раз на interval секунд і лише коли
+    змінились лічильники (Telegram відхиляє редагування без змін); кожне редагування
+    забирає токен зі спільного bucket, тож темп розсилки разом з ним не перевищує ліміт
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, message_id: int, text: str, audience_name: str,
+                 interval: float = BROADCAST_PROGRESS_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.audience_name = audience_name
+        self.interval = interval
+        self.edits = 0
+        self._result: Optional[BroadcastResult] = None
+        self._bucket: Optional[TokenBucket] = None
+        self._total = 0
+        self._sent_before = 0
+        self._failed_before = 0
+        self._started = 0.0
+        self._last_counts: Optional[Tuple[int, int]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def render(self) -> str:
+        """Текст прогресу: відправлено/помилки/залишилось, темп та орієнтовний час"""
+        result = self._result
+        sent = self._sent_before + result.sent
+        failed = self._failed_before + result.failed
+        remaining = max(self._total - sent - failed, 0)
+        # Темп - лише за поточний запуск
+        elapsed = time.monotonic() - self._started
+        rate = (result.sent + result.failed) / elapsed if elapsed > 0 else 0.0
+        percent = round((sent + failed) / self._total * 100) if self._total else 100
+        eta = format_duration(remaining / rate) if rate > 0 else "—"
+        return (
+            f"📤 Відправляємо розсилку... {percent}%\n\n"
+            f"✅ Відправлено: {sent}\n"
+            f"❌ Помилок: {failed}\n"
+            f"⏳ Залишилось: {remaining} з {self._total}\n"
+            f"⚡ Темп: {rate:.1f} повідомлень/с\n"
+            f"🕐 Орієнтовно: {eta}\n\n"
+            f"📝 Текст: {self.text[:50]}...\n"
+            f"👥 Аудиторія: {self.audience_name}"
+        )
+
+    async def refresh(self):
+        """Відредагувати повідомлення, якщо з минулого разу щось змінилось"""
+        counts = (self._result.sent, self._result.failed)
+        if counts == self._last_counts:
+            return
+        self._last_counts = counts
+
+        if self._bucket:
+            await self._bucket.acquire()
+        try:
+            await self.bot.edit_message_text(
+                self.render(), chat_id=self.chat_id, message_id=self.message_id, parse_mode=None
+            )
+            self.edits += 1
+        except TelegramBadRequest as e:
+            if "message is not modified" not in e.message.lower():
+                logger.warning(f"Не вдалося оновити прогрес розсилки: {e.message}")
+        except TelegramRetryAfter as e:
+            # Flood control стосується і доставки; це оновлення просто пропускаємо
+            if self._bucket:
+                await self._bucket.pause(e.retry_after)
+        except Exception as e:
+            logger.warning(f"Не вдалося оновити прогрес розсилки: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
+
+    def start(self, result: BroadcastResult, progress: Dict[str, int],
+              bucket: Optional[TokenBucket] = None):
+        """Почати періодичні оновлення (progress - стан журналу до початку цього запуску)"""
+        self._result = result
+        self._total = sum(progress.values())
+        self._sent_before = progress.get(SENT, 0)
+        # Все, що не sent і не чекає відправки, - оброблено з помилкою
+        self._failed_before = self._total - self._sent_before - progress.get("pending", 0)
+        self._bucket = bucket
+        self._started = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Зупинити оновлення (до відправки підсумкового звіту)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+class BroadcastSender:
+    """Відправка повідомлення списку користувачів з обмеженням темпу та паралелізму"""
+
+    def __init__(self, bot: Bot, rate: float = 1 / BROADCAST_DELAY,
+                 burst: int = BROADCAST_BURST, concurrency: int = BROADCAST_CONCURRENCY,
+                 bucket=None):
+        self.bot = bot
+        # bucket - ліміт темпу зі спільним для кількох процесів станом (SharedTokenBucket)
+        self.bucket = bucket or TokenBucket(rate, burst)
+        self.concurrency = concurrency
+
+    async def _deliver(self, user_id: int, text: str, result: BroadcastResult,
+                       media: Optional[BroadcastMedia] = None) -> Tuple[str, Optional[str], Optional[int]]:
+        """
+        Відправити одне повідомлення з урахуванням flood control та повторів
+        RetryAfter зупиняє весь конвеєр і не витрачає спроби, але одного одержувача
+        очікують не більше BROADCAST_MAX_FLOOD_WAITS разів (далі - failed); мережеві
+        та 5xx помилки повторюються до MAX_RETRIES разів.
+        Повертає (результат, помилка, тривалість успішного запиту в мс)
+        """
+        attempt = 0
+        flood_waits = 0
+        while True:
+            # Альбом Telegram рахує як кілька повідомлень
+            for _ in range(media.message_cost if media else 1):
+                await self.bucket.acquire()
+            started = time.monotonic()
+            try:
+                if media:
+                    await media.send(self.bot, user_id)
+                else:
+                    # HTML-розмітка бота за замовчуванням (перевірена при введенні тексту)
+                    await self.bot.send_message(user_id, text)
+                return SENT, None, round((time.monotonic() - started) * 1000)
+            except TelegramRetryAfter as e:
+                result.flood_waits += 1
+                flood_waits += 1
+                if flood_waits > BROADCAST_MAX_FLOOD_WAITS:
+                    logger.warning(
+                        f"Розсилку користувачу {user_id} пропущено після {BROADCAST_MAX_FLOOD_WAITS} пауз flood control"
+                    )
+                    return FAILED, e.message, None
+                logger.warning(f"Flood control: пауза розсилки на {e.retry_after} с")
+                await self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError as e:
+                await block_user(user_id)
+                return BLOCKED, e.message, None
+            except (TelegramBadRequest, TelegramNotFound) as e:
+                if any(reason in e.message.lower() for reason in _CHAT_GONE_ERRORS):
+                    return NOT_FOUND, e.message, None
+                logger.warning(f"Розсилка користувачу {user_id} відхилена: {e.message}")
+                return FAILED, e.message, None
+            except Exception as e:
+                if not is_transient_error(e) or attempt >= MAX_RETRIES:
+                    logger.warning(f"Не вдалося доставити розсилку користувачу {user_id}: {e}")
+                    return FAILED, str(e), None
+                attempt += 1
+                result.retries += 1
+                await asyncio.sleep(backoff_delay(attempt))
+
+    @staticmethod
+    def _count(result: BroadcastResult, outcome: str):
+        """Врахувати результат доставки в лічильниках"""
+        if outcome == SENT:
+            result.sent += 1
+        else:
+            result.failed += 1
+            if outcome == BLOCKED:
+                result.blocked += 1
+            elif outcome == NOT_FOUND:
+                result.not_found += 1
+
+    async def send(self, user_ids: Iterable[int], text: str,
+                   result: Optional[BroadcastResult] = None,
+                   on_outcome: Optional[Callable[[int, str, Optional[str], Optional[int]], Awaitable[None]]] = None,
+                   media: Optional[BroadcastMedia] = None) -> BroadcastResult:
+        """
+        Відправити текст (або медіа, якщо задано) усім користувачам зі списку
+        Лічильники додаються до result (для доставки порціями); on_outcome(user_id, outcome, error,
+        latency_ms) очікується для кожного одержувача, тож повільний споживач пригальмовує відправку
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+
+        if result is None:
+            result = BroadcastResult()
+        result.total += queue.qsize()
+
+        async def worker():
+            while True:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                outcome, error, latency_ms = await self._deliver(user_id, text, result, media)
+                self._count(result, outcome)
+                if on_outcome:
+                    await on_outcome(user_id, outcome, error, latency_ms)
+
+        started = time.monotonic()
+        workers = min(self.concurrency, queue.qsize())
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        result.elapsed += time.monotonic() - started
+        return result
+
+    async def send_claimed(self, claimer: RecipientClaimer, text: str, result: BroadcastResult,
+                           media: Optional[BroadcastMedia] = None) -> BroadcastResult:
+        """
+        Доставити одержувачів розсилки, яких видає claimer
+        Кожен воркер бере наступного одержувача разом із записом результату попереднього,
+        тож в журналі 'claimed' лише повідомлення, що зараз відправляються
+        """
+        async def worker():
+            outcome = None
+            while True:
+                row = await claimer.next(outcome)
+                if row is None:
+                    return
+                log_id, user_id = row
+                result.total += 1
+                status, error, latency_ms = await self._deliver(user_id, text, result, media)
+                self._count(result, status)
+                outcome = (log_id, status, error, latency_ms)
+
+        started = time.monotonic()
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            # Помилка запису журналу або скасування - зупиняємо всіх воркерів
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        finally:
+            result.elapsed += time.monotonic() - started
+        return result
+
+async def run_broadcast(bot: Bot, broadcast_id: int, text: str, audience: str,
+                        media: Optional[BroadcastMedia] = None,
+                        reporter: Optional[ProgressReporter] = None) -> BroadcastResult:
+    """
+    Доставити збережену розсилку сегменту аудиторії та оновити її статус
+    Одержувачі фіксуються в broadcast_log один раз; одержувач позначається claimed до
+    відправки разом із записом результату попереднього (RecipientClaimer), тож після
+    збою невідомими лишаються лише повідомлення, що були в дорозі.
+    Повторний виклик для тієї ж розсилки продовжує з першого ще не взятого одержувача
+    """
+    await update_broadcast_status(broadcast_id, "sending")
+    sharded = BROADCAST_PROCESSES > 1
+    if sharded:
+        # Шарди в окремих процесах з власними сесіями; цей процес (звіт прогресу,
+        # залишок одержувачів) бере слоти з того ж спільного ліміту темпу
+        from services.broadcast_shards import SharedTokenBucket, send_sharded
+        sender = BroadcastSender(bot, bucket=SharedTokenBucket())
+    else:
+        sender = BroadcastSender(bot)
+    result = BroadcastResult()
+    try:
+        await create_broadcast_recipients(broadcast_id, audience)
+        if reporter:
+            reporter.start(result, await get_broadcast_progress(broadcast_id), sender.bucket)
+
+        if sharded:
+            await send_sharded(bot, broadcast_id, text, media, result, BROADCAST_PROCESSES)
+
+        # Одержувачі, що лишились (всі - в одному процесі, або після збою шарду)
+        await sender.send_claimed(RecipientClaimer(broadcast_id), text, result, media)
+        # Підсумки рахуються з журналу, тож дописуємо результати останніх одержувачів
+        await broadcast_log_sink.flush()
+    except Exception as e:
+        logger.error(f"Помилка доставки розсилки {broadcast_id}: {e}")
+        await update_broadcast_status(broadcast_id, "failed")
+        raise
+    finally:
+        if reporter:
+            await reporter.stop()
+        if sharded:
+            sender.bucket.close()
+
+    await update_broadcast_status(broadcast_id, "sent")
+    apply_progress(result, await get_broadcast_progress(broadcast_id))
+    await save_broadcast_stats(broadcast_id, result.elapsed)
+    # Журнал щойно виріс - перевіряємо ліміт гарячої таблиці
+    broadcast_log_retention.schedule()
+    logger.info(
+        f"Розсилка {broadcast_id}: доставлено {result.sent}/{result.total}, "
+        f"{result.elapsed:.1f} с, {result.throughput:.1f} повідомлень/с"
+    )
+    return result
+
+def apply_progress(result: BroadcastResult, progress: Dict[str, int]):
+    """Підставити в результат підсумки з журналу (з урахуванням попередніх запусків)"""
+    result.total = sum(progress.values())
+    result.sent = progress.get(SENT, 0)
+    result.blocked = progress.get(BLOCKED, 0)
+    result.not_found = progress.get(NOT_FOUND, 0)
+    result.unknown = progress.get(UNKNOWN, 0)
+    result.failed = result.total - result.sent
+
+def format_broadcast_result(result: BroadcastResult, text: str, audience_name: str) -> str:
+    """Текст звіту для адміна"""
+    shards = "".join(
+        f"🧩 Процес {shard['shard'] + 1}: {shard['sent']} за {shard['elapsed']:.1f} с "
+        f"({shard['throughput']:.1f} повідомлень/с)\n"
+        for shard in result.shards
+    )
+    return f"""
+✅ Розсилка завершена!
+
+📊 Статистика:
+📤 Відправлено: {result.sent}
+❌ Помилок: {result.failed} (заблокували бота: {result.blocked}, чат не знайдено: {result.not_found})
+❔ Невідомо (перервано перезапуском): {result.unknown}
+🔁 Повторів: {result.retries}, пауз flood control: {result.flood_waits}
+📈 Успішність: {result.success_rate}%
+⏱ Тривалість: {result.elapsed:.1f} с ({result.throughput:.1f} повідомлень/с)
+{shards}
+📝 Текст: {text[:50]}...
+👥 Аудиторія: {audience_name}
+    """
+
+async def deliver_and_report(bot: Bot, broadcast_id: int, text: str, audience: str,
+                             audience_name: str, report_chat_id: int,
+                             report_message_id: Optional[int] = None,
+                             media: Optional[BroadcastMedia] = None) -> Optional[BroadcastResult]:
+    """
+    Доставити розсилку з живим прогресом та підсумковим звітом адміну
+    Прогрес і звіт показуються в повідомленні report_message_id (або в новому повідомленні)
+    """
+    if not report_message_id:
+        try:
+            message = await bot.send_message(
+                report_chat_id, f"📤 Відправляємо розсилку...\n\n📝 Текст: {text[:50]}...", parse_mode=None
+            )
+            report_message_id = message.message_id
+        except Exception as e:
+            logger.error(f"Помилка відправки повідомлення про старт розсилки {broadcast_id}: {e}")
+
+    reporter = None
+    if report_message_id:
+        reporter = ProgressReporter(bot, report_chat_id, report_message_id, text, audience_name)
+
+    result = None
+    try:
+        result = await run_broadcast(bot, broadcast_id, text, audience, media, reporter)
+        report = format_broadcast_result(result, text, audience_name)
+    except Exception as e:
+        report = f"❌ Розсилка {broadcast_id} не відправлена: {e}"
+
+    try:
+        if report_message_id:
+            await bot.edit_message_text(
+                report, chat_id=report_chat_id, message_id=report_message_id,
+                reply_markup=broadcast_back_to_menu_keyboard(), parse_mode=None
+            )
+        else:
+            await bot.send_message(
+                report_chat_id, report,
+                reply_markup=broadcast_back_to_menu_keyboard(), parse_mode=None
+            )
+    except Exception as e:
+        logger.error(f"Помилка відправки звіту розсилки {broadcast_id}: {e}")
+    return result
+
+# Фонові задачі розсилок (тримаємо посилання, щоб задачі не зібрав GC)
+_running: Set[asyncio.Task] = set()
+
+def start_broadcast(bot: Bot, broadcast_id: int, text: str, audience: str,
+                    audience_name: str, report_chat_id: int,
+                    report_message_id: Optional[int] = None,
+                    media: Optional[BroadcastMedia] = None) -> asyncio.Task:
+    """Запустити доставку у фоні; після завершення звіт редагується в повідомленні адміна"""
+    task = asyncio.create_task(deliver_and_report(
+        bot, broadcast_id, text, audience, audience_name, report_chat_id, report_message_id, media
+    ))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+async def resume_broadcasts(bot: Bot) -> int:
+    """
+    Продовжити розсилки, перервані перезапуском (статус 'sending')
+    Звіт надсилається адміну, який створив розсилку
+    """
+    broadcasts = await get_broadcasts_by_status("sending")
+    for broadcast in broadcasts:
+        unknown = await release_claimed_recipients(broadcast["id"])
+        logger.info(
+            f"Відновлення розсилки {broadcast['id']} "
+            f"({unknown} одержувачів без підтвердження позначено як unknown)"
+        )
+        start_broadcast(
+            bot, broadcast["id"], broadcast["message_text"], broadcast["audience_type"],
+            audience_name=AUDIENCE_NAMES.get(broadcast["audience_type"], broadcast["audience_type"]),
+            report_chat_id=broadcast["admin_id"],
+            media=BroadcastMedia.from_json(broadcast["media"])
+        )
+    return len(broadcasts)
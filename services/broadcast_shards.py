@@ -0,0 +1,233 @@
+"""
+Розсилка кількома процесами
+Одержувачі діляться на шарди за user_id % N; кожен шард доставляє окремий процес
+зі своєю сесією Bot та своїм event loop. Загальний темп тримає SharedTokenBucket -
+спільний для процесів розклад слотів у файлі SQLite
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from config import (
+    BROADCAST_DELAY, BROADCAST_CONCURRENCY,
+    BROADCAST_RATE_DB, BROADCAST_RATE_LEASE
+)
+from db import (
+    release_claimed_recipients, get_broadcast_progress, broadcast_log_sink, close_db,
+    RecipientClaimer
+)
+from services.broadcast_media import BroadcastMedia
+from services.broadcast_sender import BroadcastSender, BroadcastResult, SENT
+
+logger = logging.getLogger(__name__)
+
+class SharedTokenBucket:
+    """
+    Ліміт темпу, спільний для кількох процесів
+    В SQLite зберігається час наступного вільного слота; процес атомарно (BEGIN IMMEDIATE)
+    бере lease слотів наперед і відправляє кожне повідомлення в свій слот.
+    Сумарний темп усіх процесів не перевищує rate
+    """
+
+    def __init__(self, rate: float = 1 / BROADCAST_DELAY, path: str = BROADCAST_RATE_DB,
+                 lease: int = BROADCAST_RATE_LEASE, name: str = "broadcast"):
+        self.rate = rate
+        self.path = path
+        self.lease = lease
+        self.name = name
+        self._slots: deque = deque()
+        self._lock = asyncio.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_slots (name TEXT PRIMARY KEY, next_free REAL NOT NULL)"
+            )
+        return self._conn
+
+    def _reserve(self, count: int, not_before: float = 0.0) -> float:
+        """Зарезервувати count слотів; повертає час першого з них"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT next_free FROM rate_slots WHERE name = ?", (self.name,)
+            ).fetchone()
+            start = max(time.time(), not_before, row[0] if row else 0.0)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_slots (name, next_free) VALUES (?, ?)",
+                (self.name, start + count / self.rate)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return start
+
+    async def pause(self, seconds: float):
+        """Зупинити видачу слотів для всіх процесів на seconds (flood control)"""
+        self._slots.clear()
+        # Пауза - це порожній проміжок у спільному розкладі
+        await asyncio.to_thread(self._reserve, 0, time.time() + seconds)
+
+    async def acquire(self):
+        """Дочекатися свого слота"""
+        async with self._lock:
+            if not self._slots:
+                start = await asyncio.to_thread(self._reserve, self.lease)
+                self._slots.extend(start + i / self.rate for i in range(self.lease))
+            delay = self._slots.popleft() - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+def _stop_flag(broadcast_id: int, value: Optional[bool] = None) -> bool:
+    """
+    Прапорець зупинки шардів розсилки у файлі BROADCAST_RATE_DB (спільний для процесів)
+    value=True/False - встановити/зняти; повертає поточне значення
+    """
+    conn = sqlite3.connect(BROADCAST_RATE_DB, timeout=5, isolation_level=None)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS shard_stops (broadcast_id INTEGER PRIMARY KEY)")
+        if value:
+            conn.execute("INSERT OR IGNORE INTO shard_stops (broadcast_id) VALUES (?)", (broadcast_id,))
+        elif value is not None:
+            conn.execute("DELETE FROM shard_stops WHERE broadcast_id = ?", (broadcast_id,))
+        row = conn.execute(
+            "SELECT 1 FROM shard_stops WHERE broadcast_id = ?", (broadcast_id,)
+        ).fetchone()
+        return row is not None
+    finally:
+        conn.close()
+
+async def _watch_stop(task: asyncio.Task, broadcast_id: int, interval: float = 0.5):
+    """Скасувати доставку шарду, коли основний процес просить зупинитися"""
+    while not await asyncio.to_thread(_stop_flag, broadcast_id):
+        await asyncio.sleep(interval)
+    logger.warning(f"Доставку шарду розсилки {broadcast_id} зупинено на вимогу основного процесу")
+    task.cancel()
+
+async def _run_shard(shard: int, shards: int, broadcast_id: int, text: str,
+                     media_json: Optional[str], token: str, api: TelegramAPIServer) -> Dict:
+    """Доставка одного шарду (виконується в окремому процесі)"""
+    bot = Bot(
+        token=token, session=AiohttpSession(api=api),
+        default=DefaultBotProperties(parse_mode='HTML')
+    )
+    bucket = SharedTokenBucket()
+    sender = BroadcastSender(
+        bot, concurrency=max(1, BROADCAST_CONCURRENCY // shards), bucket=bucket
+    )
+    media = BroadcastMedia.from_json(media_json)
+    result = BroadcastResult()
+    broadcast_log_sink.start()
+    watcher = asyncio.create_task(_watch_stop(asyncio.current_task(), broadcast_id))
+    try:
+        await sender.send_claimed(RecipientClaimer(broadcast_id, shard=(shard, shards)), text, result, media)
+        await broadcast_log_sink.flush()
+    except asyncio.CancelledError:
+        # Зупинка на вимогу основного процесу - підсумок доставленого повертається як зазвичай
+        if not watcher.done():
+            raise
+    finally:
+        watcher.cancel()
+        bucket.close()
+        await bot.session.close()
+        await close_db()
+
+    return {
+        "shard": shard,
+        "sent": result.sent,
+        "failed": result.failed,
+        "retries": result.retries,
+        "flood_waits": result.flood_waits,
+        "elapsed": result.elapsed,
+        "throughput": result.throughput,
+    }
+
+def _shard_main(*args) -> Dict:
+    """Точка входу процесу шарду"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return asyncio.run(_run_shard(*args))
+
+async def send_sharded(bot: Bot, broadcast_id: int, text: str, media: Optional[BroadcastMedia],
+                       result: BroadcastResult, shards: int, poll_interval: float = 1.0):
+    """
+    Доставити одержувачів розсилки (вже створених в broadcast_log) shards процесами
+    Поки шарди працюють, лічильники result оновлюються з журналу (для звіту прогресу);
+    підсумки кожного шарду зберігаються в result.shards. Якщо процес шарду впав, його
+    одержувачі без підтвердження стають unknown, а решту доставляє викликаючий процес.
+    При скасуванні (зупинка бота) шарди отримують сигнал зупинки, а event loop не чекає
+    на завершення процесів
+    """
+    progress = await get_broadcast_progress(broadcast_id)
+    sent_before = progress.get(SENT, 0)
+    failed_before = sum(progress.values()) - sent_before - progress.get("pending", 0)
+
+    started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    # spawn: дочірній процес не успадковує потоки aiosqlite та event loop бота
+    await asyncio.to_thread(_stop_flag, broadcast_id, False)
+    pool = ProcessPoolExecutor(max_workers=shards, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = [
+            loop.run_in_executor(
+                pool, _shard_main, shard, shards, broadcast_id, text,
+                media.to_json() if media else None, bot.token, bot.session.api
+            )
+            for shard in range(shards)
+        ]
+        pending = set(futures)
+        while pending:
+            _, pending = await asyncio.wait(pending, timeout=poll_interval)
+            progress = await get_broadcast_progress(broadcast_id)
+            result.sent = progress.get(SENT, 0) - sent_before
+            result.failed = (
+                sum(progress.values()) - progress.get(SENT, 0) - progress.get("pending", 0)
+                - progress.get("claimed", 0) - failed_before
+            )
+    except BaseException:
+        # Шарди дописують журнал і завершуються самі; недоставлене продовжить resume_broadcasts
+        pool.shutdown(wait=False, cancel_futures=True)
+        await asyncio.to_thread(_stop_flag, broadcast_id, True)
+        raise
+    await asyncio.to_thread(pool.shutdown)
+
+    shard_results: List[Dict] = []
+    for shard, future in enumerate(futures):
+        try:
+            shard_results.append(future.result())
+        except Exception as e:
+            logger.error(f"Процес шарду {shard + 1}/{shards} розсилки {broadcast_id} впав: {e}")
+    if len(shard_results) < shards:
+        await release_claimed_recipients(broadcast_id)
+
+    result.elapsed += time.monotonic() - started
+    result.retries += sum(shard["retries"] for shard in shard_results)
+    result.flood_waits += sum(shard["flood_waits"] for shard in shard_results)
+    result.shards = sorted(shard_results, key=lambda shard: shard["shard"])
+    for shard in result.shards:
+        logger.info(
+            f"Розсилка {broadcast_id}, шард {shard['shard'] + 1}/{shards}: "
+            f"доставлено {shard['sent']}, помилок {shard['failed']}, "
+            f"{shard['elapsed']:.1f} с, {shard['throughput']:.1f} повідомлень/с"
+        )
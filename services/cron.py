@@ -0,0 +1,226 @@
+"""
+CRON вирази для регулярних розсилок
+Формат: "хвилина година день місяць день_тижня" з підтримкою *, списків (1,15),
+діапазонів (1-5), кроків (*/10, 8-18/2) та назв (jan-dec, sun-sat), а також
+скорочень @hourly, @daily, @weekly, @monthly, @yearly
+"""
+
+import calendar
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from apscheduler.triggers.base import BaseTrigger
+
+class CronError(ValueError):
+    """Некоректний CRON вираз"""
+
+@dataclass(frozen=True)
+class _Field:
+    """Опис поля CRON виразу"""
+    name: str
+    low: int
+    high: int
+    names: Dict[str, int]
+
+_MONTH_NAMES = {name.lower(): i for i, name in enumerate(calendar.month_abbr) if name}
+_DAY_NAMES = {"sun": 0, "mon": 1, "tue": 2, "wed": 3, "thu": 4, "fri": 5, "sat": 6}
+
+_FIELDS = (
+    _Field("хвилина", 0, 59, {}),
+    _Field("година", 0, 23, {}),
+    _Field("день місяця", 1, 31, {}),
+    _Field("місяць", 1, 12, _MONTH_NAMES),
+    # 7 - теж неділя
+    _Field("день тижня", 0, 7, _DAY_NAMES),
+)
+
+_MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+# Найдовший можливий інтервал між запусками - 29 лютого раз на 8 років (2096 -> 2104)
+_SEARCH_YEARS = 9
+
+def _value(text: str, field: _Field) -> int:
+    """Число або назва (jan, mon) в межах поля"""
+    if text.lower() in field.names:
+        return field.names[text.lower()]
+    if not text.isdigit():
+        raise CronError(f"{field.name}: некоректне значення '{text}'")
+    value = int(text)
+    if not field.low <= value <= field.high:
+        raise CronError(f"{field.name}: {value} поза межами {field.low}-{field.high}")
+    return value
+
+def _parse_field(text: str, field: _Field) -> int:
+    """Розібрати поле в бітову маску (біт N - значення N дозволене)"""
+    mask = 0
+    for part in text.split(","):
+        base, _, step_text = part.partition("/")
+        step = 1
+        if step_text:
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise CronError(f"{field.name}: некоректний крок '{step_text}'")
+            step = int(step_text)
+
+        if base == "*":
+            start, end = field.low, field.high
+        elif "-" in base:
+            start_text, _, end_text = base.partition("-")
+            start, end = _value(start_text, field), _value(end_text, field)
+            if start > end:
+                raise CronError(f"{field.name}: діапазон '{base}' у зворотному порядку")
+        elif base:
+            start = _value(base, field)
+            # "5/15" - з 5 до кінця діапазону з кроком 15
+            end = field.high if step_text else start
+        else:
+            raise CronError(f"{field.name}: порожнє значення в '{text}'")
+
+        for value in range(start, end + 1, step):
+            mask |= 1 << value
+    return mask
+
+def _next_bit(mask: int, start: int) -> Optional[int]:
+    """Найменше дозволене значення >= start"""
+    rest = mask >> start
+    if not rest:
+        return None
+    return start + (rest & -rest).bit_length() - 1
+
+class CronExpression:
+    """Розібраний CRON вираз з обчисленням наступних запусків"""
+
+    def __init__(self, expression: str):
+        self.expression = " ".join(expression.split())
+        source = _MACROS.get(self.expression.lower(), self.expression)
+        parts = source.split()
+        if len(parts) != 5:
+            raise CronError(
+                "має бути 5 частин розділених пробілами: хвилина година день місяць день_тижня"
+            )
+
+        masks = [_parse_field(part, field) for part, field in zip(parts, _FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = masks
+        # Неділя може бути записана як 0 або 7
+        self.weekdays = (weekdays | (weekdays >> 7)) & 0x7F
+
+        # Як у класичному cron: якщо обидва поля днів обмежені, достатньо збігу будь-якого
+        self._days_any = parts[2].startswith("*")
+        self._weekdays_any = parts[4].startswith("*")
+
+        if self.next_after(datetime(2000, 1, 1)) is None:
+            raise CronError("вираз ніколи не спрацює (немає такої дати)")
+
+    def __str__(self) -> str:
+        return self.expression
+
+    def __repr__(self) -> str:
+        return f"CronExpression({self.expression!r})"
+
+    def _day_matches(self, day: date) -> bool:
+        """Чи дозволений день з урахуванням полів дня місяця та дня тижня"""
+        in_days = bool(self.days >> day.day & 1)
+        # isoweekday(): пн=1 ... нд=7 -> нд=0
+        in_weekdays = bool(self.weekdays >> (day.isoweekday() % 7) & 1)
+        if self._days_any or self._weekdays_any:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def _next_day(self, year: int, month: int, day: int) -> Optional[date]:
+        """Перший дозволений день місяця, не раніше day"""
+        last = calendar.monthrange(year, month)[1]
+        for current in range(day, last + 1):
+            candidate = date(year, month, current)
+            if self._day_matches(candidate):
+                return candidate
+        return None
+
+    def next_after(self, moment: datetime) -> Optional[datetime]:
+        """
+        Перший час запуску строго після moment (naive, той самий часовий пояс)
+        Перехід йде одразу до наступного дозволеного місяця/дня/години/хвилини
+        """
+        current = moment.replace(second=0, microsecond=0, tzinfo=None) + timedelta(minutes=1)
+        year, month = current.year, current.month
+        day, hour, minute = current.day, current.hour, current.minute
+
+        while year <= moment.year + _SEARCH_YEARS:
+            next_month = _next_bit(self.months, month)
+            if next_month is None:
+                year, month, day, hour, minute = year + 1, 1, 1, 0, 0
+                continue
+            if next_month != month:
+                month, day, hour, minute = next_month, 1, 0, 0
+
+            found_day = self._next_day(year, month, day)
+            if found_day is None:
+                month, day, hour, minute = month + 1, 1, 0, 0
+                if month > 12:
+                    year, month = year + 1, 1
+                continue
+            if found_day.day != day:
+                day, hour, minute = found_day.day, 0, 0
+
+            next_hour = _next_bit(self.hours, hour)
+            if next_hour is None:
+                # Далі - наступний день
+                following = date(year, month, day) + timedelta(days=1)
+                year, month, day, hour, minute = following.year, following.month, following.day, 0, 0
+                continue
+            if next_hour != hour:
+                hour, minute = next_hour, 0
+
+            next_minute = _next_bit(self.minutes, minute)
+            if next_minute is None:
+                hour, minute = hour + 1, 0
+                if hour > 23:
+                    following = date(year, month, day) + timedelta(days=1)
+                    year, month, day, hour = following.year, following.month, following.day, 0
+                continue
+            return datetime(year, month, day, hour, next_minute)
+        return None
+
+    def preview(self, count: int, start: datetime) -> List[datetime]:
+        """Наступні count запусків після start"""
+        runs = []
+        moment = start
+        while len(runs) < count:
+            moment = self.next_after(moment)
+            if moment is None:
+                break
+            runs.append(moment)
+        return runs
+
+def parse_cron(expression: str) -> CronExpression:
+    """Розібрати та перевірити CRON вираз (CronError з поясненням при помилці)"""
+    return CronExpression(expression)
+
+class CronExpressionTrigger(BaseTrigger):
+    """Тригер APScheduler на основі CronExpression (час розкладу - в заданому часовому поясі)"""
+
+    def __init__(self, expression: CronExpression, timezone: str):
+        self.expression = expression
+        self.timezone = ZoneInfo(timezone)
+
+    def get_next_fire_time(self, previous_fire_time: Optional[datetime], now: datetime) -> Optional[datetime]:
+        base = previous_fire_time or now
+        local = base.astimezone(self.timezone).replace(tzinfo=None)
+        next_local = self.expression.next_after(local)
+        if next_local is None:
+            return None
+        return next_local.replace(tzinfo=self.timezone)
+
+    def __str__(self) -> str:
+        return f"cron[{self.expression}]"
+
+    def __repr__(self) -> str:
+        return f"<CronExpressionTrigger ({self.expression!r}, timezone='{self.timezone}')>"
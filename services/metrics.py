@@ -0,0 +1,284 @@
+"""
+Метрики бота у форматі Prometheus (text exposition, GET /metrics)
+Лічильники - звичайні числа та списки без блокувань: вся робота бота йде в одному
+event loop, тож оновлення метрики коштує кілька мікросекунд (dict + bisect)
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+from services.tracing import span, current_trace
+
+logger = logging.getLogger(__name__)
+
+# Межі бакетів гістограм затримок, с
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Базова метрика з набором міток"""
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """(суфікс імені, мітки, значення)"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}"
+                     for suffix, labels, value in self.samples())
+        return "\n".join(lines)
+
+class _ValueMetric(Metric):
+    """
+    Метрика зі значенням на кожен набір міток
+    callback (якщо задано) читає значення при кожному запиті /metrics: число або
+    словник {кортеж міток: значення} - для лічильників, які вже веде інший компонент
+    """
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Any]] = None):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+        self._values: Dict[Tuple, float] = {}
+
+    def samples(self):
+        values = self._values
+        if self.callback is not None:
+            try:
+                result = self.callback()
+                values = result if isinstance(result, dict) else {(): result}
+            except Exception as e:
+                logger.error(f"Помилка читання метрики {self.name}: {e}")
+                values = {}
+        return [("", _format_labels(self.labelnames, labels), value)
+                for labels, value in values.items()]
+
+class Counter(_ValueMetric):
+    """Лічильник, що лише зростає"""
+    type = "counter"
+
+    def inc(self, *labels: Any, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(_ValueMetric):
+    """Поточне значення"""
+    type = "gauge"
+
+    def set(self, value: float, *labels: Any):
+        self._values[labels] = value
+
+class _HistogramChild:
+    """Розподіл значень для одного набору міток"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Histogram(Metric):
+    """Гістограма (бакети зберігаються окремо, накопичуються при виводі)"""
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Tuple, _HistogramChild] = {}
+
+    def labels(self, *labels: Any) -> _HistogramChild:
+        """Розподіл для міток (можна зберегти і викликати observe напряму)"""
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = _HistogramChild(self.buckets)
+        return child
+
+    def observe(self, value: float, *labels: Any):
+        self.labels(*labels).observe(value)
+
+    def samples(self):
+        result = []
+        for labels, child in self._children.items():
+            # Мітки, створені наперед (timed), з'являються після першого виклику
+            if not child.count:
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                result.append(("_bucket", _format_labels(self.labelnames, labels, le), cumulative))
+            base = _format_labels(self.labelnames, labels)
+            result.append(("_sum", base, child.sum))
+            result.append(("_count", base, child.count))
+        return result
+
+class MetricsRegistry:
+    """Усі метрики процесу"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = (),
+                callback: Optional[Callable[[], Any]] = None) -> Counter:
+        return self.register(Counter(name, help, labelnames, callback))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (),
+              callback: Optional[Callable[[], Any]] = None) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, callback))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+# Глобальний реєстр метрик
+registry = MetricsRegistry()
+
+HANDLER_UPDATES = registry.counter(
+    "bot_handler_updates_total", "Оброблені апдейти за роутером, обробником та результатом",
+    ("router", "handler", "status")
+)
+HANDLER_LATENCY = registry.histogram(
+    "bot_handler_duration_seconds", "Час роботи обробника", ("router", "handler")
+)
+DB_LATENCY = registry.histogram(
+    "bot_db_call_duration_seconds", "Час виклику функцій db.py", ("function",)
+)
+ZENEDU_LATENCY = registry.histogram(
+    "bot_zenedu_call_duration_seconds", "Час запитів до ZenEdu", ("method",)
+)
+LOOP_LAG = registry.histogram(
+    "bot_event_loop_lag_seconds", "Запізнення event loop відносно запланованого пробудження",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+
+def timed(histogram: Histogram, label: Optional[str] = None, span_kind: Optional[str] = None):
+    """
+    Декоратор async-функції: час кожного виклику в histogram з міткою імені функції
+    span_kind - також врахувати час у trace апдейта (services.tracing)
+    """
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        child = histogram.labels(label or func.__name__)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                if span_kind is None:
+                    return await func(*args, **kwargs)
+                with span(span_kind):
+                    return await func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+# Час викликів db.py
+db_timed = timed(DB_LATENCY, span_kind="db")
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Кількість та час роботи обробників роутера (реєструється як внутрішній middleware)"""
+
+    def __init__(self, router_name: str):
+        self.router_name = router_name
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        trace = current_trace()
+        if trace is not None:
+            trace.handler = f"{self.router_name}.{name}"
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            with span("handler"):
+                return await handler(event, data)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, self.router_name, name)
+            HANDLER_UPDATES.inc(self.router_name, name, status)
+
+class EventLoopMonitor:
+    """Вимір запізнення event loop: наскільки пізніше за заплановане прокидається sleep"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+        registry.gauge("bot_event_loop_lag_last_seconds", "Останнє виміряне запізнення event loop",
+                       callback=lambda: self.last_lag)
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, time.perf_counter() - started - self.interval)
+            LOOP_LAG.observe(self.last_lag)
+
+    def start(self):
+        """Запустити вимір у фоні"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Зупинити вимір"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+# Глобальний монітор event loop
+loop_monitor = EventLoopMonitor()
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """GET /metrics"""
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
@@ -0,0 +1,165 @@
+"""
+Зберігання журналу розсилок
+Рядки broadcast_log завершених розсилок (після підрахунку broadcast_stats) переносяться
+у стиснені архіви gzip JSONL і видаляються з БД; звільнене місце повертається через
+incremental VACUUM, тож гаряча таблиця та файл БД (і його бекап) не ростуть безмежно
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from config import (
+    BROADCAST_LOG_RETENTION_DAYS, BROADCAST_LOG_MAX_ROWS,
+    BROADCAST_ARCHIVE_DIR, BROADCAST_ARCHIVE_RETENTION_DAYS
+)
+from db import (
+    get_archivable_broadcasts, iter_broadcast_log, archive_broadcast_log,
+    has_broadcast_stats, save_broadcast_stats,
+    enable_incremental_vacuum, incremental_vacuum, checkpoint_db
+)
+
+logger = logging.getLogger(__name__)
+
+class BroadcastLogRetention:
+    """Архівація старого журналу розсилок та стиснення БД"""
+
+    def __init__(self, retention_days: int = BROADCAST_LOG_RETENTION_DAYS,
+                 max_rows: int = BROADCAST_LOG_MAX_ROWS,
+                 archive_dir: str = BROADCAST_ARCHIVE_DIR,
+                 archive_retention_days: int = BROADCAST_ARCHIVE_RETENTION_DAYS):
+        self.retention_days = retention_days
+        self.max_rows = max_rows
+        self.archive_dir = archive_dir
+        self.archive_retention_days = archive_retention_days
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def archive_path(self, broadcast_id: int, first_log_id: int, last_log_id: int) -> str:
+        """
+        Файл частини архіву розсилки; ім'я визначається діапазоном id рядків, тож повтор
+        перерваного проходу переписує той самий файл, а не створює дублікат
+        """
+        return os.path.join(
+            self.archive_dir, f"broadcast_log_{broadcast_id}.{first_log_id}-{last_log_id}.jsonl.gz"
+        )
+
+    async def archive_broadcast(self, broadcast_id: int) -> int:
+        """
+        Перенести журнал розсилки в архівний файл і видалити з БД
+        Файл пишеться під тимчасовим ім'ям і перейменовується лише після повного запису,
+        тож рядки видаляються тільки коли архів точно збережено
+        """
+        # Підсумки мають бути пораховані до видалення рядків
+        if not await has_broadcast_stats(broadcast_id):
+            await save_broadcast_stats(broadcast_id)
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        tmp_path = os.path.join(self.archive_dir, f"broadcast_log_{broadcast_id}.jsonl.gz.tmp")
+        archive = await asyncio.to_thread(gzip.open, tmp_path, "wt", encoding="utf-8")
+        rows = 0
+        first_log_id = last_log_id = None
+        try:
+            async for chunk in iter_broadcast_log(broadcast_id):
+                lines = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk)
+                await asyncio.to_thread(archive.write, lines)
+                if first_log_id is None:
+                    first_log_id = chunk[0]["id"]
+                last_log_id = chunk[-1]["id"]
+                rows += len(chunk)
+        finally:
+            await asyncio.to_thread(archive.close)
+        if not rows:
+            os.remove(tmp_path)
+            return 0
+
+        path = self.archive_path(broadcast_id, first_log_id, last_log_id)
+        os.replace(tmp_path, path)
+        deleted = await archive_broadcast_log(broadcast_id, path, last_log_id)
+        logger.info(f"Журнал розсилки {broadcast_id} перенесено в {path}: {rows} рядків, видалено {deleted}")
+        return deleted
+
+    def _remove_expired_archives(self) -> int:
+        """Видалити архіви, старші за archive_retention_days (0 - не видаляти)"""
+        if not self.archive_retention_days or not os.path.isdir(self.archive_dir):
+            return 0
+        cutoff = time.time() - self.archive_retention_days * 86400
+        removed = 0
+        for name in os.listdir(self.archive_dir):
+            path = os.path.join(self.archive_dir, name)
+            if name.endswith(".jsonl.gz") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    async def run(self) -> Dict[str, int]:
+        """
+        Один прохід: архівація, incremental VACUUM, очищення старих архівів
+        БД, створена без auto_vacuum, сама не перетворюється (повний VACUUM блокує всі записи) -
+        це робить адмін через compact_database()
+        """
+        async with self._lock:
+            stats = {"broadcasts": 0, "rows": 0, "freed_pages": 0, "removed_archives": 0}
+            try:
+                for broadcast_id in await get_archivable_broadcasts(self.retention_days, self.max_rows):
+                    stats["rows"] += await self.archive_broadcast(broadcast_id)
+                    stats["broadcasts"] += 1
+
+                if await enable_incremental_vacuum(convert=False):
+                    stats["freed_pages"] = await incremental_vacuum()
+                    # У WAL файл БД зменшується лише при checkpoint
+                    if stats["freed_pages"]:
+                        await checkpoint_db()
+                elif stats["rows"]:
+                    logger.warning(
+                        "БД без auto_vacuum = INCREMENTAL: місце після архівації не повертається, "
+                        "потрібне одноразове стиснення БД (адмін панель → Налаштування)"
+                    )
+                stats["removed_archives"] = await asyncio.to_thread(self._remove_expired_archives)
+            except Exception as e:
+                logger.error(f"Помилка архівації журналу розсилок: {e}")
+
+            if stats["broadcasts"] or stats["freed_pages"] or stats["removed_archives"]:
+                logger.info(
+                    f"Архівація журналу розсилок: {stats['broadcasts']} розсилок, "
+                    f"{stats['rows']} рядків, звільнено {stats['freed_pages']} сторінок БД, "
+                    f"видалено {stats['removed_archives']} старих архівів"
+                )
+            return stats
+
+    async def compact_database(self) -> bool:
+        """
+        Одноразово перевести стару БД на auto_vacuum = INCREMENTAL (повний VACUUM)
+        На час перезапису файлу БД всі записи чекають, тож запускається лише вручну;
+        повертає True, якщо перетворення виконано
+        """
+        async with self._lock:
+            if await enable_incremental_vacuum(convert=False):
+                return False
+            await enable_incremental_vacuum(convert=True)
+            await checkpoint_db()
+            return True
+
+    def schedule(self):
+        """
+        Запустити прохід у фоні, якщо він ще не йде (після розсилки та за розкладом)
+        Задача зберігається, тож stop() дочекається її перед закриттям БД
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Дочекатися фонового проходу перед закриттям БД"""
+        if self._task is not None and not self._task.done():
+            try:
+                await asyncio.wait_for(self._task, timeout=30)
+            except asyncio.TimeoutError:
+                logger.warning("Архівацію журналу розсилок перервано зупинкою бота")
+        self._task = None
+
+# Глобальний сервіс зберігання журналу розсилок
+broadcast_log_retention = BroadcastLogRetention()
@@ -0,0 +1,189 @@
+"""
+Планувальник розсилок
+Одноразові (broadcasts.scheduled_time) та регулярні (recurring_broadcasts.cron_expression)
+розсилки реєструються в APScheduler, який спить до найближчого запуску
+і передає розсилку рушію доставки. CRON вирази розбирає services.cron зі стандартною
+нумерацією днів тижня (0 і 7 - неділя, 1 - понеділок), а не CronTrigger APScheduler
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from aiogram import Bot
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.date import DateTrigger
+
+from config import TIMEZONE, BROADCAST_RETENTION_CRON, AUDIENCE_NAMES
+from db import (
+    get_scheduled_broadcasts, get_active_recurring_broadcasts, get_broadcast_by_id,
+    get_recurring_broadcast_by_id, update_recurring_schedule, save_broadcast
+)
+from services.broadcast_media import BroadcastMedia
+from services.broadcast_sender import deliver_and_report
+from services.cron import CronExpressionTrigger, parse_cron
+from services.retention import broadcast_log_retention
+
+logger = logging.getLogger(__name__)
+
+def local_now() -> datetime:
+    """Поточний час в часовому поясі розкладу (naive, як дата/час від адміна)"""
+    return datetime.now(ZoneInfo(TIMEZONE)).replace(tzinfo=None)
+
+def _to_db_time(moment: Optional[datetime]) -> Optional[str]:
+    """Час у форматі CURRENT_TIMESTAMP (UTC) для next_run"""
+    if moment is None:
+        return None
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+class BroadcastScheduler:
+    """Запуск запланованих та регулярних розсилок у визначений час"""
+
+    def __init__(self, tz: str = TIMEZONE):
+        self.timezone = tz
+        self._scheduler: Optional[AsyncIOScheduler] = None
+        self._bot: Optional[Bot] = None
+
+    @property
+    def running(self) -> bool:
+        return self._scheduler is not None and self._scheduler.running
+
+    async def start(self, bot: Bot) -> int:
+        """Запустити планувальник та завантажити розклад з БД; повертає кількість задач"""
+        self._bot = bot
+        self._scheduler = AsyncIOScheduler(
+            timezone=self.timezone,
+            # Пропущені під час простою запуски виконуються один раз після старту
+            job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": None}
+        )
+        self._scheduler.start()
+
+        # Щоденна архівація старого журналу розсилок
+        self._scheduler.add_job(
+            self._run_retention,
+            CronExpressionTrigger(parse_cron(BROADCAST_RETENTION_CRON), self.timezone),
+            id="broadcast_log_retention", replace_existing=True
+        )
+
+        count = 0
+        for broadcast in await get_scheduled_broadcasts():
+            if self.schedule_broadcast(broadcast["id"], broadcast["scheduled_for"]):
+                count += 1
+        for recurring in await get_active_recurring_broadcasts():
+            if await self.schedule_recurring(recurring["id"], recurring["cron_expression"]):
+                count += 1
+        return count
+
+    def shutdown(self):
+        """Зупинити планувальник"""
+        if self.running:
+            self._scheduler.shutdown(wait=False)
+        self._scheduler = None
+
+    def schedule_broadcast(self, broadcast_id: int, run_at: str) -> bool:
+        """Запланувати одноразову розсилку (run_at - ISO дата/час в часовому поясі розкладу)"""
+        if not self.running:
+            logger.warning(f"Планувальник не запущений, розсилку {broadcast_id} не заплановано")
+            return False
+        try:
+            trigger = DateTrigger(run_date=datetime.fromisoformat(run_at), timezone=self.timezone)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Некоректний час розсилки {broadcast_id} ({run_at}): {e}")
+            return False
+
+        self._scheduler.add_job(
+            self._fire_scheduled, trigger, args=[broadcast_id],
+            id=f"broadcast:{broadcast_id}", replace_existing=True
+        )
+        return True
+
+    async def schedule_recurring(self, recurring_id: int, cron_expression: str) -> bool:
+        """Запланувати регулярну розсилку за CRON виразом та зберегти next_run"""
+        if not self.running:
+            logger.warning(f"Планувальник не запущений, регулярну розсилку {recurring_id} не заплановано")
+            return False
+        try:
+            trigger = CronExpressionTrigger(parse_cron(cron_expression), self.timezone)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Некоректний CRON регулярної розсилки {recurring_id} ({cron_expression}): {e}")
+            return False
+
+        job = self._scheduler.add_job(
+            self._fire_recurring, trigger, args=[recurring_id],
+            id=f"recurring:{recurring_id}", replace_existing=True
+        )
+        await update_recurring_schedule(recurring_id, _to_db_time(job.next_run_time))
+        return True
+
+    def _remove_job(self, job_id: str):
+        """Прибрати задачу, якщо вона є"""
+        if not self.running:
+            return
+        try:
+            self._scheduler.remove_job(job_id)
+        except JobLookupError:
+            pass
+
+    def unschedule_broadcast(self, broadcast_id: int):
+        """Скасувати одноразову розсилку"""
+        self._remove_job(f"broadcast:{broadcast_id}")
+
+    def unschedule_recurring(self, recurring_id: int):
+        """Скасувати регулярну розсилку"""
+        self._remove_job(f"recurring:{recurring_id}")
+
+    async def _run_retention(self):
+        """Нічна архівація журналу розсилок (фоновою задачею retention, яку чекає зупинка бота)"""
+        broadcast_log_retention.schedule()
+
+    async def _fire_scheduled(self, broadcast_id: int):
+        """Настав час одноразової розсилки"""
+        broadcast = await get_broadcast_by_id(broadcast_id)
+        # Розсилку могли видалити або вже запустити (відновлення після перезапуску)
+        if broadcast.get("status") != "pending":
+            return
+
+        logger.info(f"Запуск запланованої розсилки {broadcast_id}")
+        await deliver_and_report(
+            self._bot, broadcast_id, broadcast["message_text"], broadcast["audience_type"],
+            audience_name=AUDIENCE_NAMES.get(broadcast["audience_type"], broadcast["audience_type"]),
+            report_chat_id=broadcast["admin_id"],
+            media=BroadcastMedia.from_json(broadcast["media"])
+        )
+
+    async def _fire_recurring(self, recurring_id: int):
+        """Настав час регулярної розсилки: окремий запис в broadcasts на кожен запуск"""
+        recurring = await get_recurring_broadcast_by_id(recurring_id)
+        if recurring.get("status") != "active":
+            self.unschedule_recurring(recurring_id)
+            return
+
+        job = self._scheduler.get_job(f"recurring:{recurring_id}")
+        await update_recurring_schedule(
+            recurring_id, _to_db_time(job.next_run_time if job else None), mark_run=True
+        )
+
+        media = BroadcastMedia.from_json(recurring["media"])
+        broadcast_id = await save_broadcast(
+            admin_id=recurring["admin_id"],
+            message_text=recurring["message_text"],
+            audience=recurring["audience_type"],
+            status="sending",
+            media=recurring["media"],
+            media_file_id=media.file_id if media else None
+        )
+        if not broadcast_id:
+            return
+
+        logger.info(f"Запуск регулярної розсилки {recurring_id} (розсилка {broadcast_id})")
+        await deliver_and_report(
+            self._bot, broadcast_id, recurring["message_text"], recurring["audience_type"],
+            audience_name=AUDIENCE_NAMES.get(recurring["audience_type"], recurring["audience_type"]),
+            report_chat_id=recurring["admin_id"],
+            media=media
+        )
+
+# Глобальний планувальник розсилок
+broadcast_scheduler = BroadcastScheduler()
@@ -0,0 +1,128 @@
+"""
+Трасування обробки апдейтів
+Зовнішній middleware відкриває trace для кожного апдейта (contextvar), а виклики БД,
+Telegram API та ZenEdu додають в нього свій час. Якщо апдейт оброблявся довше за
+UPDATE_SLOW_THRESHOLD, в лог пишеться структурований запис з розбивкою часу
+"""
+
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject, Update
+
+from config import UPDATE_SLOW_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Частини часу, що враховуються окремо
+SPAN_KINDS = ("handler", "db", "telegram", "zenedu")
+
+class UpdateTrace:
+    """Час обробки одного апдейта по частинах"""
+
+    def __init__(self, update_id: Optional[int], event_type: str):
+        self.update_id = update_id
+        self.event_type = event_type
+        self.user_id: Optional[int] = None
+        self.handler: Optional[str] = None
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.spans: Dict[str, float] = {kind: 0.0 for kind in SPAN_KINDS}
+        self.calls: Dict[str, int] = {kind: 0 for kind in SPAN_KINDS}
+        self.finished = False
+        self._open: Set[str] = set()
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+        self.finished = True
+
+    def record(self) -> Dict[str, Any]:
+        """Запис для лога: загальний час, middleware (все поза обробником) та частини, мс"""
+        handler = self.spans["handler"]
+        record = {
+            "update_id": self.update_id,
+            "event": self.event_type,
+            "user_id": self.user_id,
+            "handler": self.handler,
+            "total_ms": round(self.total * 1000, 1),
+            "middleware_ms": round(max(0.0, self.total - handler) * 1000, 1),
+        }
+        for kind in SPAN_KINDS:
+            record[f"{kind}_ms"] = round(self.spans[kind] * 1000, 1)
+            if kind != "handler":
+                record[f"{kind}_calls"] = self.calls[kind]
+        return record
+
+_current_trace: ContextVar[Optional[UpdateTrace]] = ContextVar("update_trace", default=None)
+
+def current_trace() -> Optional[UpdateTrace]:
+    """Trace апдейта, що обробляється в поточному контексті"""
+    return _current_trace.get()
+
+class span:
+    """
+    Врахувати час блоку в trace поточного апдейта як kind
+    Вкладені блоки того ж виду (функція БД викликає іншу) рахуються один раз; після
+    завершення апдейта (фонові задачі, запущені з обробника) нічого не записується
+    """
+    __slots__ = ("kind", "trace", "started")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.trace: Optional[UpdateTrace] = None
+
+    def __enter__(self):
+        trace = _current_trace.get()
+        if trace is not None and not trace.finished and self.kind not in trace._open:
+            trace._open.add(self.kind)
+            self.trace = trace
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        trace = self.trace
+        if trace is not None:
+            trace._open.discard(self.kind)
+            if not trace.finished:
+                trace.spans[self.kind] += time.perf_counter() - self.started
+                trace.calls[self.kind] += 1
+        return False
+
+class TracingMiddleware(BaseMiddleware):
+    """Зовнішній middleware dp.update: trace на кожен апдейт та лог повільних апдейтів"""
+
+    def __init__(self, threshold: float = UPDATE_SLOW_THRESHOLD):
+        self.threshold = threshold
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        trace = UpdateTrace(event.update_id, event.event_type)
+        user = data.get("event_from_user")
+        if user:
+            trace.user_id = user.id
+        token = _current_trace.set(trace)
+        try:
+            return await handler(event, data)
+        finally:
+            _current_trace.reset(token)
+            trace.finish()
+            if self.threshold and trace.total >= self.threshold:
+                logger.warning(f"Повільний апдейт: {json.dumps(trace.record(), ensure_ascii=False)}")
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сесії бота: час запитів до Telegram API"""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[Any],
+                       bot: Bot, method: TelegramMethod[Any]) -> Any:
+        with span("telegram"):
+            return await make_request(bot, method)
@@ -0,0 +1,364 @@
+"""
+Конвеєр обробки апдейтів webhook
+Telegram отримує відповідь одразу після постановки апдейта в чергу, а обробка йде
+у фоні. Апдейти одного чату обробляються строго по черзі, різних чатів - паралельно;
+черги обмежені: при переповненні Telegram отримує 503 і повторить доставку пізніше,
+тож пам'ять не росте, а апдейти не губляться. Повторні доставки (Telegram повторює
+апдейт при таймауті) відсікаються за update_id ще до черги
+"""
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from config import (
+    UPDATE_WORKERS, UPDATE_QUEUE_SIZE, UPDATE_LANE_SIZE, UPDATE_LANE_IDLE, UPDATE_ENQUEUE_TIMEOUT,
+    UPDATE_DEDUP_WINDOW, BROADCAST_ALBUM_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """Чат (або користувач), до якого належить апдейт - ключ порядку обробки"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return None
+
+def album_group_id(update: Dict[str, Any]) -> Optional[str]:
+    """media_group_id частини альбому - такі апдейти AlbumCollector має отримати одночасно"""
+    message = update.get("message") or update.get("channel_post") or {}
+    return message.get("media_group_id")
+
+class UpdateDeduplicator:
+    """
+    Вікно останніх window update_id (бітова маска в кільцевому буфері)
+    update_id у Telegram зростають, тож достатньо пам'ятати лише останні; id, старіші
+    за вікно, вважаються вже обробленими
+    """
+
+    def __init__(self, window: int = UPDATE_DEDUP_WINDOW):
+        self.window = max(8, window)
+        self._bits = bytearray((self.window + 7) // 8)
+        self._high: Optional[int] = None  # Найбільший update_id у вікні
+
+    def _bit(self, update_id: int):
+        index = update_id % self.window
+        return index >> 3, 1 << (index & 7)
+
+    def _clear(self, start: int, end: int):
+        """Звільнити біти id з (start, end] - вони виходять з вікна"""
+        if end - start >= self.window:
+            self._bits[:] = bytes(len(self._bits))
+            return
+        for update_id in range(start + 1, end + 1):
+            byte, mask = self._bit(update_id)
+            self._bits[byte] &= ~mask
+
+    def __contains__(self, update_id: int) -> bool:
+        if self._high is None or update_id > self._high:
+            return False
+        if update_id <= self._high - self.window:
+            return True
+        byte, mask = self._bit(update_id)
+        return bool(self._bits[byte] & mask)
+
+    def add(self, update_id: int):
+        if self._high is None:
+            self._high = update_id
+        elif update_id > self._high:
+            self._clear(self._high, update_id)
+            self._high = update_id
+        elif update_id <= self._high - self.window:
+            return
+        byte, mask = self._bit(update_id)
+        self._bits[byte] |= mask
+
+    def discard(self, update_id: int):
+        """Забути id (апдейт не прийнято - Telegram доставить його повторно)"""
+        if self._high is not None and self._high - self.window < update_id <= self._high:
+            byte, mask = self._bit(update_id)
+            self._bits[byte] &= ~mask
+
+@dataclass
+class PipelineStats:
+    """Лічильники конвеєра для моніторингу back-pressure"""
+    received: int = 0
+    processed: int = 0
+    failed: int = 0
+    rejected: int = 0          # Черга переповнена - Telegram повторить доставку
+    duplicates: int = 0        # Повторні доставки вже прийнятих апдейтів
+    max_depth: int = 0         # Найбільша кількість апдейтів в чергах
+    max_lane_depth: int = 0    # Найбільша черга одного чату
+    max_lanes: int = 0         # Найбільша кількість одночасно активних чатів
+    lanes_created: int = 0
+    lanes_collected: int = 0   # Прибрано черг чатів після простою
+    wait_total: float = 0.0    # Сумарний час очікування в черзі, с
+    wait_max: float = 0.0
+    handle_total: float = 0.0  # Сумарний час обробки, с
+    handle_max: float = 0.0
+
+class _Lane:
+    """Черга апдейтів одного чату та задача, що обробляє її послідовно"""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.task: Optional[asyncio.Task] = None
+
+class UpdatePipeline:
+    """
+    Черги апдейтів по чатах
+    Кожен чат має свою чергу (lane): його апдейти обробляються строго послідовно, тож
+    два швидкі натискання не змагаються за стан FSM, а різні чати обробляються паралельно
+    (не більше workers одночасно). Черга чату створюється з першим апдейтом і прибирається
+    після idle_timeout секунд простою. Частини альбому, що йдуть підряд, чекають одна одну
+    (до album_delay секунд між частинами) і обробляються разом
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, workers: int = UPDATE_WORKERS,
+                 queue_size: int = UPDATE_QUEUE_SIZE, lane_size: int = UPDATE_LANE_SIZE,
+                 idle_timeout: float = UPDATE_LANE_IDLE,
+                 enqueue_timeout: float = UPDATE_ENQUEUE_TIMEOUT,
+                 album_delay: float = BROADCAST_ALBUM_DELAY, **data: Any):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.data = data
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.lane_size = max(1, lane_size)
+        self.idle_timeout = idle_timeout
+        self.enqueue_timeout = enqueue_timeout
+        self.album_delay = album_delay
+        self.stats = PipelineStats()
+        self.dedup = UpdateDeduplicator()
+        self._lanes: Dict[int, _Lane] = {}
+        self._capacity: Optional[asyncio.Semaphore] = None
+        self._running: Optional[asyncio.Semaphore] = None
+        self._depth = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._accepting = False
+
+    @property
+    def depth(self) -> int:
+        """Апдейтів в чергах та в обробці зараз"""
+        return self._depth
+
+    @property
+    def lanes(self) -> int:
+        """Активних черг чатів"""
+        return len(self._lanes)
+
+    def _lane_for(self, key: int) -> _Lane:
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(self.lane_size)
+            lane.task = asyncio.create_task(self._run_lane(key, lane))
+            self.stats.lanes_created += 1
+            self.stats.max_lanes = max(self.stats.max_lanes, len(self._lanes))
+        return lane
+
+    async def submit(self, update: Dict[str, Any]) -> bool:
+        """
+        Поставити апдейт в чергу його чату
+        Якщо черги переповнені довше за enqueue_timeout - False (відповідь 503, Telegram повторить);
+        повторна доставка вже прийнятого апдейта лише підтверджується
+        """
+        if not self._accepting:
+            return False
+        self.stats.received += 1
+        update_id = update.get("update_id")
+        if update_id is not None:
+            if update_id in self.dedup:
+                self.stats.duplicates += 1
+                logger.info(f"Повторна доставка апдейта {update_id} пропущена")
+                return True
+            # Позначаємо до очікування місця: паралельна повторна доставка теж буде пропущена
+            self.dedup.add(update_id)
+        chat_id = update_chat_id(update)
+        key = chat_id if chat_id is not None else update_id or 0
+        try:
+            # Загальна ємність, потім місце в черзі чату (один чат не займе всі черги)
+            await asyncio.wait_for(self._capacity.acquire(), timeout=self.enqueue_timeout)
+            try:
+                lane = self._lane_for(key)
+                item = (time.monotonic(), update)
+                if lane.queue.full():
+                    await asyncio.wait_for(lane.queue.put(item), timeout=self.enqueue_timeout)
+                else:
+                    # Без await: черга не може бути прибрана між перевіркою та записом
+                    lane.queue.put_nowait(item)
+            except BaseException:
+                self._capacity.release()
+                raise
+        except asyncio.TimeoutError:
+            if update_id is not None:
+                self.dedup.discard(update_id)
+            self.stats.rejected += 1
+            logger.warning(
+                f"Черги апдейтів переповнені ({self._depth}, чат {key}), "
+                f"апдейт {update.get('update_id')} відхилено"
+            )
+            return False
+
+        self._depth += 1
+        self._drained.clear()
+        self.stats.max_depth = max(self.stats.max_depth, self._depth)
+        self.stats.max_lane_depth = max(self.stats.max_lane_depth, lane.queue.qsize())
+        return True
+
+    async def _handle(self, update: Dict[str, Any]):
+        """Обробка одного апдейта диспетчером"""
+        result = await self.dispatcher.feed_raw_update(bot=self.bot, update=update, **self.data)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+
+    async def _process(self, enqueued: float, update: Dict[str, Any]):
+        """Обробка апдейта з обліком часу очікування та обробки"""
+        started = time.monotonic()
+        waited = started - enqueued
+        self.stats.wait_total += waited
+        self.stats.wait_max = max(self.stats.wait_max, waited)
+        try:
+            await self._handle(update)
+            self.stats.processed += 1
+        except Exception as e:
+            self.stats.failed += 1
+            logger.error(f"Помилка обробки апдейта {update.get('update_id')}: {e}")
+        finally:
+            elapsed = time.monotonic() - started
+            self.stats.handle_total += elapsed
+            self.stats.handle_max = max(self.stats.handle_max, elapsed)
+            self._depth -= 1
+            self._capacity.release()
+            if not self._depth:
+                self._drained.set()
+
+    async def _collect_album(self, lane: _Lane, first: Tuple[float, Dict[str, Any]]):
+        """
+        Частини альбому з черги чату, що йдуть за first; повертає (частини, наступний апдейт)
+        Апдейт, що не належить альбому, повертається для обробки після нього
+        """
+        group_id = album_group_id(first[1])
+        parts = [first]
+        while True:
+            try:
+                item = await asyncio.wait_for(lane.queue.get(), timeout=self.album_delay)
+            except asyncio.TimeoutError:
+                return parts, None
+            if album_group_id(item[1]) != group_id:
+                return parts, item
+            parts.append(item)
+
+    async def _run_lane(self, key: int, lane: _Lane):
+        """Послідовна обробка апдейтів одного чату; після простою черга прибирається"""
+        item = None
+        while True:
+            if item is None:
+                try:
+                    item = await asyncio.wait_for(lane.queue.get(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if lane.queue.empty():
+                        del self._lanes[key]
+                        self.stats.lanes_collected += 1
+                        return
+                    continue
+
+            if album_group_id(item[1]) is None:
+                async with self._running:
+                    await self._process(*item)
+                item = None
+                continue
+
+            # AlbumCollector чекає всі частини одночасно - вони обробляються паралельно,
+            # але в одному слоті workers і до наступних апдейтів чату
+            parts, item = await self._collect_album(lane, item)
+            async with self._running:
+                await asyncio.gather(*(self._process(*part) for part in parts))
+
+    def start(self):
+        """Почати приймати апдейти"""
+        if self._capacity is None:
+            self._capacity = asyncio.Semaphore(self.queue_size)
+            self._running = asyncio.Semaphore(self.workers)
+        self._accepting = True
+
+    async def stop(self, timeout: float = 10.0):
+        """Перестати приймати апдейти, дообробити черги (не довше timeout) та зупинити обробку"""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дооброблено апдейтів при зупинці: {self._depth}")
+        tasks = [lane.task for lane in self._lanes.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._lanes.clear()
+
+    def snapshot(self, top: int = 5) -> Dict[str, Any]:
+        """Поточний стан для моніторингу; busiest_lanes - чати з найдовшими чергами"""
+        stats = self.stats
+        done = stats.processed + stats.failed
+        busiest = sorted(
+            ((key, lane.queue.qsize()) for key, lane in self._lanes.items()),
+            key=lambda item: item[1], reverse=True
+        )[:top]
+        return {
+            "workers": self.workers,
+            "capacity": self.queue_size,
+            "depth": self._depth,
+            "lanes": len(self._lanes),
+            "busiest_lanes": [{"chat_id": key, "depth": depth} for key, depth in busiest if depth],
+            "received": stats.received,
+            "processed": stats.processed,
+            "failed": stats.failed,
+            "rejected": stats.rejected,
+            "duplicates": stats.duplicates,
+            "max_depth": stats.max_depth,
+            "max_lane_depth": stats.max_lane_depth,
+            "max_lanes": stats.max_lanes,
+            "lanes_created": stats.lanes_created,
+            "lanes_collected": stats.lanes_collected,
+            "avg_wait_ms": round(stats.wait_total / done * 1000, 1) if done else 0.0,
+            "max_wait_ms": round(stats.wait_max * 1000, 1),
+            "avg_handle_ms": round(stats.handle_total / done * 1000, 1) if done else 0.0,
+            "max_handle_ms": round(stats.handle_max * 1000, 1),
+        }
+
+class FastAckRequestHandler(SimpleRequestHandler):
+    """Webhook handler: апдейт ставиться в UpdatePipeline, Telegram отримує відповідь одразу"""
+
+    def __init__(self, pipeline: UpdatePipeline, secret_token: Optional[str] = None):
+        super().__init__(dispatcher=pipeline.dispatcher, bot=pipeline.bot, secret_token=secret_token)
+        self.pipeline = pipeline
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.bot):
+            return web.Response(body="Unauthorized", status=401)
+        try:
+            update = await request.json(loads=json.loads)
+        except ValueError:
+            return web.Response(body="Bad Request", status=400)
+
+        if not await self.pipeline.submit(update):
+            return web.Response(body="Service Unavailable", status=503)
+        return web.json_response({})
+
+    async def stats_handler(self, request: web.Request) -> web.Response:
+        """Стан черг апдейтів (JSON)"""
+        return web.json_response(self.pipeline.snapshot())
@@ -12,9 +12,13 @@ import asyncio
 from typing import List, Dict, Any, Optional
 from config import ZENEDU_API_URL, ZENEDU_API_KEY, ZENEDU_WEBHOOK_SECRET
 from db import add_course, get_courses as get_db_courses, grant_course_access
+from services.metrics import timed, ZENEDU_LATENCY
 
 logger = logging.getLogger(__name__)
 
+# Час запитів до ZenEdu API
+zenedu_timed = timed(ZENEDU_LATENCY, span_kind="zenedu")
+
 class ZenEduClient:
     """
     Клієнт для взаємодії з ZenEdu API
@@ -33,6 +37,7 @@ class ZenEduClient:
         """Закрити HTTP сесію (не потрібно в демо-режимі)"""
         pass
     
+    @zenedu_timed
     async def test_connection(self) -> bool:
         """
         Тестує з'єднання з ZenEdu API
@@ -53,6 +58,7 @@ class ZenEduClient:
             logger.error(f"❌ Помилка тестування ZenEdu: {e}")
             return False
     
+    @zenedu_timed
     async def get_products(self) -> List[Dict[str, Any]]:
         """
         Отримує список всіх продуктів (курсів) з ZenEdu
@@ -74,6 +80,7 @@ class ZenEduClient:
             logger.error(f"❌ Помилка отримання продуктів: {e}")
             return []
     
+    @zenedu_timed
     async def get_product_details(self, product_id: str) -> Optional[Dict[str, Any]]:
         """
         Отримує детальну інформацію про продукт/курс
@@ -97,6 +104,7 @@ class ZenEduClient:
             logger.error(f"❌ Помилка запиту деталей продукту {product_id}: {e}")
             return None
     
+    @zenedu_timed
     async def create_subscriber(self, user_id: int, username: str = None, 
                               first_name: str = None) -> bool:
         """
@@ -112,6 +120,7 @@ class ZenEduClient:
             logger.error(f"❌ Помилка створення підписника {user_id}: {e}")
             return False
     
+    @zenedu_timed
     async def grant_product_access(self, product_id: str, user_id: int) -> bool:
         """
         Надає користувачу доступ до продукту в ZenEdu
@@ -126,6 +135,7 @@ class ZenEduClient:
             logger.error(f"❌ Помилка надання доступу користувачу {user_id} до продукту {product_id}: {e}")
             return False
     
+    @zenedu_timed
     async def revoke_product_access(self, product_id: str, user_id: int) -> bool:
         """
         Відбирає у користувача доступ до продукту
@@ -140,6 +150,7 @@ class ZenEduClient:
             logger.error(f"❌ Помилка відбирання доступу користувача {user_id} до продукту {product_id}: {e}")
             return False
     
+    @zenedu_timed
     async def check_user_access(self, product_id: str, user_id: int) -> bool:
         """
         Перевіряє чи має користувач доступ до продукту в ZenEdu
@@ -156,6 +167,7 @@ class ZenEduClient:
             logger.error(f"❌ Помилка перевірки доступу користувача {user_id} до продукту {product_id}: {e}")
             return False
     
+    @zenedu_timed
     async def get_product_access_link(self, product_id: str, user_id: int) -> Optional[str]:
         """
         Отримує персональне посилання для доступу до продукту
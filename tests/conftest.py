@@ -0,0 +1,18 @@
+"""
+Спільні налаштування тестів
+Змінні оточення задаються до імпорту config, тож тести працюють з окремою тимчасовою БД
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="prometey-tests-")
+
+os.environ["DATABASE_PATH"] = os.path.join(TEST_DIR, "bot.db")
+os.environ["BROADCAST_PROCESSES"] = "1"
+os.environ["BROADCAST_ARCHIVE_DIR"] = os.path.join(TEST_DIR, "archive")
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
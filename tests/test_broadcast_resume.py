@@ -0,0 +1,136 @@
+"""
+Відновлення розсилки після аварійної зупинки
+Розсилка запускається в окремому процесі, який вбивається (SIGKILL) посеред доставки;
+потім resume_broadcasts доводить її до кінця. Кожен одержувач має отримати повідомлення
+рівно один раз або бути в звіті як unknown (повідомлення було в дорозі під час збою)
+"""
+
+import asyncio
+import os
+import signal
+import sys
+from collections import Counter
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from config import BROADCAST_CONCURRENCY
+
+RECIPIENTS = 300
+KILL_AFTER = 100
+ADMIN_ID = 10 ** 9  # Не входить в аудиторію розсилки
+
+SENDER_SCRIPT = """
+import asyncio, sys
+sys.path.insert(0, {root!r})
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+import db
+from services.broadcast_sender import run_broadcast
+
+async def main():
+    await db.init_db()
+    bot = Bot("123:abc", session=AiohttpSession(api=TelegramAPIServer.from_base({api!r})))
+    await run_broadcast(bot, {broadcast_id}, "hello", "all")
+
+asyncio.run(main())
+"""
+
+class FakeTelegram:
+    """Bot API, що рахує надіслані повідомлення по чатах"""
+
+    def __init__(self):
+        self.received = Counter()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        chat_id = int(data.get("chat_id", 0))
+        # Повідомлення "в дорозі" - щоб SIGKILL застав частину запитів незавершеними
+        await asyncio.sleep(0.02)
+        if request.match_info["method"] == "sendMessage":
+            self.received[chat_id] += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "x"
+        }})
+
+async def _scenario():
+    import db
+    from services import broadcast_sender
+
+    telegram = FakeTelegram()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", telegram.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    api = f"http://127.0.0.1:{port}"
+
+    try:
+        await db.init_db()
+        for user_id in range(1, RECIPIENTS + 1):
+            await db.add_user(user_id, f"user{user_id}")
+        broadcast_id = await db.save_broadcast(ADMIN_ID, "hello", "all", status="sending")
+        await db.close_db()
+
+        # Доставка в окремому процесі, який вбиваємо посеред розсилки
+        script = SENDER_SCRIPT.format(
+            root=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            api=api, broadcast_id=broadcast_id
+        )
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", script, env=dict(os.environ),
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+        for _ in range(600):
+            if sum(telegram.received.values()) >= KILL_AFTER or process.returncode is not None:
+                break
+            await asyncio.sleep(0.05)
+        assert process.returncode is None, "процес розсилки завершився до вбивства"
+        process.send_signal(signal.SIGKILL)
+        await process.wait()
+        sent_before_kill = sum(telegram.received.values())
+
+        # Перезапуск бота: незавершені розсилки продовжуються
+        await db.init_db()
+        bot = Bot("123:abc", session=AiohttpSession(api=TelegramAPIServer.from_base(api)))
+        assert await broadcast_sender.resume_broadcasts(bot) == 1
+        await asyncio.gather(*broadcast_sender._running)
+        await bot.session.close()
+
+        statuses = {}
+        async with db._reader() as conn:
+            async with conn.execute(
+                "SELECT user_id, status FROM broadcast_log WHERE broadcast_id = ?", (broadcast_id,)
+            ) as cursor:
+                statuses = dict(await cursor.fetchall())
+        broadcast = await db.get_broadcast_by_id(broadcast_id)
+        return telegram.received, statuses, broadcast, sent_before_kill
+    finally:
+        await db.close_db()
+        await runner.cleanup()
+
+def test_killed_broadcast_resumes_without_double_sending():
+    received, statuses, broadcast, sent_before_kill = asyncio.run(_scenario())
+
+    assert KILL_AFTER <= sent_before_kill < RECIPIENTS
+    assert broadcast["status"] == "sent"
+    assert len(statuses) == RECIPIENTS
+
+    # Ніхто не отримав повідомлення двічі
+    assert max(received[user_id] for user_id in statuses) <= 1
+
+    unknown = [user_id for user_id, status in statuses.items() if status == "unknown"]
+    for user_id, status in statuses.items():
+        assert status in ("sent", "unknown"), (user_id, status)
+        if status == "sent":
+            assert received[user_id] == 1, user_id
+
+    # Невідомими лишаються лише повідомлення, що були в дорозі під час збою
+    assert len(unknown) <= BROADCAST_CONCURRENCY
+    # Кожен, хто не отримав повідомлення, є в звіті як unknown
+    assert all(statuses[user_id] == "unknown" for user_id in statuses if not received[user_id])
@@ -0,0 +1,105 @@
+"""
+Властивості розбору CRON виразів (services.cron)
+Наступний запуск порівнюється з повним перебором за хвилинами
+"""
+
+from datetime import date, datetime, timedelta
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from services.cron import CronError, parse_cron
+
+# Межі полів: хвилина, година, день місяця, місяць, день тижня
+BOUNDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+def field_strategy(low: int, high: int):
+    """(текст поля, множина значень) - *, список, діапазон або крок"""
+    values = st.integers(low, high)
+    return st.one_of(
+        st.just(("*", set(range(low, high + 1)))),
+        st.sets(values, min_size=1, max_size=5).map(
+            lambda chosen: (",".join(map(str, sorted(chosen))), chosen)
+        ),
+        st.tuples(values, values).map(sorted).map(
+            lambda pair: (f"{pair[0]}-{pair[1]}", set(range(pair[0], pair[1] + 1)))
+        ),
+        st.integers(1, high - low + 1).map(
+            lambda step: (f"*/{step}", set(range(low, high + 1, step)))
+        ),
+    )
+
+expressions = st.tuples(*(field_strategy(low, high) for low, high in BOUNDS))
+moments = st.datetimes(min_value=datetime(2000, 1, 1), max_value=datetime(2090, 12, 31))
+
+def day_matches(day: date, fields) -> bool:
+    """Класичний cron: якщо обидва поля днів обмежені, достатньо збігу будь-якого"""
+    (dom_text, doms), (_, months), (dow_text, dows) = fields[2], fields[3], fields[4]
+    if day.month not in months:
+        return False
+    in_dom = day.day in doms
+    in_dow = day.isoweekday() % 7 in dows
+    if dom_text.startswith("*") or dow_text.startswith("*"):
+        return in_dom and in_dow
+    return in_dom or in_dow
+
+def brute_force_next(fields, moment: datetime):
+    """Перший запуск після moment: перебір днів і всіх хвилин дозволених днів"""
+    minutes, hours = fields[0][1], fields[1][1]
+    start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    day = start.date()
+    while day.year <= moment.year + 9:
+        if day_matches(day, fields):
+            current = max(start, datetime.combine(day, datetime.min.time()))
+            while current.date() == day:
+                if current.hour in hours and current.minute in minutes:
+                    return current
+                current += timedelta(minutes=1)
+        day += timedelta(days=1)
+    return None
+
+@settings(max_examples=300, deadline=None)
+@given(expressions, moments)
+def test_next_fire_time_matches_brute_force(fields, moment):
+    text = " ".join(field_text for field_text, _ in fields)
+    try:
+        expression = parse_cron(text)
+    except CronError:
+        # Вираз, що ніколи не спрацює (30 лютого)
+        assert brute_force_next(fields, datetime(2000, 1, 1)) is None
+        return
+    assert expression.next_after(moment) == brute_force_next(fields, moment)
+
+@settings(max_examples=200, deadline=None)
+@given(
+    st.sets(st.integers(1, 31), min_size=1, max_size=4),
+    st.sets(st.integers(0, 6), min_size=1, max_size=3),
+    st.dates(min_value=date(2000, 1, 1), max_value=date(2090, 1, 1)),
+)
+def test_restricted_day_fields_are_ored(doms, dows, start):
+    expression = parse_cron(
+        f"0 0 {','.join(map(str, sorted(doms)))} * {','.join(map(str, sorted(dows)))}"
+    )
+    window = [start + timedelta(days=offset) for offset in range(1, 63)]
+    expected = [day for day in window if day.day in doms or day.isoweekday() % 7 in dows]
+    runs = expression.preview(len(expected), datetime.combine(start, datetime.min.time()))
+    assert [run.date() for run in runs] == expected
+
+@settings(max_examples=100, deadline=None)
+@given(st.sets(st.integers(1, 31), min_size=1, max_size=4), moments)
+def test_unrestricted_weekday_keeps_only_day_of_month(doms, moment):
+    expression = parse_cron(f"0 0 {','.join(map(str, sorted(doms)))} * *")
+    for run in expression.preview(5, moment):
+        assert run.day in doms
+
+@given(moments)
+def test_sunday_is_zero_and_seven(moment):
+    assert parse_cron("30 9 * * 0").next_after(moment) == parse_cron("30 9 * * 7").next_after(moment)
+    assert parse_cron("30 9 * * 0").next_after(moment).isoweekday() == 7
+
+@pytest.mark.parametrize("text", ["", "* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *",
+                                  "* * * 13 *", "* * * * 8", "*/0 * * * *", "5-1 * * * *",
+                                  "0 0 30 2 *", "0 0 31 4,6 *"])
+def test_invalid_expressions_are_rejected(text):
+    with pytest.raises(CronError):
+        parse_cron(text)
@@ -0,0 +1,53 @@
+"""
+Планувальник регулярних розсилок: дні тижня нумеруються як у стандартному cron
+(0 і 7 - неділя, 1 - понеділок), а не як у CronTrigger APScheduler (0 - понеділок)
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from config import TIMEZONE
+from services import scheduler as scheduler_module
+from services.scheduler import BroadcastScheduler
+
+CASES = [
+    ("30 9 * * 1", 1),      # понеділок
+    ("0 18 * * 5", 5),      # п'ятниця
+    ("0 12 * * 0", 7),      # неділя
+    ("0 12 * * 7", 7),      # неділя
+    ("0 8 * * sat", 6),     # субота
+]
+
+async def _schedule():
+    scheduler = BroadcastScheduler()
+    scheduler._scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+    scheduler._scheduler.start()
+    try:
+        runs = []
+        for recurring_id, (expression, _) in enumerate(CASES, start=1):
+            assert await scheduler.schedule_recurring(recurring_id, expression)
+            runs.append(scheduler._scheduler.get_job(f"recurring:{recurring_id}").next_run_time)
+        return runs
+    finally:
+        scheduler.shutdown()
+
+def test_recurring_weekdays_follow_standard_cron(monkeypatch):
+    stored = {}
+
+    async def update_recurring_schedule(recurring_id, next_run, mark_run=False):
+        stored[recurring_id] = next_run
+        return True
+
+    monkeypatch.setattr(scheduler_module, "update_recurring_schedule", update_recurring_schedule)
+    now = datetime.now(ZoneInfo(TIMEZONE))
+    runs = asyncio.run(_schedule())
+
+    for recurring_id, ((expression, isoweekday), next_run) in enumerate(zip(CASES, runs), start=1):
+        local = next_run.astimezone(ZoneInfo(TIMEZONE))
+        assert local.isoweekday() == isoweekday, expression
+        assert now < local <= now + timedelta(days=7), expression
+        # next_run в БД - той самий момент в UTC
+        assert stored[recurring_id] == local.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")